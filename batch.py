@@ -0,0 +1,186 @@
+"""
+Batch CLI: run a stream of API requests against one warm set of managers.
+
+Reads NDJSON from stdin (or --input), one request per line:
+
+    {"method": "create_user", "request": {"name": "ana", "display_name": "Ana"}, "id": "<optional tag>"}
+    {"method": "list_users"}
+    {"flush": true}
+
+and writes one NDJSON response per request line, in input order:
+
+    {"line": 1, "id": "<tag>", "method": "create_user", "response": {"id": "..."}}
+
+"request" can be an object or the json string the API method takes; methods
+without a request (list_users, list_teams) take none. A line that is not a
+request gets {"line": n, "error": "..."} and the run goes on.
+
+Requests are executed in batches, each batch in one storage.transaction(), so a
+collection touched by many requests is written once per batch. A batch ends
+after --batch-size requests, at a {"flush": true} line and at the end of the
+input; its responses are written once its changes are on disk. A request that
+raises is answered with an error: its transaction is rolled back, the requests
+before it run again and are committed on their own, and the batch goes on after
+it, so a request runs at most twice however many requests of its batch fail.
+
+Usage:
+    python -m batch [--db db] [-i requests.ndjson] [--batch-size 1000] [--durability strict]
+"""
+import argparse
+import inspect
+import json
+import os
+import sys
+
+import storage
+from user_base import UserBase
+from team_base import TeamBase
+from project_board_base import ProjectBoardBase
+
+BATCH_SIZE = 1000
+
+
+class _CallFailed(Exception):
+    def __init__(self, position, error):
+        super().__init__(error)
+        self.position = position
+        self.error = error
+
+
+class BatchRunner:
+    """
+    Executes request lines against the managers of one layout.
+    :param batch_size: requests per transaction
+    """
+
+    def __init__(self, layout=storage.DEFAULT_LAYOUT, batch_size=BATCH_SIZE):
+        self.layout = layout
+        self.batch_size = batch_size
+        self.methods = {}
+        for api in (UserBase(layout), TeamBase(layout), ProjectBoardBase(layout)):
+            for name, method in inspect.getmembers(api, inspect.ismethod):
+                if not name.startswith("_"):
+                    takes_request = len(inspect.signature(method).parameters) > 0
+                    self.methods[name] = (method, takes_request)
+        self.counts = {"requests": 0, "errors": 0, "batches": 0}
+
+    def run(self, lines, out):
+        """
+        Execute every line and write the responses to out.
+        :return: {"requests": <count>, "errors": <count>, "batches": <count>}
+        """
+        batch = []
+        for line_number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            entry, error = self._parse(line)
+            if error is None and entry.get("flush"):
+                self._flush(batch, out)
+                batch = []
+                continue
+            batch.append((line_number, entry, error))
+            if len(batch) >= self.batch_size:
+                self._flush(batch, out)
+                batch = []
+        self._flush(batch, out)
+        return dict(self.counts)
+
+    def _parse(self, line):
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            return None, "Invalid json"
+        if not isinstance(entry, dict):
+            return None, "A request line must be a json object"
+        if entry.get("flush"):
+            return entry, None
+        if entry.get("method") not in self.methods:
+            return None, f"Unknown method {entry.get('method')!r}"
+        return entry, None
+
+    def _flush(self, batch, out):
+        if not batch:
+            return
+        responses = [None] * len(batch)
+        pending = [position for position, (_, _, error) in enumerate(batch) if error is None]
+        failed_at = set()
+        start, stop = 0, len(pending)
+        while start < len(pending):
+            try:
+                with storage.transaction():
+                    for i in range(start, stop):
+                        if i not in failed_at:
+                            responses[pending[i]] = self._call(i, batch[pending[i]][1])
+            except _CallFailed as failed:
+                # the failed call may have left half a change behind: roll it all back and
+                # commit the calls before it on their own
+                failed_at.add(failed.position)
+                responses[pending[failed.position]] = json.dumps({"error": failed.error})
+                stop = failed.position
+                continue
+            # then go on after the failed call
+            start, stop = stop, len(pending)
+
+        for (line_number, entry, error), response in zip(batch, responses):
+            out.write(self._line(line_number, entry, error, response))
+        out.flush()
+        self.counts["batches"] += 1
+
+    def _call(self, position, entry):
+        method, takes_request = self.methods[entry["method"]]
+        request = entry.get("request")
+        try:
+            if not takes_request:
+                return method()
+            return method(request if isinstance(request, str) else json.dumps(request or {}))
+        except Exception as e:
+            raise _CallFailed(position, f"{type(e).__name__}: {e}")
+
+    def _line(self, line_number, entry, error, response):
+        self.counts["requests"] += 1
+        head = {"line": line_number}
+        if entry is not None:
+            if "id" in entry:
+                head["id"] = entry["id"]
+            head["method"] = entry["method"]
+        if error is not None:
+            self.counts["errors"] += 1
+            head["error"] = error
+            return json.dumps(head) + "\n"
+        if response.startswith('{"error'):
+            self.counts["errors"] += 1
+        # responses are json already; pretty-printed ones are compacted to stay on one line
+        if "\n" in response:
+            response = json.dumps(json.loads(response))
+        return json.dumps(head)[:-1] + ', "response": ' + response + "}\n"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run NDJSON API requests against one set of managers.")
+    parser.add_argument("--db", default=storage.DB_DIR, help="db folder, db by default")
+    parser.add_argument("-i", "--input", help="request file, stdin by default")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                        help=f"requests per transaction, {BATCH_SIZE} by default")
+    parser.add_argument("--durability", choices=storage.DURABILITY_MODES,
+                        help="storage durability mode, $PLANNER_DURABILITY or strict by default")
+    args = parser.parse_args(argv)
+
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+    if args.durability:
+        storage.set_durability(args.durability)
+
+    os.makedirs(args.db, exist_ok=True)
+    runner = BatchRunner(storage.Layout(args.db), args.batch_size)
+    source = open(args.input, "r", buffering=1 << 20) if args.input else sys.stdin
+    try:
+        counts = runner.run(source, sys.stdout)
+    finally:
+        if args.input:
+            source.close()
+    print(json.dumps(counts), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
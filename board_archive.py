@@ -0,0 +1,277 @@
+"""
+Cold archive of CLOSED boards.
+
+Boards closed longer than a given age are moved out of the hot board file into
+compressed, immutable segments (gzip or lzma) under db/archive/. A small archive
+index (db/archive/archive_index.json) maps every archived board id to its segment,
+so single-board reads such as export_board and list_tasks can still fetch an
+archived board on demand without the hot file carrying its history.
+
+Segments are written before the hot file is rewritten; if archiving is interrupted
+in between, a board can be in both places, the hot copy wins and the next run
+drops it from the hot file without archiving it twice.
+
+Usage:
+    python board_archive.py [--db db] [--days 30] [--compression gzip|lzma]
+"""
+import argparse
+import functools
+import gzip
+import json
+import lzma
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import storage
+
+ARCHIVE_DIR = "archive"
+ARCHIVE_INDEX_FILE = "archive_index.json"
+ARCHIVE_AFTER_DAYS = 30
+SEGMENT_BOARDS = 256
+
+_COMPRESSIONS = {
+    "gzip": (".json.gz", gzip.open),
+    "lzma": (".json.xz", lzma.open),
+}
+
+_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def archive_dir(layout=storage.DEFAULT_LAYOUT):
+    return os.path.join(layout.db_dir, ARCHIVE_DIR)
+
+
+def _open_segment(path, mode):
+    for extension, opener in _COMPRESSIONS.values():
+        if path.endswith(extension):
+            return opener(path, mode + "t", encoding="utf-8")
+    raise ValueError(f"Unknown archive segment {path}")
+
+
+# ------------------- archive index -------------------
+
+# index path -> (mtime_ns, size, data), re-read only when the file changed
+_index_cache = {}
+
+
+def load_archive_index(layout=storage.DEFAULT_LAYOUT):
+    """
+    :return: {"boards": {board_id: {"segment", "team_id", "board_name", "end_time", "assignees"}}}
+    ("assignees", the user ids of the board's tasks, is missing on boards archived by older versions)
+    """
+    path = os.path.join(archive_dir(layout), ARCHIVE_INDEX_FILE)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return {"boards": {}}
+
+    cached = _index_cache.get(path)
+    if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+    with open(path, "r") as f:
+        data = json.load(f)
+    _index_cache[path] = (stat.st_mtime_ns, stat.st_size, data)
+    return data
+
+
+def forget_archive_index(layout):
+    _index_cache.pop(os.path.join(archive_dir(layout), ARCHIVE_INDEX_FILE), None)
+
+
+def _save_archive_index(layout, data):
+    storage.replace_file(os.path.join(archive_dir(layout), ARCHIVE_INDEX_FILE),
+                         json.dumps(data, indent=2).encode("utf-8"))
+
+
+def is_archived(layout, board_id):
+    return board_id in load_archive_index(layout)["boards"]
+
+
+def archived_board_name_exists(layout, team_id, board_name):
+    return any(entry["team_id"] == team_id and entry["board_name"] == board_name
+               for entry in load_archive_index(layout)["boards"].values())
+
+
+# ------------------- reads -------------------
+
+@functools.lru_cache(maxsize=4)
+def _read_segment(path):
+    # segments are immutable once written, so they can be cached by path
+    with _open_segment(path, "r") as f:
+        return {board["id"]: board for board in json.load(f)}
+
+
+def load_board(layout, board_id):
+    """
+    :return: the archived board (with its tasks), or None if it is not archived
+    """
+    entry = load_archive_index(layout)["boards"].get(board_id)
+    if entry is None:
+        return None
+    board = _read_segment(os.path.join(archive_dir(layout), entry["segment"])).get(board_id)
+    return json.loads(json.dumps(board)) if board is not None else None
+
+
+def iter_archived_boards(layout=storage.DEFAULT_LAYOUT):
+    """Every archived board, segment by segment."""
+    segments = {}
+    for board_id, entry in load_archive_index(layout)["boards"].items():
+        segments.setdefault(entry["segment"], []).append(board_id)
+    for segment, board_ids in segments.items():
+        with _open_segment(os.path.join(archive_dir(layout), segment), "r") as f:
+            boards = {board["id"]: board for board in json.load(f)}
+        for board_id in board_ids:
+            yield boards[board_id]
+
+
+# ------------------- archiving -------------------
+
+def archive_closed_boards(layout=storage.DEFAULT_LAYOUT, older_than_days=ARCHIVE_AFTER_DAYS,
+                          compression="gzip", now=None):
+    """
+    Move the boards closed more than `older_than_days` ago to compressed segments.
+    :return: {"archived": <boards moved>, "segments": [<segment file names>], "hot_boards": <boards left>}
+    """
+    if compression not in _COMPRESSIONS:
+        raise ValueError(f"compression must be one of {', '.join(_COMPRESSIONS)}")
+    extension, opener = _COMPRESSIONS[compression]
+    cutoff = ((now or datetime.now()) - timedelta(days=older_than_days)).strftime(_TIME_FORMAT)
+
+    # the API must not add a task to a board while it is moved out of the hot file
+    with storage.locked(layout, "boards"):
+        try:
+            boards = storage.load_collection(layout.path("boards"))
+        except FileNotFoundError:
+            return {"archived": 0, "segments": [], "hot_boards": 0}
+
+        archive_index = load_archive_index(layout)
+        archived_ids = archive_index["boards"]
+        # end_time is a sortable "%Y-%m-%d %H:%M:%S" string
+        cold = [board for board in boards
+                if board.get("status") == "CLOSED" and isinstance(board.get("end_time"), str)
+                and board["end_time"] <= cutoff]
+        if not cold:
+            return {"archived": 0, "segments": [], "hot_boards": len(boards)}
+
+        os.makedirs(archive_dir(layout), exist_ok=True)
+        new_boards = [board for board in cold if board["id"] not in archived_ids]
+        segments = []
+        for start in range(0, len(new_boards), SEGMENT_BOARDS):
+            chunk = new_boards[start:start + SEGMENT_BOARDS]
+            segment = _write_segment(layout, chunk, extension, opener)
+            segments.append(segment)
+            for board in chunk:
+                archived_ids[board["id"]] = _index_entry(board, segment)
+        if segments:
+            _save_archive_index(layout, archive_index)
+
+        cold_ids = {board["id"] for board in cold}
+        hot = [board for board in boards if board["id"] not in cold_ids]
+        # the index picks up the smaller hot file on its next refresh
+        storage.save_collection(layout.path("boards"), hot)
+
+        return {"archived": len(cold), "segments": segments, "hot_boards": len(hot)}
+
+
+def _write_segment(layout, boards, extension, opener):
+    """:return: the file name of a new segment holding the boards"""
+    segment = f"boards-{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}{extension}"
+    path = os.path.join(archive_dir(layout), segment)
+    with opener(path + ".tmp", "wt", encoding="utf-8") as f:
+        json.dump(boards, f)
+    os.replace(path + ".tmp", path)
+    return segment
+
+
+def _index_entry(board, segment):
+    return {
+        "segment": segment,
+        "team_id": board.get("team_id"),
+        "board_name": board.get("board_name"),
+        "end_time": board["end_time"],
+        "assignees": sorted({task["user_id"] for task in board.get("tasks", []) if task.get("user_id")}),
+    }
+
+
+def _remove_unused_segments(layout, archive_index, segments):
+    still_used = {entry["segment"] for entry in archive_index["boards"].values()}
+    for segment in segments - still_used:
+        os.remove(os.path.join(archive_dir(layout), segment))
+    _read_segment.cache_clear()
+
+
+def reassign_archived_tasks(layout, tasks):
+    """
+    Give archived tasks to other assignees. Segments are immutable: the boards
+    holding the tasks are written to a new segment, with the compression of the
+    segment they come from, and their old segments are removed once unused.
+    :param tasks: {board_id: {task_id: new user id, or None to leave the task unassigned}}
+    :return: number of tasks reassigned
+    """
+    archive_index = load_archive_index(layout)
+    archived_ids = archive_index["boards"]
+    by_compression = {}
+    for board_id, assignees in tasks.items():
+        entry = archived_ids.get(board_id)
+        if entry is None:
+            continue
+        compression = next(pair for pair in _COMPRESSIONS.values() if entry["segment"].endswith(pair[0]))
+        by_compression.setdefault(compression, []).append((load_board(layout, board_id), assignees))
+    if not by_compression:
+        return 0
+
+    reassigned = 0
+    old_segments = set()
+    for (extension, opener), boards in by_compression.items():
+        for board, assignees in boards:
+            for task in board.get("tasks", []):
+                if task["id"] in assignees:
+                    task["user_id"] = assignees[task["id"]]
+                    reassigned += 1
+        segment = _write_segment(layout, [board for board, _ in boards], extension, opener)
+        for board, _ in boards:
+            old_segments.add(archived_ids[board["id"]]["segment"])
+            archived_ids[board["id"]] = _index_entry(board, segment)
+    _save_archive_index(layout, archive_index)
+    _remove_unused_segments(layout, archive_index, old_segments)
+    return reassigned
+
+
+def delete_archived_boards(layout, board_ids):
+    """
+    Delete archived boards: they leave the archive index, so no read finds them again.
+    Segments are immutable, a segment is only removed once none of its boards is left.
+    :return: number of boards deleted
+    """
+    archive_index = load_archive_index(layout)
+    archived_ids = archive_index["boards"]
+    segments = {archived_ids[board_id]["segment"] for board_id in board_ids if board_id in archived_ids}
+    if not segments:
+        return 0
+    deleted = 0
+    for board_id in board_ids:
+        if archived_ids.pop(board_id, None) is not None:
+            deleted += 1
+    _save_archive_index(layout, archive_index)
+    _remove_unused_segments(layout, archive_index, segments)
+    return deleted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move old CLOSED boards to the compressed archive.")
+    parser.add_argument("--db", default=storage.DB_DIR, help="db folder, db by default")
+    parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS,
+                        help=f"archive boards closed more than this many days ago, {ARCHIVE_AFTER_DAYS} by default")
+    parser.add_argument("--compression", choices=sorted(_COMPRESSIONS), default="gzip")
+    args = parser.parse_args(argv)
+
+    result = archive_closed_boards(storage.Layout(args.db), args.days, args.compression)
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
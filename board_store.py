@@ -0,0 +1,297 @@
+"""
+Bounded-memory access to the boards collection.
+
+By default every board call parses the whole boards file and rewrites it. A
+BoardStore, enabled per layout with enable(), keeps only the board metadata
+(the records without their tasks) and the byte range of every board in the file
+resident. A board's tasks are read from its byte range on first access into an
+LRU bounded by task count and bytes; boards changed through the store stay in
+memory, marked dirty, until they are written back.
+
+A write-back rewrites the file once for all dirty boards: the dirty ones are
+encoded again, every other board is copied byte for byte from the current file.
+It happens when a dirty board is evicted, before anything else reads or rewrites
+the boards collection (storage.set_barrier), before the index sidecar is saved,
+and at exit. If another process rewrote the file in the meantime, it is scanned
+again first: its version of every board not dirty here is kept, the dirty boards
+replace its version of the same boards.
+
+The store does not follow the durability mode: a call returns once its board is
+changed in memory, and the change reaches the disk with the next write-back, so
+even in strict mode a crash loses the changes not written back yet. Call
+write_back() (or storage.flush() through the barrier) where that matters.
+
+create_board, close_board, add_task, update_task_status and export_board use the
+store of their layout when it is enabled and no transaction is open; every other
+call reads the collection as usual, after the write-back.
+"""
+import atexit
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import storage
+import index_store
+
+MAX_TASKS = 100000
+MAX_BYTES = 64 * 1024 * 1024
+
+# estimated bytes in memory per byte of a board's encoded record
+_MEMORY_FACTOR = 4
+
+
+class BoardStore:
+    """
+    :param max_tasks: most tasks kept in memory
+    :param max_bytes: most (estimated) bytes of boards kept in memory
+    """
+
+    def __init__(self, layout=storage.DEFAULT_LAYOUT, max_tasks=MAX_TASKS, max_bytes=MAX_BYTES):
+        self.layout = layout
+        self.path = layout.path("boards")
+        self.max_tasks = max_tasks
+        self.max_bytes = max_bytes
+        self.lock = threading.RLock()
+        self.meta = {}               # board_id -> board record without "tasks", in file order
+        self.spans = {}              # board_id -> (start, end) in the file, missing for new boards
+        self.cache = OrderedDict()   # board_id -> full board record, least recently used first
+        self.sizes = {}              # board_id -> (task count, estimated bytes) of a cached board
+        self.cached_tasks = 0
+        self.cached_bytes = 0
+        self.dirty = set()
+        self.checksum = None
+        self.codec = None
+        self.file = None
+        self.loads = 0
+        self.hits = 0
+        self.evictions = 0
+        self.write_backs = 0
+
+    # ------------------- file -------------------
+
+    def _check(self):
+        """Rescan the file if it is not the one the spans point into."""
+        checksum = storage.file_checksum(self.path)
+        if self.file is not None and checksum == self.checksum:
+            return
+        if self.dirty:
+            # changed by another process: written back over its version, see write_back()
+            self.write_back()
+            return
+        self._scan()
+
+    def _scan(self):
+        self._close_file()
+        self.meta, self.spans = {}, {}
+        self.cache.clear()
+        self.sizes.clear()
+        self.cached_tasks = self.cached_bytes = 0
+        # saves still pending in relaxed mode must be in the file that is opened
+        storage.flush()
+        self.file = open(self.path, "rb")
+        self.checksum = storage.file_checksum(self.path)
+        self.codec = storage.file_codec(self.path)
+        for board, start, end in storage.iter_collection_spans(self.path):
+            board.pop("tasks", None)
+            self.meta[board["id"]] = board
+            self.spans[board["id"]] = (start, end)
+
+    def _close_file(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def write_back(self):
+        """Write the dirty boards to the file."""
+        with self.lock:
+            if not self.dirty:
+                return
+            if self.file is not None and storage.file_checksum(self.path) != self.checksum:
+                self._rescan_keeping_dirty()
+            index = index_store.loaded_index(self.layout)
+            in_sync = index is not None and index.checksums.get("boards") == self.checksum
+
+            tmp_path = storage.temporary_path(self.path, ".writeback")
+            try:
+                writer = storage.CollectionWriter(tmp_path, codec=self.codec)
+                spans = {}
+                for board_id in self.meta:
+                    if board_id in self.dirty or board_id not in self.spans:
+                        spans[board_id] = writer.write(self.cache[board_id])
+                    else:
+                        start, end = self.spans[board_id]
+                        spans[board_id] = writer.write_raw(os.pread(self.file.fileno(), end - start, start))
+                writer.close()
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+            self._close_file()
+            self.file = open(self.path, "rb")
+            self.spans = spans
+            self.dirty.clear()
+            self.checksum = storage.file_checksum(self.path)
+            self.write_backs += 1
+            if in_sync:
+                # the index already holds the changes written now
+                index.checksums["boards"] = self.checksum
+                index.dirty = True
+            storage.notify_write(self.path)
+            self._evict()
+
+    def _rescan_keeping_dirty(self):
+        """Scan a file another process rewrote, keeping the dirty boards on top of it."""
+        dirty = [(board_id, self.cache[board_id], self.sizes[board_id][1]) for board_id in self.dirty]
+        self._scan()
+        for board_id, board, size in dirty:
+            # a board the other process deleted is added back at the end
+            self.meta[board_id] = {key: value for key, value in board.items() if key != "tasks"}
+            self._cache(board_id, board, size)
+
+    # ------------------- boards -------------------
+
+    def boards(self):
+        """:return: the metadata of every board (records without tasks), in file order"""
+        with self.lock:
+            self._check()
+            return list(self.meta.values())
+
+    def get(self, board_id):
+        """
+        :return: the board record with its tasks, None if there is no such board.
+        Changes to it must be followed by mark_dirty(board_id).
+        Raises FileNotFoundError when the boards collection does not exist.
+        """
+        with self.lock:
+            self._check()
+            board = self.cache.get(board_id)
+            if board is not None:
+                self.cache.move_to_end(board_id)
+                self.hits += 1
+                return board
+            span = self.spans.get(board_id)
+            if span is None:
+                return None
+            board = storage.read_span(self.file, span[0], span[1], self.codec)
+            self.loads += 1
+            self._cache(board_id, board, (span[1] - span[0]) * _MEMORY_FACTOR)
+            self._evict(keep=board_id)
+            return board
+
+    def mark_dirty(self, board_id, added_task=None):
+        """
+        Record that the board returned by get() was changed.
+        :param added_task: the task appended to the board, if any. The board's size
+        estimate grows by that task only, so a change costs O(task) and not O(board);
+        changes of fields in place (status, end_time) keep the estimate.
+        """
+        with self.lock:
+            board = self.cache[board_id]
+            self.meta[board_id] = {key: value for key, value in board.items() if key != "tasks"}
+            self.dirty.add(board_id)
+            size = self.sizes[board_id][1]
+            if added_task is not None:
+                size += len(json.dumps(added_task)) * _MEMORY_FACTOR
+            self._cache(board_id, board, size)
+            storage.notify_write(self.path)
+            self._evict(keep=board_id)
+
+    def add_board(self, board):
+        """Add a new board; the first board of a missing file is written at once."""
+        with self.lock:
+            try:
+                self._check()
+            except FileNotFoundError:
+                self.file = None
+            self.meta[board["id"]] = {key: value for key, value in board.items() if key != "tasks"}
+            self._cache(board["id"], board, len(json.dumps(board)) * _MEMORY_FACTOR)
+            self.dirty.add(board["id"])
+            if self.file is None:
+                self.codec = storage.codec_for(self.path)
+                self.write_back()
+            else:
+                storage.notify_write(self.path)
+                self._evict(keep=board["id"])
+
+    def _cache(self, board_id, board, size):
+        tasks, old_size = self.sizes.pop(board_id, (0, 0))
+        self.cached_tasks -= tasks
+        self.cached_bytes -= old_size
+        self.cache[board_id] = board
+        self.cache.move_to_end(board_id)
+        self.sizes[board_id] = (len(board.get("tasks", [])), size)
+        self.cached_tasks += self.sizes[board_id][0]
+        self.cached_bytes += size
+
+    def _evict(self, keep=None):
+        while self.cached_tasks > self.max_tasks or self.cached_bytes > self.max_bytes:
+            board_id = next((board_id for board_id in self.cache if board_id != keep), None)
+            if board_id is None:
+                return
+            if board_id in self.dirty:
+                # writes every dirty board, after which they can all be dropped
+                self.write_back()
+                continue
+            del self.cache[board_id]
+            tasks, size = self.sizes.pop(board_id)
+            self.cached_tasks -= tasks
+            self.cached_bytes -= size
+            self.evictions += 1
+
+    def close(self):
+        with self.lock:
+            self.write_back()
+            self._close_file()
+            self.cache.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "boards": len(self.meta),
+                "cached_boards": len(self.cache),
+                "cached_tasks": self.cached_tasks,
+                "cached_bytes": self.cached_bytes,
+                "dirty": len(self.dirty),
+                "loads": self.loads,
+                "hits": self.hits,
+                "evictions": self.evictions,
+                "write_backs": self.write_backs,
+            }
+
+
+# layout key -> BoardStore
+_stores = {}
+
+
+def enable(layout=storage.DEFAULT_LAYOUT, max_tasks=MAX_TASKS, max_bytes=MAX_BYTES):
+    """Serve the board calls of a layout from a BoardStore; :return: the store"""
+    store = _stores.get(layout.key)
+    if store is None:
+        store = BoardStore(layout, max_tasks, max_bytes)
+        _stores[layout.key] = store
+        storage.set_barrier(store.path, store.write_back)
+    return store
+
+
+def get_store(layout):
+    """:return: the BoardStore of a layout, None when it is not enabled or a transaction is open"""
+    if storage.current_transaction() is not None:
+        return None
+    return _stores.get(layout.key)
+
+
+def close_store(layout):
+    """Write back and drop the BoardStore of a layout, if it has one."""
+    store = _stores.pop(layout.key, None)
+    if store is not None:
+        store.close()
+        storage.clear_barrier(store.path)
+
+
+@atexit.register
+def _write_back_all():
+    for store in list(_stores.values()):
+        store.write_back()
@@ -0,0 +1,261 @@
+"""
+Opt-in profiling of single API calls, to see whether a slow call goes to
+parsing, scanning or serializing.
+
+Wrap the managers with a CallProfiler (main.py does it when
+PLANNER_PROFILE=<directory> is set)
+
+    profiler = CallProfiler("profiles", sample_rate=0.01, slow_ms=250)
+    board_api = profiler.wrap(ProjectBoardBase())
+
+and the calls it picks run under cProfile and tracemalloc. A call is captured
+when it is sampled (sample_rate of the calls), or when it follows a slow call of
+the same method: a call is only known to be slow once it returned, so a call
+over slow_ms arms its method and the next call of that method is captured. A
+method is armed at most once per cooldown_seconds, so a method that is always
+slow is not captured call after call. Every capture writes two files to the
+directory:
+
+    <method>-<ms since epoch>-<pid>-<n>.prof   cProfile stats, for pstats or snakeviz
+    <method>-<ms since epoch>-<pid>-<n>.json   {"api", "method", "request_bytes", "ms", "trigger",
+                                               "peak_bytes", "allocations": [{"where", "bytes", "count"}]}
+
+"allocations" are the largest blocks allocated during the call and still alive
+when it returned (the response, caches it filled), "peak_bytes" the peak traced
+memory of the call. One call is captured at a time; a call arriving while
+another is captured runs without profiling.
+
+The report aggregates the captures of a directory per API method: the hottest
+functions over all its captures and its largest allocations.
+
+Usage:
+    PLANNER_PROFILE=profiles [PLANNER_PROFILE_SAMPLE=0.01] [PLANNER_PROFILE_SLOW_MS=250] \
+        [PLANNER_PROFILE_COOLDOWN_S=60] python main.py
+    python call_profiler.py profiles [--top 15] [--method add_task]
+"""
+import argparse
+import cProfile
+import glob
+import json
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import tracemalloc
+
+PROFILE_ENV = "PLANNER_PROFILE"
+SAMPLE_ENV = "PLANNER_PROFILE_SAMPLE"
+SLOW_MS_ENV = "PLANNER_PROFILE_SLOW_MS"
+COOLDOWN_ENV = "PLANNER_PROFILE_COOLDOWN_S"
+
+SAMPLE_RATE = 0.01
+SLOW_MS = 250
+COOLDOWN_SECONDS = 60
+TOP_ALLOCATIONS = 20
+TRACEBACK_FRAMES = 1
+
+_IGNORED_FILES = (__file__, tracemalloc.__file__, cProfile.__file__, "<frozen importlib._bootstrap>")
+
+
+class CallProfiler:
+    """
+    Captures sampled and slow calls of the wrapped managers; shared by all of them.
+    :param sample_rate: fraction of the calls captured, 0 for none
+    :param slow_ms: latency that arms the next call of a method, None to only sample
+    :param cooldown_seconds: least time between two arming of the same method
+    """
+
+    def __init__(self, directory, sample_rate=SAMPLE_RATE, slow_ms=SLOW_MS, cooldown_seconds=COOLDOWN_SECONDS):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.cooldown_seconds = cooldown_seconds
+        self.armed = {}  # method -> latency of the slow call that armed it
+        self.last_armed = {}  # method -> time.monotonic() it was last armed
+        self.lock = threading.Lock()
+        self.capturing = threading.Lock()
+        self.sequence = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def wrap(self, api):
+        return _ProfilingProxy(api, self)
+
+    def call(self, api_name, method, function, args):
+        with self.lock:
+            armed_ms = self.armed.pop(method, None)
+        if armed_ms is not None:
+            trigger = {"trigger": "slow", "after_ms": armed_ms}
+        elif self.sample_rate and random.random() < self.sample_rate:
+            trigger = {"trigger": "sample"}
+        else:
+            trigger = None
+
+        if trigger is None or not self.capturing.acquire(blocking=False):
+            clock = time.perf_counter()
+            response = function(*args)
+            self._observe(method, (time.perf_counter() - clock) * 1000)
+            return response
+        try:
+            return self._capture(api_name, method, function, args, trigger)
+        finally:
+            self.capturing.release()
+
+    def _observe(self, method, elapsed_ms):
+        if self.slow_ms is None or elapsed_ms <= self.slow_ms:
+            return
+        now = time.monotonic()
+        with self.lock:
+            if now - self.last_armed.get(method, -self.cooldown_seconds) >= self.cooldown_seconds:
+                self.armed[method] = round(elapsed_ms, 3)
+                self.last_armed[method] = now
+
+    def _capture(self, api_name, method, function, args, trigger):
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(TRACEBACK_FRAMES)
+        tracemalloc.reset_peak()
+        profile = cProfile.Profile()
+        clock = time.perf_counter()
+        profile.enable()
+        try:
+            response = function(*args)
+        finally:
+            profile.disable()
+            elapsed_ms = (time.perf_counter() - clock) * 1000
+            peak = tracemalloc.get_traced_memory()[1]
+            snapshot = tracemalloc.take_snapshot()
+            if started_tracing:
+                tracemalloc.stop()
+
+        snapshot = snapshot.filter_traces([tracemalloc.Filter(False, name) for name in _IGNORED_FILES])
+        allocations = [{
+            "where": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+            "bytes": stat.size,
+            "count": stat.count,
+        } for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]]
+
+        with self.lock:
+            self.sequence += 1
+            name = f"{method}-{int(time.time() * 1000)}-{os.getpid()}-{self.sequence}"
+        path = os.path.join(self.directory, name)
+        profile.dump_stats(path + ".prof")
+        entry = dict(trigger, **{
+            "api": api_name,
+            "method": method,
+            "request_bytes": sum(len(arg) for arg in args if isinstance(arg, str)),
+            "ms": round(elapsed_ms, 3),
+            "slow": self.slow_ms is not None and elapsed_ms > self.slow_ms,
+            "peak_bytes": peak,
+            "allocations": allocations,
+        })
+        with open(path + ".json", "w") as f:
+            json.dump(entry, f, indent=2)
+        return response
+
+
+class _ProfilingProxy:
+    def __init__(self, api, profiler):
+        self._api = api
+        self._profiler = profiler
+
+    def __getattr__(self, name):
+        attribute = getattr(self._api, name)
+        if name.startswith("_") or not callable(attribute):
+            return attribute
+
+        # the api may already be wrapped, e.g. by a request_trace recorder
+        api = self._api
+        while hasattr(api, "_api"):
+            api = api._api
+        api_name = type(api).__name__
+
+        def call(*args):
+            return self._profiler.call(api_name, name, attribute, args)
+        return call
+
+
+def wrap_from_env(*apis):
+    """
+    :return: the apis wrapped in a CallProfiler writing to $PLANNER_PROFILE, or unchanged if it is not set
+    """
+    directory = os.environ.get(PROFILE_ENV)
+    if not directory:
+        return apis
+    slow_ms = os.environ.get(SLOW_MS_ENV, str(SLOW_MS))
+    profiler = CallProfiler(directory, float(os.environ.get(SAMPLE_ENV, SAMPLE_RATE)),
+                            float(slow_ms) if slow_ms else None,
+                            float(os.environ.get(COOLDOWN_ENV, COOLDOWN_SECONDS)))
+    return tuple(profiler.wrap(api) for api in apis)
+
+
+# ------------------- report -------------------
+
+def report(directory, top=15, method=None):
+    """
+    Aggregate the captures of a directory per API method.
+    :return: {method: {"captures", "slow", "max_ms", "max_peak_bytes",
+                       "functions": [{"function", "calls", "self_ms", "cumulative_ms"}],
+                       "allocations": [{"where", "bytes", "count"}]}}, functions by self time,
+             allocations by bytes, both summed over the captures
+    """
+    captures = {}
+    for path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+        except (ValueError, OSError):
+            continue
+        if method and entry.get("method") != method:
+            continue
+        captures.setdefault(entry["method"], []).append((path[:-len(".json")] + ".prof", entry))
+
+    result = {}
+    for name, entries in sorted(captures.items()):
+        profiles = [prof for prof, _ in entries if os.path.exists(prof)]
+        functions = []
+        if profiles:
+            stats = pstats.Stats(*profiles).stats
+            hottest = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:top]
+            functions = [{
+                "function": f"{os.path.basename(filename)}:{line}({function})",
+                "calls": calls,
+                "self_ms": round(self_time * 1000, 3),
+                "cumulative_ms": round(cumulative * 1000, 3),
+            } for (filename, line, function), (_, calls, self_time, cumulative, _) in hottest]
+
+        allocations = {}
+        for _, entry in entries:
+            for allocation in entry.get("allocations", []):
+                total = allocations.setdefault(allocation["where"], {"where": allocation["where"], "bytes": 0, "count": 0})
+                total["bytes"] += allocation["bytes"]
+                total["count"] += allocation["count"]
+
+        result[name] = {
+            "captures": len(entries),
+            "slow": sum(1 for _, entry in entries if entry.get("slow")),
+            "max_ms": max(entry["ms"] for _, entry in entries),
+            "max_request_bytes": max(entry.get("request_bytes", 0) for _, entry in entries),
+            "max_peak_bytes": max(entry.get("peak_bytes", 0) for _, entry in entries),
+            "functions": functions,
+            "allocations": sorted(allocations.values(), key=lambda total: total["bytes"], reverse=True)[:top],
+        }
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize the calls captured with PLANNER_PROFILE.")
+    parser.add_argument("directory", help="capture directory")
+    parser.add_argument("--top", type=int, default=15, help="functions and allocations listed per method, 15 by default")
+    parser.add_argument("--method", help="only this API method")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.directory):
+        parser.error(f"{args.directory} is not a directory")
+    print(json.dumps(report(args.directory, args.top, args.method), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+"""
+Board-side work of the cascading deletes (UserBase.delete_user, TeamBase.delete_team,
+ProjectBoardBase.delete_board) and the tombstone log they write.
+
+The records a delete affects are found through the reverse indexes of the
+ProjectIndex (team memberships and admins, team -> boards, board -> tasks) and of
+the workload index (assignee -> tasks), so working out a delete costs
+O(affected records); a dry run stops there. Archived boards are found through
+the assignees and teams listed in the archive index, only the boards listing
+the assignee are read. A delete then runs in one storage.transaction(), writing
+each touched collection once; the archive is rewritten when it commits.
+
+Every committed delete appends one line to db/tombstones.ndjson:
+    {"type": "user | team | board", "id": "<id>", "deleted_at": "<date:time>", "impact": {...}}
+The collections drop deleted records for good, but the append-only stores keep
+them: the status history columns and the immutable archive segments. The log is
+what tells a reader of those (or a replica following the db) that an id is gone.
+"""
+import json
+from datetime import datetime
+
+import storage
+import board_archive
+
+TOMBSTONES_FILE = "tombstones.ndjson"
+
+
+def tombstones_path(layout=storage.DEFAULT_LAYOUT):
+    return layout.side_file(TOMBSTONES_FILE)
+
+
+def record_tombstone(layout, record_type, record_id, impact):
+    """Append a tombstone, once the transaction in progress (if any) commits."""
+    txn = storage.current_transaction()
+    if txn is not None:
+        txn.after_commit(lambda: record_tombstone(layout, record_type, record_id, impact))
+        return
+    entry = {
+        "type": record_type,
+        "id": record_id,
+        "deleted_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "impact": impact,
+    }
+    with open(tombstones_path(layout), "a") as f:
+        f.write(json.dumps(entry) + "\n")
+
+
+def iter_tombstones(layout=storage.DEFAULT_LAYOUT):
+    """Every tombstone, oldest first."""
+    try:
+        with open(tombstones_path(layout), "r") as f:
+            for line in f:
+                # a line cut short by a crash is not a tombstone
+                if line.endswith("\n"):
+                    yield json.loads(line)
+    except FileNotFoundError:
+        return
+
+
+def team_archived_boards(layout, team_id):
+    """:return: ids of the archived boards of a team"""
+    return [board_id for board_id, entry in board_archive.load_archive_index(layout)["boards"].items()
+            if entry["team_id"] == team_id]
+
+
+def archived_tasks_of(layout, assignee, exclude=()):
+    """
+    :param exclude: ids of boards to leave out
+    :return: {board_id: [task_id]} of the archived tasks assigned to assignee
+    """
+    found = {}
+    for board_id, entry in board_archive.load_archive_index(layout)["boards"].items():
+        # boards archived by older versions do not list their assignees, they are read to find out
+        if board_id in exclude or assignee not in entry.get("assignees", (assignee,)):
+            continue
+        board = board_archive.load_board(layout, board_id)
+        task_ids = [task["id"] for task in board.get("tasks", []) if task.get("user_id") == assignee]
+        if task_ids:
+            found[board_id] = task_ids
+    return found
+
+
+def reassignment(layout, index, task_ids, archived_tasks, assignee):
+    """
+    Work out who gets the tasks of a deleted user: assignee on the boards of the
+    teams it can be assigned on (ProjectIndex.team_assignees), nobody elsewhere.
+    :param task_ids: ids of the hot tasks
+    :param archived_tasks: {board_id: [task_id]} of the archived tasks
+    :param assignee: user id, or None to leave every task unassigned
+    :return: ({task_id: new user id}, {board_id: {task_id: new user id}}, number of tasks given to assignee)
+    """
+    archived_teams = board_archive.load_archive_index(layout)["boards"] if archived_tasks else {}
+    allowed = {}
+
+    def new_user(team_id):
+        if assignee is None:
+            return None
+        if team_id not in allowed:
+            allowed[team_id] = assignee in index.team_assignees(team_id)
+        return assignee if allowed[team_id] else None
+
+    hot = {task_id: new_user(index.board_by_id.get(index.task_board.get(task_id))) for task_id in task_ids}
+    archived = {}
+    for board_id, board_task_ids in archived_tasks.items():
+        user_id = new_user(archived_teams[board_id]["team_id"])
+        archived[board_id] = dict.fromkeys(board_task_ids, user_id)
+    given = sum(1 for user_id in hot.values() if user_id is not None)
+    given += sum(1 for tasks in archived.values() for user_id in tasks.values() if user_id is not None)
+    return hot, archived, given
+
+
+def count_tasks(layout, index, board_ids):
+    """:return: number of tasks on the boards, hot ones counted from the index"""
+    count = 0
+    for board_id in board_ids:
+        if board_id in index.board_by_id:
+            count += len(index.board_tasks(board_id))
+        else:
+            board = board_archive.load_board(layout, board_id)
+            count += len(board.get("tasks", [])) if board else 0
+    return count
+
+
+def apply(layout, index, drop_boards=(), reassign=None, reassign_archived=None):
+    """
+    Change the boards collection for a delete; call it inside a transaction.
+    :param drop_boards: ids of the boards to delete, hot or archived
+    :param reassign: {task_id: new user id, None leaves the task unassigned}
+    :param reassign_archived: {board_id: {task_id: new user id}} of archived tasks
+    """
+    drop = set(drop_boards)
+    reassign = reassign or {}
+    hot_drop = {board_id for board_id in drop if board_id in index.board_by_id}
+    touched = {index.task_board[task_id] for task_id in reassign if task_id in index.task_board} - drop
+
+    if hot_drop or touched:
+        boards = storage.load_collection(layout.path("boards"))
+        kept = []
+        for board in boards:
+            if board["id"] in hot_drop:
+                index.remove_board(board)
+                continue
+            kept.append(board)
+            if board["id"] in touched:
+                for task in board.get("tasks", []):
+                    if task["id"] in reassign:
+                        task["user_id"] = reassign[task["id"]]
+                        index.update_task(board["id"], task)
+        storage.save_collection(layout.path("boards"), kept)
+        index.synced("boards")
+
+    archived = drop - hot_drop
+    if archived:
+        _after_commit(lambda: board_archive.delete_archived_boards(layout, archived))
+    if reassign_archived:
+        _after_commit(lambda: board_archive.reassign_archived_tasks(layout, reassign_archived))
+
+
+def _after_commit(func):
+    txn = storage.current_transaction()
+    if txn is not None:
+        txn.after_commit(func)
+    else:
+        func()
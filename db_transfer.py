@@ -0,0 +1,295 @@
+"""
+Streaming NDJSON dump and load of a whole db folder, for moving data between environments.
+
+The dump is one JSON object per line, users first, then teams, then every board
+(archived boards included) followed by its tasks:
+    {"type": "user", "record": {...}}
+    {"type": "team", "record": {...}}
+    {"type": "board", "record": {<board without tasks>}, "tasks": <task count>}
+    {"type": "task", "board_id": "<board_id>", "record": {...}}
+
+Both directions work one record at a time (a board is read whole on dump, but its
+tasks are streamed on load), so memory does not grow with the size of the data.
+Load validates every record with the fsck checks (tasks written by older versions,
+assigned to a team or with an old status spelling, are migrated rather than
+rejected), builds the index sidecar as it goes and writes the target collections
+through large buffered writers; the target files only replace existing ones once
+the whole stream was loaded. The stores describing the replaced data go with it:
+the archive (its boards are in the dump), the status history (seeded again from
+the loaded tasks on first use), the idempotency keys and the tombstones.
+
+Usage:
+    python db_transfer.py dump [--db db] [-o dump.ndjson]
+    python db_transfer.py load [--db db] [-i dump.ndjson] [--strict] [--force] [--no-index]
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+
+import storage
+import index_store
+import board_archive
+import cascade
+import idempotency
+import status_history
+import search_index  # registers its board index, so the sidecar written on load includes it
+import workload_index  # same
+from fsck import Checker
+
+_SECTIONS = ("user", "team", "board")
+
+
+class LoadError(Exception):
+    pass
+
+
+def dump(db_dir=storage.DB_DIR, out=sys.stdout):
+    """
+    Write every record of db_dir to `out` as NDJSON.
+    :return: {"users": <count>, "teams": <count>, "boards": <count>, "tasks": <count>}
+    """
+    counts = {"users": 0, "teams": 0, "boards": 0, "tasks": 0}
+    for collection, record_type in (("users", "user"), ("teams", "team")):
+        for record in _iter(storage.collection_path(collection, db_dir)):
+            out.write(json.dumps({"type": record_type, "record": record}) + "\n")
+            counts[collection] += 1
+
+    hot_ids = set()
+    for board in _iter(storage.collection_path("boards", db_dir)):
+        hot_ids.add(board["id"])
+        _dump_board(board, out, counts)
+    # archived boards are loaded back into the hot file; a board caught in both places is dumped once
+    for board in board_archive.iter_archived_boards(storage.Layout(db_dir)):
+        if board["id"] not in hot_ids:
+            _dump_board(board, out, counts)
+    return counts
+
+
+def _dump_board(board, out, counts):
+    tasks = board.pop("tasks", [])
+    out.write(json.dumps({"type": "board", "record": board, "tasks": len(tasks)}) + "\n")
+    counts["boards"] += 1
+    for task in tasks:
+        out.write(json.dumps({"type": "task", "board_id": board["id"], "record": task}) + "\n")
+        counts["tasks"] += 1
+
+
+def _iter(path):
+    try:
+        yield from storage.iter_collection(path)
+    except FileNotFoundError:
+        return
+
+
+class _Loader:
+    def __init__(self, db_dir, strict, build_index):
+        self.layout = storage.Layout(db_dir)
+        self.strict = strict
+        self.checker = Checker(migrate=True)
+        self.index = index_store.ProjectIndex(self.layout) if build_index else None
+        self.writers = {
+            name: storage.CollectionWriter(self._tmp_path(name), buffer_size=8 << 20,
+                                           codec=storage.codec_for(self.layout.path(name)))
+            for name in storage.COLLECTION_FILES
+        }
+        self.counts = {"users": 0, "teams": 0, "boards": 0, "tasks": 0}
+        self.rejected = 0
+        self.section = 0
+        self.board = None
+        self.board_kept = False
+        self.list_open = False
+        self.tasks_left = 0
+        self.titles = set()
+
+    def _tmp_path(self, name):
+        return self.layout.path(name) + ".loading"
+
+    def load(self, lines):
+        try:
+            for line_number, line in enumerate(lines, start=1):
+                if line.strip():
+                    self._load_line(line_number, line)
+            self._end_board(None)
+        except BaseException:
+            self._discard()
+            raise
+
+        for writer in self.writers.values():
+            writer.close()
+        # a dirty index of this process is saved now rather than over the new sidecar at exit
+        index_store.close_index(self.layout)
+        for name in storage.COLLECTION_FILES:
+            os.replace(self._tmp_path(name), self.layout.path(name))
+        self._reset_side_stores()
+
+        if self.index is not None:
+            for name in storage.COLLECTION_FILES:
+                self.index.checksums[name] = storage.file_checksum(self.layout.path(name))
+            index_store.save_index(self.index)
+
+        return {
+            "loaded": self.counts,
+            "rejected": self.rejected,
+            "report": self.checker.report.to_json(),
+        }
+
+    def _reset_side_stores(self):
+        """
+        Drop the stores that describe the replaced data: archived boards would be there
+        twice, and a remembered response would name ids that no longer exist.
+        """
+        shutil.rmtree(board_archive.archive_dir(self.layout), ignore_errors=True)
+        shutil.rmtree(os.path.join(self.layout.db_dir, status_history.HISTORY_DIR), ignore_errors=True)
+        side_files = [self.layout.side_file(idempotency.KEYS_FILE), cascade.tombstones_path(self.layout)]
+        if self.index is None:
+            side_files.append(self.layout.side_file(index_store.SIDECAR_FILE))
+        for path in side_files:
+            if os.path.exists(path):
+                os.remove(path)
+        board_archive.forget_archive_index(self.layout)
+        status_history.close_history(self.layout)
+        idempotency.close_cache(self.layout)
+
+    def _discard(self):
+        for name, writer in self.writers.items():
+            writer.close()
+            os.remove(self._tmp_path(name))
+
+    def _load_line(self, line_number, line):
+        try:
+            entry = json.loads(line)
+            record_type = entry["type"]
+            record = entry["record"]
+        except (ValueError, KeyError, TypeError):
+            raise LoadError(f"line {line_number}: not a dump entry")
+
+        if record_type == "task":
+            self._load_task(line_number, entry, record)
+            return
+
+        if record_type not in _SECTIONS or _SECTIONS.index(record_type) < self.section:
+            raise LoadError(f"line {line_number}: unexpected {record_type!r} entry, dumps list users, teams then boards")
+        self._end_board(line_number)
+        self.section = _SECTIONS.index(record_type)
+
+        collection = record_type + "s"
+        if not self._keep(line_number, lambda: self.checker.check(collection, record)):
+            if record_type == "board":
+                self.board, self.board_kept, self.tasks_left = record, False, entry.get("tasks", 0)
+            return
+
+        if record_type == "board":
+            self.board, self.board_kept, self.tasks_left = record, True, entry.get("tasks", 0)
+            self.titles = set()
+            if self.tasks_left:
+                self.writers["boards"].open_list(record, "tasks")
+                self.list_open = True
+            else:
+                self.writers["boards"].write(record)
+        else:
+            self.writers[collection].write(record)
+
+        self.counts[collection] += 1
+        if self.index is not None:
+            getattr(self.index, "add_" + record_type)(record)
+
+    def _load_task(self, line_number, entry, task):
+        if self.board is None or entry.get("board_id") != self.board.get("id") or self.tasks_left <= 0:
+            raise LoadError(f"line {line_number}: task does not follow its board")
+        self.tasks_left -= 1
+
+        if not self.board_kept:
+            self.rejected += 1
+            return
+        if not self._keep(line_number, lambda: self.checker.check_task(self.board, task, self.titles)):
+            return
+        self.writers["boards"].write_item(task)
+        self.counts["tasks"] += 1
+        if self.index is not None:
+            self.index.add_task(self.board["id"], task)
+
+    def _end_board(self, line_number):
+        if self.board is None:
+            return
+        if self.tasks_left:
+            raise LoadError(f"line {line_number}: board {self.board.get('id')} is missing {self.tasks_left} tasks")
+        if self.list_open:
+            self.writers["boards"].close_list()
+            self.list_open = False
+        self.board = None
+
+    def _keep(self, line_number, check):
+        violations = self.checker.report.counts.copy()
+        keep = check()
+        if self.strict and self.checker.report.counts != violations:
+            kind = next(k for k, v in self.checker.report.counts.items() if violations.get(k) != v)
+            raise LoadError(f"line {line_number}: {kind}: {self.checker.report.samples[kind][-1]['detail']}")
+        if not keep:
+            self.rejected += 1
+        return keep
+
+
+def load(lines, db_dir=storage.DB_DIR, strict=False, build_index=True):
+    """
+    Load an NDJSON dump into db_dir, replacing its collections and dropping its
+    archive, status history, idempotency keys and tombstones.
+    :param lines: iterable of dump lines, e.g. an open file
+    :param strict: abort on the first violation instead of reporting it (migrated legacy values
+        are not violations)
+    :return: {"loaded": {...counts}, "rejected": <count>, "report": <fsck report>}
+    Raises LoadError for a malformed dump (nothing is replaced in that case).
+    """
+    os.makedirs(db_dir, exist_ok=True)
+    return _Loader(db_dir, strict, build_index).load(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Dump or load the db collections as NDJSON.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    dump_parser = sub.add_parser("dump", help="write the db as NDJSON")
+    dump_parser.add_argument("--db", default=storage.DB_DIR)
+    dump_parser.add_argument("-o", "--output", help="output file, stdout by default")
+
+    load_parser = sub.add_parser("load", help="replace the db with an NDJSON dump")
+    load_parser.add_argument("--db", default=storage.DB_DIR)
+    load_parser.add_argument("-i", "--input", help="input file, stdin by default")
+    load_parser.add_argument("--strict", action="store_true", help="abort on the first invalid record")
+    load_parser.add_argument("--force", action="store_true", help="replace collections that already hold data, and their archive, history, keys and tombstones")
+    load_parser.add_argument("--no-index", action="store_true", help="do not build the index sidecar")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "dump":
+        out = open(args.output, "w", buffering=8 << 20) if args.output else sys.stdout
+        try:
+            counts = dump(args.db, out)
+        finally:
+            if args.output:
+                out.close()
+        print(json.dumps({"dumped": counts}), file=sys.stderr)
+        return 0
+
+    if not args.force:
+        for name in storage.COLLECTION_FILES:
+            path = storage.collection_path(name, args.db)
+            if os.path.exists(path) and os.path.getsize(path) > 2:
+                parser.error(f"{path} already holds data, use --force to replace it")
+
+    source = open(args.input, "r", buffering=8 << 20) if args.input else sys.stdin
+    try:
+        result = load(source, args.db, args.strict, not args.no_index)
+    except LoadError as e:
+        print(json.dumps({"error": str(e)}), file=sys.stderr)
+        return 1
+    finally:
+        if args.input:
+            source.close()
+    print(json.dumps(result, indent=2))
+    return 1 if result["rejected"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,365 @@
+"""
+Offline integrity checker for the db folder.
+
+Streams users, teams and boards one record at a time (see storage.iter_collection),
+and the tasks of a board one task at a time (storage.iter_collection_items),
+checks field types, length limits and references between the collections, and
+reports every violation grouped by kind. With --repair it writes a repaired copy
+of the collections to another folder; records that cannot be kept are written to
+lost_found.ndjson there instead of being silently dropped.
+
+Only ids, team admins and the titles of the board being checked are kept in
+memory, never whole collections or whole boards.
+
+Tasks written by older versions of add_task are assigned to a team id; they are
+reported as legacy_assignee and --repair assigns them to the admin of that team.
+
+Usage:
+    python fsck.py [--db db] [--repair OUT_DIR] [--samples 20]
+Exit status is 0 when no violation was found, 1 otherwise.
+"""
+import argparse
+import json
+import os
+import sys
+
+import storage
+from request_schema import MAX_TEAM_MEMBERS, TASK_STATUSES
+
+BOARD_STATUSES = ("OPEN", "CLOSED")
+
+# Spellings written by older versions of add_task
+LEGACY_TASK_STATUSES = {"IN PROGRESS": "IN_PROGRESS"}
+
+
+class Report:
+    """Violation counts per kind plus the first few samples of each kind."""
+
+    def __init__(self, max_samples=20):
+        self.max_samples = max_samples
+        self.counts = {}
+        self.samples = {}
+        self.records = {}
+        self.repaired = 0
+        self.lost = 0
+        self.migrated = {}
+
+    def violation(self, kind, collection, record_id, detail, repaired=False):
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        samples = self.samples.setdefault(kind, [])
+        if len(samples) < self.max_samples:
+            samples.append({
+                "collection": collection,
+                "id": record_id,
+                "detail": detail,
+                "repaired": repaired,
+            })
+
+    def migration(self, kind):
+        self.migrated[kind] = self.migrated.get(kind, 0) + 1
+
+    def to_json(self):
+        return {
+            "records": self.records,
+            "violations": sum(self.counts.values()),
+            "counts": self.counts,
+            "samples": self.samples,
+            "repaired": self.repaired,
+            "lost": self.lost,
+            "migrated": self.migrated,
+        }
+
+
+class Checker:
+    def __init__(self, db_dir=storage.DB_DIR, repair_dir=None, max_samples=20, migrate=False):
+        self.db_dir = db_dir
+        self.repair_dir = repair_dir
+        # rewrite values written by older versions in place instead of reporting them
+        self.migrate = migrate
+        self.report = Report(max_samples)
+        self.user_ids = set()
+        self.team_ids = set()
+        self.team_admins = {}
+        self.board_ids = set()
+        self._lost_found = None
+
+    def run(self):
+        if self.repair_dir:
+            os.makedirs(self.repair_dir, exist_ok=True)
+            self._lost_found = open(os.path.join(self.repair_dir, "lost_found.ndjson"), "w")
+        try:
+            self._check("users")
+            self._check("teams")
+            self._check("boards")
+        finally:
+            if self._lost_found:
+                self._lost_found.close()
+        return self.report
+
+    # ------------------- single records -------------------
+
+    def check(self, collection, record):
+        """
+        Check one user, team or board. Users must be checked before teams and teams
+        before boards, since references are resolved against the ids seen so far.
+        :return: False when the record cannot be kept
+        """
+        return self._is_record(collection, record) and getattr(self, "_check_" + collection.rstrip("s"))(record)
+
+    def _is_record(self, collection, record):
+        if not isinstance(record, dict) or not isinstance(record.get("id"), str):
+            self.report.violation("invalid_record", collection, None, "record is not an object with a string id",
+                                  repaired=self._fixed())
+            return False
+        return True
+
+    def check_task(self, board, task, titles):
+        """
+        Check one task of a board.
+        :param titles: set of the casefolded titles of the board's tasks checked so far
+        :return: False when the task cannot be kept
+        """
+        if not isinstance(task, dict) or not isinstance(task.get("id"), str):
+            self.report.violation("invalid_record", "tasks", board["id"], "task is not an object with a string id",
+                                  repaired=self._fixed())
+            return False
+        return self._check_task(board, task, titles)
+
+    # ------------------- driver -------------------
+
+    def _check(self, collection):
+        path = storage.collection_path(collection, self.db_dir)
+        writer = None
+        if self.repair_dir:
+            writer = storage.CollectionWriter(storage.collection_path(collection, self.repair_dir))
+
+        self.report.records[collection] = 0
+        try:
+            if collection == "boards":
+                self._check_boards(path, writer)
+            else:
+                for record in storage.iter_collection(path):
+                    self.report.records[collection] += 1
+                    keep = self.check(collection, record)
+                    if writer and keep:
+                        writer.write(record)
+                    elif not keep:
+                        self._lose(collection, record)
+        except FileNotFoundError:
+            self.report.violation("missing_collection", collection, None, path)
+        except json.JSONDecodeError as e:
+            self.report.violation("corrupt_collection", collection, None, f"{path}: {e}")
+        finally:
+            if writer:
+                writer.close()
+
+    def _check_boards(self, path, writer):
+        """
+        Check the boards a task at a time. The board itself is checked on the fields
+        that precede its task list (the API writes id and team_id first); the fields
+        that follow the list, such as status and end_time, are checked after it.
+        """
+        keep = False
+        head = None
+        titles = set()
+        for event, record in storage.iter_collection_items(path, "tasks"):
+            if event == "record":
+                self.report.records["boards"] += 1
+                keep = self.check("boards", record)
+                if writer and keep:
+                    writer.write(record)
+                elif not keep:
+                    self._lose("boards", record)
+            elif event == "head":
+                self.report.records["boards"] += 1
+                head = record
+                titles = set()
+                keep = self._is_record("boards", head) and self._check_board_head(head)
+                if not keep:
+                    self._lose("boards", head)
+                elif writer:
+                    writer.open_list(head, "tasks")
+            elif event == "item":
+                if not keep:
+                    # tasks of a board that was not kept follow it to lost_found
+                    self._lose("tasks", record, board_id=head.get("id"))
+                elif self.check_task(head, record, titles):
+                    if writer:
+                        writer.write_item(record)
+                else:
+                    self._lose("tasks", record, board_id=head["id"])
+            else:
+                if keep:
+                    self._check_board_status(record)
+                if keep and writer:
+                    writer.close_list({field: value for field, value in record.items() if field not in head})
+
+    def _lose(self, collection, record, **context):
+        if self._lost_found:
+            self._lost_found.write(json.dumps(dict({"collection": collection, "record": record}, **context)) + "\n")
+            self.report.lost += 1
+
+    def _fixed(self):
+        if self.repair_dir:
+            self.report.repaired += 1
+        return bool(self.repair_dir)
+
+    def _check_string(self, collection, record, field, max_length=None, required=True):
+        value = record.get(field)
+        if value is None:
+            if required:
+                self.report.violation("missing_field", collection, record["id"], field)
+            return
+        if not isinstance(value, str):
+            self.report.violation("wrong_type", collection, record["id"], f"{field} is {type(value).__name__}")
+        elif max_length is not None and len(value) > max_length:
+            self.report.violation("too_long", collection, record["id"], f"{field} has {len(value)} characters")
+
+    # ------------------- collections -------------------
+
+    def _check_user(self, user):
+        if user["id"] in self.user_ids:
+            self.report.violation("duplicate_id", "users", user["id"], "user id already used", repaired=self._fixed())
+            return False
+        self.user_ids.add(user["id"])
+
+        self._check_string("users", user, "name", 64)
+        self._check_string("users", user, "display_name", 128)
+        self._check_string("users", user, "creation_time")
+        return True
+
+    def _check_team(self, team):
+        if team["id"] in self.team_ids:
+            self.report.violation("duplicate_id", "teams", team["id"], "team id already used", repaired=self._fixed())
+            return False
+        self.team_ids.add(team["id"])
+        if team.get("admin") in self.user_ids:
+            self.team_admins[team["id"]] = team["admin"]
+
+        self._check_string("teams", team, "team_name", 64)
+        self._check_string("teams", team, "team_description", 128)
+        self._check_string("teams", team, "creation_time")
+        if team.get("admin") not in self.user_ids:
+            self.report.violation("dangling_reference", "teams", team["id"], f"admin {team.get('admin')} is not a user")
+
+        members = team.get("members", [])
+        if not isinstance(members, list):
+            self.report.violation("wrong_type", "teams", team["id"], f"members is {type(members).__name__}",
+                                  repaired=self._fixed())
+            members = []
+
+        valid = {}
+        for user_id in members:
+            if user_id not in self.user_ids:
+                self.report.violation("dangling_reference", "teams", team["id"], f"member {user_id} is not a user",
+                                      repaired=self._fixed())
+            else:
+                valid[user_id] = None
+        if len(valid) > MAX_TEAM_MEMBERS:
+            self.report.violation("too_many_members", "teams", team["id"], f"{len(valid)} members")
+
+        member_count = team.get("member_count")
+        if member_count is not None and member_count != len(valid):
+            self.report.violation("wrong_count", "teams", team["id"],
+                                  f"member_count is {member_count}, team has {len(valid)} members",
+                                  repaired=self._fixed())
+
+        if self.repair_dir and "members" in team:
+            team["members"] = list(valid)
+            if "member_count" in team:
+                team["member_count"] = len(valid)
+        return True
+
+    def _check_board(self, board):
+        if not self._check_board_head(board):
+            return False
+        self._check_board_status(board)
+        return True
+
+    def _check_board_head(self, board):
+        if board["id"] in self.board_ids:
+            self.report.violation("duplicate_id", "boards", board["id"], "board id already used", repaired=self._fixed())
+            return False
+        self.board_ids.add(board["id"])
+
+        self._check_string("boards", board, "board_name", 64)
+        self._check_string("boards", board, "board_description", 128)
+        self._check_string("boards", board, "creation_time")
+
+        if board.get("team_id") not in self.team_ids:
+            self.report.violation("dangling_reference", "boards", board["id"],
+                                  f"team {board.get('team_id')} does not exist", repaired=self._fixed())
+            return False
+        return True
+
+    def _check_board_status(self, board):
+        """Checks of the fields close_board adds after the task list, and of a tasks field that is not a list."""
+        status = board.get("status", "OPEN")
+        if status not in BOARD_STATUSES:
+            self.report.violation("invalid_status", "boards", board["id"], f"status {status}")
+        if status == "CLOSED" and not board.get("end_time"):
+            self.report.violation("missing_field", "boards", board["id"], "end_time of a CLOSED board")
+
+        tasks = board.get("tasks", [])
+        if not isinstance(tasks, list):
+            self.report.violation("wrong_type", "boards", board["id"], f"tasks is {type(tasks).__name__}")
+
+    def _check_task(self, board, task, titles):
+        self._check_string("tasks", task, "title", 64)
+        self._check_string("tasks", task, "description", 128)
+
+        title = task.get("title")
+        if isinstance(title, str):
+            if title.casefold() in titles:
+                self.report.violation("duplicate_title", "tasks", task["id"], f"title {title!r} on board {board['id']}")
+            titles.add(title.casefold())
+
+        # a null user_id is an unassigned task
+        user_id = task.get("user_id")
+        if user_id in self.team_ids and user_id not in self.user_ids:
+            # assigned by an older add_task, the team's admin takes the task over
+            admin = self.team_admins.get(user_id)
+            if self.migrate and admin:
+                self.report.migration("legacy_assignee")
+                task["user_id"] = admin
+            else:
+                self.report.violation("legacy_assignee", "tasks", task["id"], f"user_id {user_id} is a team id",
+                                      repaired=self._fixed() if admin else False)
+                if self.repair_dir and admin:
+                    task["user_id"] = admin
+        elif user_id is not None and user_id not in self.user_ids:
+            self.report.violation("dangling_reference", "tasks", task["id"], f"user_id {user_id} is not a user",
+                                  repaired=self._fixed())
+            if self.repair_dir:
+                task["user_id"] = None
+
+        status = task.get("status")
+        if status in LEGACY_TASK_STATUSES and self.migrate:
+            self.report.migration("legacy_status")
+            task["status"] = LEGACY_TASK_STATUSES[status]
+        elif status in LEGACY_TASK_STATUSES:
+            self.report.violation("legacy_status", "tasks", task["id"], f"status {status!r}", repaired=self._fixed())
+            if self.repair_dir:
+                task["status"] = LEGACY_TASK_STATUSES[status]
+        elif status not in TASK_STATUSES:
+            self.report.violation("invalid_status", "tasks", task["id"], f"status {status!r}")
+        return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check (and optionally repair) the db collections.")
+    parser.add_argument("--db", default=storage.DB_DIR, help="db folder to check")
+    parser.add_argument("--repair", metavar="OUT_DIR", help="write a repaired copy of the collections to OUT_DIR")
+    parser.add_argument("--samples", type=int, default=20, help="samples reported per violation kind")
+    args = parser.parse_args(argv)
+
+    if args.repair and os.path.abspath(args.repair) == os.path.abspath(args.db):
+        parser.error("--repair must not point to the folder being checked")
+
+    report = Checker(args.db, args.repair, args.samples).run()
+    print(json.dumps(report.to_json(), indent=2))
+    return 1 if report.counts else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+"""
+Idempotency keys for the create_* style API methods.
+
+A client may send an optional "idempotency_key" with create_user, create_team,
+create_board and add_task. The first successful response for a key is kept in a
+bounded, time-expiring LRU persisted to db/idempotency_keys.json, and a retry
+with the same key gets that response back without the method loading or
+rewriting any collection.
+
+The keys file is an append-only log, one JSON row per remembered response, so
+remembering a key costs one short append. Once the log holds more than
+COMPACT_FACTOR times the live entries it is rewritten with only those.
+"""
+import contextlib
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import storage
+
+KEYS_FILE = "idempotency_keys.json"
+MAX_ENTRIES = 10000
+TTL_SECONDS = 24 * 60 * 60
+COMPACT_FACTOR = 2
+
+
+class IdempotencyCache:
+    """
+    LRU of (method, idempotency_key) -> (stored_at, request fingerprint, response).
+    """
+
+    def __init__(self, path, max_entries=MAX_ENTRIES, ttl_seconds=TTL_SECONDS):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # (method, key) -> [lock, calls holding or waiting for it]
+        self._key_locks = {}
+        self._log_rows = 0
+        self._load()
+
+    @contextlib.contextmanager
+    def key_lock(self, method, key):
+        """
+        Serialise concurrent calls that carry the same key. The lock only lives
+        while a call holds or waits for it.
+        """
+        with self.lock:
+            entry = self._key_locks.setdefault((method, key), [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self.lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._key_locks[(method, key)]
+
+    def lookup(self, method, key, fingerprint):
+        """
+        :return: the stored response for the key, a json error when the key was used
+        with a different request, or None when the key is unknown or expired.
+        """
+        with self.lock:
+            entry = self.entries.get((method, key))
+            if entry is None:
+                return None
+
+            stored_at, stored_fingerprint, response = entry
+            if time.time() - stored_at > self.ttl_seconds:
+                del self.entries[(method, key)]
+                return None
+            if stored_fingerprint != fingerprint:
+                return json.dumps({"error": "Idempotency key already used with a different request"})
+
+            self.entries.move_to_end((method, key))
+            return response
+
+    def remember(self, method, key, fingerprint, response):
+        with self.lock:
+            stored_at = time.time()
+            self._add(method, key, stored_at, fingerprint, response)
+            if self._log_rows >= COMPACT_FACTOR * max(len(self.entries), 1):
+                self._compact()
+            else:
+                self._append([method, key, stored_at, fingerprint, response])
+
+    def _add(self, method, key, stored_at, fingerprint, response):
+        self.entries[(method, key)] = (stored_at, fingerprint, response)
+        self.entries.move_to_end((method, key))
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+
+        now = time.time()
+        for line in lines:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                # a row cut short by a crash
+                continue
+            # files written before the log hold all the rows in one list
+            rows = row if not row or isinstance(row[0], list) else [row]
+            for method, key, stored_at, fingerprint, response in rows:
+                self._log_rows += 1
+                if now - stored_at <= self.ttl_seconds:
+                    self._add(method, key, stored_at, fingerprint, response)
+
+    def _append(self, row):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            return
+        with open(self.path, "a") as f:
+            f.write(json.dumps(row) + "\n")
+        self._log_rows += 1
+
+    def _compact(self):
+        """Rewrite the log with the live entries only, oldest first."""
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            return
+        now = time.time()
+        lines = [
+            json.dumps([method, key, stored_at, fingerprint, response]) + "\n"
+            for (method, key), (stored_at, fingerprint, response) in self.entries.items()
+            if now - stored_at <= self.ttl_seconds
+        ]
+        storage.replace_file(self.path, "".join(lines).encode("utf-8"))
+        self._log_rows = len(lines)
+
+
+# keys file path -> IdempotencyCache
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(layout=storage.DEFAULT_LAYOUT):
+    path = layout.side_file(KEYS_FILE)
+    with _caches_lock:
+        cache = _caches.get(path)
+        if cache is None:
+            cache = IdempotencyCache(path)
+            _caches[path] = cache
+        return cache
+
+
+def close_cache(layout):
+    """Drop the keys of a layout from memory, they are appended to the log on every remember()."""
+    with _caches_lock:
+        _caches.pop(layout.side_file(KEYS_FILE), None)
+
+
+def _fingerprint(data):
+    body = {k: v for k, v in data.items() if k != "idempotency_key"}
+    return hashlib.sha1(json.dumps(body, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def idempotent(method):
+    """
+    Decorator for an API method taking a json request string. Requests without an
+    "idempotency_key" go straight through; otherwise a replay of a key returns the
+    cached response and only successful responses are cached.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, request):
+            try:
+                data = json.loads(request)
+            except (TypeError, ValueError):
+                return func(self, request)
+
+            key = data.get("idempotency_key") if isinstance(data, dict) else None
+            if not key or not isinstance(key, str):
+                return func(self, request)
+
+            cache = get_cache(self.layout)
+            fingerprint = _fingerprint(data)
+            with cache.key_lock(method, key):
+                cached = cache.lookup(method, key, fingerprint)
+                if cached is not None:
+                    return cached
+
+                response = func(self, request)
+                result = json.loads(response)
+                if isinstance(result, dict) and "error" not in result and "errors" not in result:
+                    txn = storage.current_transaction()
+                    if txn is not None:
+                        # only remember responses whose records were committed
+                        txn.after_commit(functools.partial(cache.remember, method, key, fingerprint, response))
+                    else:
+                        cache.remember(method, key, fingerprint, response)
+                return response
+        return wrapper
+    return decorator
@@ -0,0 +1,409 @@
+"""
+In-memory indexes derived from the db collections, persisted in a versioned
+sidecar file (db/index_sidecar.json) so a fresh process does not have to parse
+every collection to rebuild them.
+
+The sidecar records the checksum of each collection it was built from. On load,
+any collection whose checksum no longer matches is re-parsed and only its part
+of the index is rebuilt.
+
+Other modules can add their own structures over the boards collection with
+register_board_index(); they are rebuilt, updated and persisted together with
+the built-in board structures.
+"""
+import atexit
+import json
+import os
+import time
+
+import storage
+
+INDEX_VERSION = 3
+SIDECAR_FILE = "index_sidecar.json"
+
+# estimated bytes of one map or set entry keyed by a uuid string, see approx_bytes()
+ENTRY_BYTES = 256
+
+# name -> class of an extra index over the boards collection
+_board_indexes = {}
+
+
+def register_board_index(name, index_class):
+    """
+    Register an extra index over the boards collection. index_class() must build an
+    empty index and provide:
+        add_board(board)
+        add_task(board_id, team_id, task)
+        update_task(board_id, team_id, task)   after a task of the board changed
+        remove_task(board_id, team_id, task)   when the task or its board is deleted
+        to_json() / classmethod from_json(data)
+    """
+    _board_indexes[name] = index_class
+
+
+class ProjectIndex:
+    """
+    Lookup structures for users, teams and boards.
+
+    users  : user_by_id {user_id: name}, user_by_name {name: user_id}
+    teams  : team_by_id {team_id: name}, team_by_name {name: team_id},
+             team_members {team_id: set(user_id)}, user_teams {user_id: set(team_id)},
+             team_admin {team_id: user_id}, admin_teams {user_id: set(team_id)}
+    boards : board_by_id {board_id: team_id}, team_boards {team_id: [board_id]},
+             task_board {task_id: board_id}, board_titles {board_id: set(casefolded task title)},
+             extras {name: registered board index}
+             board_tasks(board_id) : set(task_id), derived from task_board on first use, not persisted
+    members_version : bumped on every membership change, never reset
+    """
+
+    def __init__(self, layout=storage.DEFAULT_LAYOUT):
+        self.layout = layout
+        self.checksums = {}
+        self.dirty = False
+        self.load_stats = {}
+        self.members_version = 0
+        self._reset_users()
+        self._reset_teams()
+        self._reset_boards()
+
+    # ------------------- rebuild -------------------
+
+    def _reset_users(self):
+        self.user_by_id = {}
+        self.user_by_name = {}
+
+    def _reset_teams(self):
+        self.members_version += 1
+        self.team_by_id = {}
+        self.team_by_name = {}
+        self.team_members = {}
+        self.user_teams = {}
+        self.team_admin = {}
+        self.admin_teams = {}
+
+    def _reset_boards(self):
+        self.board_by_id = {}
+        self.team_boards = {}
+        self.task_board = {}
+        self.board_titles = {}
+        self.extras = {name: index_class() for name, index_class in _board_indexes.items()}
+        self._board_tasks = None
+
+    def refresh(self):
+        """
+        Rebuild the part of the index belonging to every collection whose file changed.
+        :return: list of the collection names that were rebuilt
+        """
+        rebuilt = []
+        for name in storage.COLLECTION_FILES:
+            path = self.layout.path(name)
+            checksum = storage.file_checksum(path)
+            if name in self.checksums and self.checksums[name] == checksum:
+                continue
+
+            try:
+                records = storage.load_collection(path)
+            except FileNotFoundError:
+                records = []
+            getattr(self, "_rebuild_" + name)(records)
+            self.checksums[name] = checksum
+            rebuilt.append(name)
+
+        if rebuilt:
+            self.dirty = True
+        return rebuilt
+
+    def _rebuild_users(self, users):
+        self._reset_users()
+        for user in users:
+            self.add_user(user)
+
+    def _rebuild_teams(self, teams):
+        self._reset_teams()
+        for team in teams:
+            self.add_team(team)
+
+    def _rebuild_boards(self, boards):
+        self._reset_boards()
+        for board in boards:
+            self.add_board(board)
+            for task in board.get("tasks", []):
+                self.add_task(board["id"], task)
+
+    # ------------------- incremental updates -------------------
+
+    def add_user(self, user):
+        self.user_by_id[user["id"]] = user.get("name", "")
+        self.user_by_name[user.get("name", "")] = user["id"]
+
+    def add_team(self, team):
+        team_id = team["id"]
+        self.team_by_id[team_id] = team.get("team_name", "")
+        self.team_by_name[team.get("team_name", "")] = team_id
+        self.set_team_admin(team_id, team.get("admin"))
+        self.set_team_members(team_id, team.get("members", []))
+
+    def set_team_admin(self, team_id, admin_id):
+        self.admin_teams.get(self.team_admin.get(team_id), set()).discard(team_id)
+        self.team_admin[team_id] = admin_id
+        self.admin_teams.setdefault(admin_id, set()).add(team_id)
+
+    def team_assignees(self, team_id):
+        """
+        :return: the users a task of the team's boards can be assigned to: the members
+        and the admin, who is a member of their team even when not listed in members
+        """
+        assignees = set(self.team_members.get(team_id, ()))
+        admin = self.team_admin.get(team_id)
+        if admin in self.user_by_id:
+            assignees.add(admin)
+        return assignees
+
+    def set_team_members(self, team_id, members):
+        self.members_version += 1
+        for user_id in self.team_members.get(team_id, ()):
+            self.user_teams.get(user_id, set()).discard(team_id)
+
+        # members written by older versions can be a bare number; treat them as unknown
+        member_set = set(members) if isinstance(members, list) else set()
+        self.team_members[team_id] = member_set
+        for user_id in member_set:
+            self.user_teams.setdefault(user_id, set()).add(team_id)
+
+    def add_team_members(self, team_id, user_ids):
+        self.members_version += 1
+        members = self.team_members.setdefault(team_id, set())
+        for user_id in user_ids:
+            members.add(user_id)
+            self.user_teams.setdefault(user_id, set()).add(team_id)
+
+    def remove_team_members(self, team_id, user_ids):
+        self.members_version += 1
+        members = self.team_members.get(team_id, set())
+        for user_id in user_ids:
+            members.discard(user_id)
+            self.user_teams.get(user_id, set()).discard(team_id)
+
+    def remove_user(self, user_id):
+        name = self.user_by_id.pop(user_id, None)
+        if self.user_by_name.get(name) == user_id:
+            del self.user_by_name[name]
+
+    def remove_team(self, team_id):
+        name = self.team_by_id.pop(team_id, None)
+        if self.team_by_name.get(name) == team_id:
+            del self.team_by_name[name]
+        self.remove_team_members(team_id, list(self.team_members.pop(team_id, ())))
+        self.admin_teams.get(self.team_admin.pop(team_id, None), set()).discard(team_id)
+        self.team_boards.pop(team_id, None)
+
+    def add_board(self, board):
+        self.board_by_id[board["id"]] = board.get("team_id")
+        self.team_boards.setdefault(board.get("team_id"), []).append(board["id"])
+        for extra in self.extras.values():
+            extra.add_board(board)
+
+    def add_task(self, board_id, task):
+        self.task_board[task["id"]] = board_id
+        self.board_titles.setdefault(board_id, set()).add(task.get("title", "").casefold())
+        if self._board_tasks is not None:
+            self._board_tasks.setdefault(board_id, set()).add(task["id"])
+        team_id = self.board_by_id.get(board_id)
+        for extra in self.extras.values():
+            extra.add_task(board_id, team_id, task)
+
+    def remove_board(self, board):
+        """Forget a board and its tasks; board is the full record."""
+        board_id = board["id"]
+        team_id = self.board_by_id.pop(board_id, None)
+        team_boards = self.team_boards.get(team_id)
+        if team_boards and board_id in team_boards:
+            team_boards.remove(board_id)
+        self.board_titles.pop(board_id, None)
+        if self._board_tasks is not None:
+            self._board_tasks.pop(board_id, None)
+        for task in board.get("tasks", []):
+            self.task_board.pop(task["id"], None)
+            for extra in self.extras.values():
+                extra.remove_task(board_id, team_id, task)
+
+    def board_tasks(self, board_id):
+        """:return: ids of the tasks of a hot board"""
+        if self._board_tasks is None:
+            self._board_tasks = {}
+            for task_id, task_board in self.task_board.items():
+                self._board_tasks.setdefault(task_board, set()).add(task_id)
+        return set(self._board_tasks.get(board_id, ()))
+
+    def update_task(self, board_id, task):
+        """Let the extra indexes see a changed task (the built-in maps do not depend on its fields)."""
+        team_id = self.board_by_id.get(board_id)
+        for extra in self.extras.values():
+            extra.update_task(board_id, team_id, task)
+
+    def synced(self, name):
+        """
+        Record that collection `name` was just rewritten by this process and the
+        in-memory structures were updated to match it. Call it only after an index
+        obtained from get_index(), i.e. one that was in sync before the write.
+        Inside a transaction the file is only written on commit, so is the checksum.
+        """
+        txn = storage.current_transaction()
+        if txn is not None:
+            txn.after_commit(lambda: self.synced(name), key=("index_synced", self.layout.key, name))
+            return
+        self.checksums[name] = storage.file_checksum(self.layout.path(name))
+        self.dirty = True
+
+    def approx_bytes(self):
+        """Rough size of the structures in memory, ENTRY_BYTES per id kept in a map or set."""
+        entries = (2 * len(self.user_by_id) + 2 * len(self.team_by_id) + len(self.board_by_id)
+                   + 2 * len(self.task_board) + 2 * sum(len(members) for members in self.team_members.values()))
+        return entries * ENTRY_BYTES
+
+    # ------------------- sidecar -------------------
+
+    def to_json(self):
+        return {
+            "version": INDEX_VERSION,
+            "checksums": self.checksums,
+            "users": {"user_by_id": self.user_by_id},
+            "teams": {
+                "team_by_id": self.team_by_id,
+                "team_members": {k: sorted(v) for k, v in self.team_members.items()},
+                "team_admin": self.team_admin,
+            },
+            "boards": {
+                "board_by_id": self.board_by_id,
+                "team_boards": self.team_boards,
+                "task_board": self.task_board,
+                "board_titles": {k: sorted(v) for k, v in self.board_titles.items()},
+                "extras": {name: extra.to_json() for name, extra in self.extras.items()},
+            },
+        }
+
+    @classmethod
+    def from_json(cls, data, layout=storage.DEFAULT_LAYOUT):
+        index = cls(layout)
+        index.checksums = dict(data["checksums"])
+
+        index.user_by_id = dict(data["users"]["user_by_id"])
+        index.user_by_name = {name: user_id for user_id, name in index.user_by_id.items()}
+
+        index.team_by_id = dict(data["teams"]["team_by_id"])
+        index.team_by_name = {name: team_id for team_id, name in index.team_by_id.items()}
+        for team_id, members in data["teams"]["team_members"].items():
+            index.set_team_members(team_id, members)
+        for team_id, admin_id in data["teams"]["team_admin"].items():
+            index.set_team_admin(team_id, admin_id)
+
+        index.board_by_id = dict(data["boards"]["board_by_id"])
+        index.team_boards = {k: list(v) for k, v in data["boards"]["team_boards"].items()}
+        index.task_board = dict(data["boards"]["task_board"])
+        index.board_titles = {k: set(v) for k, v in data["boards"]["board_titles"].items()}
+
+        extras = data["boards"].get("extras", {})
+        for name, index_class in _board_indexes.items():
+            if name in extras:
+                index.extras[name] = index_class.from_json(extras[name])
+            else:
+                # registered after the sidecar was written, rebuild the boards part
+                index.checksums.pop("boards", None)
+        return index
+
+
+# layout key -> ProjectIndex loaded by this process
+_indexes = {}
+
+
+def get_index(layout=storage.DEFAULT_LAYOUT):
+    """
+    :return: the ProjectIndex of a layout, in sync with the collection files.
+    The first call in a process loads the sidecar (rebuilding stale parts) and
+    records how long that took in index.load_stats.
+    """
+    txn = storage.current_transaction()
+    if txn is not None:
+        # a rolled back transaction leaves the index with changes that never reached the files
+        txn.after_rollback(lambda: _indexes.pop(layout.key, None), key=("index_rollback", layout.key))
+
+    index = _indexes.get(layout.key)
+    if index is not None:
+        index.refresh()
+        return index
+
+    started = time.perf_counter()
+    for directory in {os.path.dirname(path) for path in layout.paths.values()}:
+        storage.recover(directory)
+    index = _load_sidecar(layout)
+    source = "sidecar"
+    if index is None:
+        index = ProjectIndex(layout)
+        source = "rebuilt"
+
+    rebuilt = index.refresh()
+    if rebuilt:
+        save_index(index)
+        if source == "sidecar":
+            source = "partial"
+
+    index.load_stats = {
+        "source": source,
+        "rebuilt": rebuilt,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 3),
+    }
+    _indexes[layout.key] = index
+    return index
+
+
+def loaded_index(layout):
+    """:return: the ProjectIndex of a layout if this process loaded it, without refreshing it"""
+    return _indexes.get(layout.key)
+
+
+def close_index(layout):
+    """Save the index of a layout if it changed and drop it from memory."""
+    index = _indexes.pop(layout.key, None)
+    if index is not None and index.dirty:
+        save_index(index)
+
+
+def startup_report(layout=storage.DEFAULT_LAYOUT):
+    """
+    :return: A json string describing how the index was obtained on startup
+    {"source": "sidecar | partial | rebuilt", "rebuilt": [...], "elapsed_ms": <float>}
+    """
+    return json.dumps(get_index(layout).load_stats)
+
+
+def save_index(index):
+    if not os.path.isdir(index.layout.db_dir) or storage.current_transaction() is not None:
+        # inside a transaction the index may hold staged changes, it stays dirty until later
+        return
+    # changes held back from the collection files are in the index, write them first
+    for collection_path in index.layout.paths.values():
+        storage.barrier(collection_path)
+    storage.replace_file(index.layout.side_file(SIDECAR_FILE), json.dumps(index.to_json()).encode("utf-8"))
+    index.dirty = False
+
+
+def _load_sidecar(layout):
+    try:
+        with open(layout.side_file(SIDECAR_FILE), "r") as f:
+            data = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+    if data.get("version") != INDEX_VERSION:
+        return None
+    try:
+        return ProjectIndex.from_json(data, layout)
+    except (KeyError, TypeError, AttributeError):
+        return None
+
+
+@atexit.register
+def _save_dirty_indexes():
+    for index in _indexes.values():
+        if index.dirty:
+            save_index(index)
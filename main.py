@@ -1,13 +1,20 @@
 from user_base import UserBase
 from team_base import TeamBase
 from project_board_base import ProjectBoardBase
+import index_store
+import storage
+import request_trace
+import call_profiler
 import json
 from datetime import datetime
 
-# Initialize APIs
-user_api = UserBase()
-team_api = TeamBase()
-project_board_api = ProjectBoardBase()
+# Initialize APIs, recording every call when PLANNER_TRACE=<trace file> is set
+# and profiling sampled or slow calls when PLANNER_PROFILE=<directory> is set
+user_api, team_api, project_board_api = call_profiler.wrap_from_env(
+    *request_trace.wrap_from_env(UserBase(), TeamBase(), ProjectBoardBase()))
+
+# Loads the index sidecar (or rebuilds it) and reports how long startup took
+print("Index Startup:", index_store.startup_report())
 
 
 # ------------------- Create a User -------------------
@@ -49,9 +56,8 @@ print(user_api.list_users())
 
 # ------------------- Describe User -------------------
 print("\nDescription of User")
-with open("db/user_base.json", "r") as f:
-    users = json.load(f)
-    user_id = users[0]["id"]  # Fetch the first user's ID dynamically
+users = storage.load_collection(storage.collection_path("users"))
+user_id = users[0]["id"]  # Fetch the first user's ID dynamically
 
 request = json.dumps({
     "id": user_id
@@ -95,9 +101,8 @@ print(team_api.list_teams())
 
 # ------------------- Describe Team -------------------
 print("\nDescription of Team")
-with open("db/team_base.json", "r") as f:
-    teams = json.load(f)
-    team_id = teams[0]["id"]  # Fetch the first team's ID dynamically
+teams = storage.load_collection(storage.collection_path("teams"))
+team_id = teams[0]["id"]  # Fetch the first team's ID dynamically
 
 request = json.dumps({
     "id": team_id
@@ -150,9 +155,8 @@ print(project_board_api.create_board(request_data))
 
 
 # ------------------- Closed(status) Board -------------------
-with open("db/project_board_base.json", "r") as f:
-    boards = json.load(f)
-    board_id = boards[0]["id"]
+boards = storage.load_collection(storage.collection_path("boards"))
+board_id = boards[0]["id"]
 
 print("Closed(status) Board")
 request_data = json.dumps({
@@ -161,16 +165,15 @@ request_data = json.dumps({
 print(project_board_api.close_board(request_data))
 
 # ------------------- Add task -------------------
-with open("db/project_board_base.json", "r") as f:
-    tasks = json.load(f)
-    task_id = tasks[0]["id"]
+tasks = storage.load_collection(storage.collection_path("boards"))
+task_id = tasks[0]["id"]
 
 print("Add task")
 request_data = json.dumps({
     "id": task_id,
     "title": "Fix User Login API",
     "description": "Ensure proper token validation",
-    "user_id": team_id,
+    "user_id": user_id,
     "creation_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 })
 print(project_board_api.add_task(request_data))
@@ -190,12 +193,11 @@ request = json.dumps({
 print(project_board_api.list_boards(request))
 
 # Step 1: Read board_id from the existing board database
-with open("db/project_board_base.json", "r") as f:
-    boards = json.load(f)
-    if not boards:
-        print("No boards found.")
-        exit()
-    board_id = boards[0]["id"]  # Or select dynamically
+boards = storage.load_collection(storage.collection_path("boards"))
+if not boards:
+    print("No boards found.")
+    exit()
+board_id = boards[0]["id"]  # Or select dynamically
 
 # Step 2: Prepare request JSON
 request_data = json.dumps({
@@ -0,0 +1,329 @@
+"""
+Team-partitioned multi-process mode for the board API.
+
+Boards and their tasks are partitioned by team_id across N worker processes.
+Every worker runs its own ProjectBoardBase over a private board file
+(db/partitions/p<N>/project_board_base.json) and shares the user and team files,
+which the board API only reads. PartitionedProjectBoard has the same methods as
+ProjectBoardBase and dispatches each call to the worker owning the partition,
+so mutations on different partitions run in parallel on different cores.
+
+Board and task ids are mapped to their partition as they are created; ids that
+are not known yet (e.g. created before a restart) are located by asking all
+workers in parallel.
+"""
+import json
+import multiprocessing
+import os
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import storage
+import index_store
+import board_archive
+import board_store
+import request_schema
+from project_board_base import ProjectBoardBase
+
+PARTITIONS_DIR = "partitions"
+
+
+def partition_layout(partition, db_dir=storage.DB_DIR):
+    partition_dir = os.path.join(db_dir, PARTITIONS_DIR, f"p{partition}")
+    return storage.Layout(partition_dir, {
+        "users": storage.collection_path("users", db_dir),
+        "teams": storage.collection_path("teams", db_dir),
+    })
+
+
+def partition_for(team_id, partitions):
+    """Stable partition of a team (crc32, so every process agrees on it)."""
+    return zlib.crc32(team_id.encode("utf-8")) % partitions
+
+
+def _worker_main(conn, layout):
+    os.makedirs(layout.db_dir, exist_ok=True)
+    api = ProjectBoardBase(layout)
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        method, request = message
+        try:
+            if method == "locate":
+                response = _locate(layout, request)
+            else:
+                response = getattr(api, method)(request)
+        except Exception as e:
+            response = json.dumps({"error": f"{type(e).__name__}: {e}"})
+        conn.send(response)
+    # worker processes exit without running atexit hooks: write back the board store,
+    # the pending saves and a changed index sidecar here
+    board_store.close_store(layout)
+    storage.flush()
+    index_store.close_index(layout)
+    conn.close()
+
+
+def _locate(layout, request):
+    """:return: json {"board": <bool>, "task": <bool>} for the ids in request"""
+    data = json.loads(request)
+    index = index_store.get_index(layout)
+    return json.dumps({
+        "board": data.get("board_id") in index.board_by_id or board_archive.is_archived(layout, data.get("board_id")),
+        "task": data.get("task_id") in index.task_board,
+    })
+
+
+class _Worker:
+    def __init__(self, context, layout):
+        self.conn, child_conn = context.Pipe()
+        self.lock = threading.Lock()
+        self.process = context.Process(target=_worker_main, args=(child_conn, layout), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def call(self, method, request):
+        with self.lock:
+            self.conn.send((method, request))
+            return self.conn.recv()
+
+    def stop(self):
+        with self.lock:
+            self.conn.send(None)
+        self.process.join()
+
+
+class PartitionedProjectBoard:
+    """
+    Router in front of N ProjectBoardBase worker processes. Safe to call from
+    several threads; calls for different partitions run concurrently.
+    """
+
+    def __init__(self, partitions=None, db_dir=storage.DB_DIR):
+        self.partitions = partitions or os.cpu_count() or 1
+        self.db_dir = db_dir
+        context = multiprocessing.get_context()
+        self.workers = [_Worker(context, partition_layout(i, db_dir)) for i in range(self.partitions)]
+        self.board_partition = {}
+        self.task_partition = {}
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=self.partitions)
+
+    def close(self):
+        for worker in self.workers:
+            worker.stop()
+        self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # ------------------- routing -------------------
+
+    def _fan_out(self, method, request):
+        """Send the same request to every worker and return their responses in partition order."""
+        return list(self.pool.map(lambda worker: worker.call(method, request), self.workers))
+
+    def _locate(self, board_id=None, task_id=None):
+        with self.lock:
+            if board_id in self.board_partition:
+                return self.board_partition[board_id]
+            if task_id in self.task_partition:
+                return self.task_partition[task_id]
+
+        request = json.dumps({"board_id": board_id, "task_id": task_id})
+        for partition, response in enumerate(self._fan_out("locate", request)):
+            found = json.loads(response)
+            if found["board"] or found["task"]:
+                with self.lock:
+                    if board_id:
+                        self.board_partition[board_id] = partition
+                    if task_id:
+                        self.task_partition[task_id] = partition
+                return partition
+        return None
+
+    def _by_board(self, method, request, not_found):
+        try:
+            board_id = json.loads(request).get("id")
+        except (TypeError, ValueError, AttributeError):
+            board_id = None
+        partition = self._locate(board_id=board_id) if isinstance(board_id, str) else None
+        if partition is None:
+            # unknown ids still go through a worker so validation errors look the same
+            return self.workers[0].call(method, request) if not isinstance(board_id, str) else not_found
+        return self.workers[partition].call(method, request)
+
+    def _by_team(self, method, request, team_field):
+        try:
+            team_id = json.loads(request).get(team_field)
+        except (TypeError, ValueError, AttributeError):
+            team_id = None
+        partition = partition_for(team_id, self.partitions) if isinstance(team_id, str) else 0
+        return partition, self.workers[partition].call(method, request)
+
+    # ------------------- ProjectBoardBase API -------------------
+
+    def create_board(self, request: str):
+        partition, response = self._by_team("create_board", request, "team_id")
+        board_id = json.loads(response).get("id")
+        if board_id:
+            with self.lock:
+                self.board_partition[board_id] = partition
+        return response
+
+    def close_board(self, request: str) -> str:
+        return self._by_board("close_board", request, json.dumps({"error": "Board not found"}))
+
+    def add_task(self, request: str) -> str:
+        # auto_assign balances over the tasks of the partition owning the board, which
+        # holds every board of the board's team
+        response = self._by_board("add_task", request, json.dumps({"error": "Board not found"}))
+        task_id = json.loads(response).get("id")
+        if task_id:
+            board_id = json.loads(request)["id"]
+            with self.lock:
+                self.task_partition[task_id] = self.board_partition[board_id]
+        return response
+
+    def update_task_status(self, request: str):
+        try:
+            task_id = json.loads(request).get("id")
+        except (TypeError, ValueError, AttributeError):
+            task_id = None
+        if not isinstance(task_id, str):
+            return self.workers[0].call("update_task_status", request)
+
+        partition = self._locate(task_id=task_id)
+        if partition is None:
+            return json.dumps({"error": "Task not found"})
+        return self.workers[partition].call("update_task_status", request)
+
+    def list_boards(self, request: str) -> str:
+        """
+        A team's members can be assigned tasks on the boards of teams in any
+        partition: every partition is asked and the boards are merged.
+        """
+        return self._merge_boards(self._fan_out("list_boards", request))
+
+    def export_board(self, request: str) -> str:
+        return self._by_board("export_board", request, json.dumps({"error": "Board not found"}))
+
+    def delete_board(self, request: str) -> str:
+        return self._by_board("delete_board", request, json.dumps({"error": "Board not found"}))
+
+    def list_tasks(self, request: str) -> str:
+        return self._by_board("list_tasks", request, json.dumps({"error": "Board not found"}))
+
+    def board_burndown(self, request: str) -> str:
+        return self._by_board_or_team("board_burndown", request)
+
+    def cumulative_flow(self, request: str) -> str:
+        return self._by_board_or_team("cumulative_flow", request)
+
+    def _by_board_or_team(self, method, request):
+        try:
+            board_id = json.loads(request).get("board_id")
+        except (TypeError, ValueError, AttributeError):
+            board_id = None
+        if not board_id or not isinstance(board_id, str):
+            return self._by_team(method, request, "team_id")[1]
+        partition = self._locate(board_id=board_id)
+        if partition is None:
+            return json.dumps({"error": "Board not found"})
+        return self.workers[partition].call(method, request)
+
+    # ------------------- cross-partition reads -------------------
+
+    def search_tasks(self, request: str) -> str:
+        """
+        Search every partition in parallel and merge the ranked results. Each worker
+        is asked for offset + limit results so the merged page is exact.
+        """
+        data, error = request_schema.parse_request("search_tasks", request)
+        if error:
+            return error
+        limit = data.get("limit") or 20
+        offset = data.get("offset") or 0
+        worker_request = json.dumps(dict(data, offset=0, limit=offset + limit))
+
+        total = 0
+        results = []
+        for response in self._fan_out("search_tasks", worker_request):
+            found = json.loads(response)
+            if "error" in found:
+                return response
+            total += found["total"]
+            results.extend(found["results"])
+
+        results.sort(key=lambda result: (-result["score"], result["id"]))
+        return json.dumps({"total": total, "results": results[offset:offset + limit]})
+
+    def user_workload(self, request: str) -> str:
+        """
+        A user's tasks can sit on the boards of teams in any partition: every
+        partition is asked and the counts of each user are added up.
+        """
+        responses = self._fan_out("user_workload", request)
+        # a partition answering "User not found" is skipped, the error only comes back
+        # when no partition knows the user or team
+        found_in = [found for found in map(json.loads, responses) if "error" not in found]
+        if not found_in:
+            return responses[0]
+
+        totals = {}
+        for found in found_in:
+            for counts in found.get("members", [found]):
+                total = totals.setdefault(counts["user_id"], dict(counts, **dict.fromkeys(counts.keys() - {"user_id"}, 0)))
+                for key, value in counts.items():
+                    if key != "user_id":
+                        total[key] += value
+
+        found = found_in[0]
+        if "members" not in found:
+            return json.dumps(totals[found["user_id"]])
+        members = sorted(totals.values(), key=lambda member: (member["open"], member["user_id"]))
+        return json.dumps({"team_id": found["team_id"], "members": members})
+
+    def list_all_boards(self, team_ids):
+        """
+        Boards of several teams at once; every partition is queried in parallel
+        for all the teams and a board listed for more than one team is returned once.
+        :return: A json list [{"id": "<board_id>", "board_name": "<board_name>"}]
+        """
+        def query(worker):
+            return [worker.call("list_boards", json.dumps({"id": team_id})) for team_id in team_ids]
+
+        result = {}
+        for responses in self.pool.map(query, self.workers):
+            for response in responses:
+                boards = json.loads(response)
+                if isinstance(boards, list):
+                    for board in boards:
+                        result.setdefault(board["id"], board)
+        return json.dumps(list(result.values()))
+
+    def _merge_boards(self, responses):
+        """
+        Merge the list_boards answers of every partition. A partition without a
+        board file has no boards; an error is only returned when no partition
+        answered with a list.
+        """
+        result = {}
+        errors = []
+        for response in responses:
+            boards = json.loads(response)
+            if isinstance(boards, dict) and boards.get("error") == "Board database not found":
+                boards = []
+            if not isinstance(boards, list):
+                errors.append(response)
+                continue
+            for board in boards:
+                result.setdefault(board["id"], board)
+        if len(errors) == len(responses):
+            return errors[0]
+        return json.dumps(list(result.values()))
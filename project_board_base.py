@@ -1,12 +1,53 @@
+import base64
 import json
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
+
+import storage
+import index_store
+import request_schema
+from idempotency import idempotent
+from response_cache import cached_response
+import board_archive
+import board_store
+import cascade
+import export_renderers
+import search_index
+import status_history
+import workload_index
+
 class ProjectBoardBase:
     """
     A project board is a unit of delivery for a project. Each board will have a set of tasks assigned to a user.
     """
 
+    def __init__(self, layout=None):
+        """
+        :param layout: storage.Layout of the collections, the db folder by default
+        """
+        self.layout = layout or storage.DEFAULT_LAYOUT
+
+    def _load_board(self, board_id):
+        """
+        :return: (board, boards) with board None when it does not exist; boards is the
+        whole collection to save back, or None when the board store of the layout serves it.
+        Raises FileNotFoundError when the boards collection does not exist.
+        """
+        store = board_store.get_store(self.layout)
+        if store is not None:
+            return store.get(board_id), None
+        boards = storage.load_collection(self.layout.path("boards"))
+        return next((b for b in boards if b["id"] == board_id), None), boards
+
+    def _save_board(self, board_id, boards, added_task=None):
+        if boards is None:
+            board_store.get_store(self.layout).mark_dirty(board_id, added_task)
+        else:
+            storage.save_collection(self.layout.path("boards"), boards)
+
+    @storage.serialized("boards")
+    @idempotent("create_board")
     def create_board(self, request: str):
         """
         :param request: A json string with the board details.
@@ -14,7 +55,8 @@ class ProjectBoardBase:
             "name" : "<board_name>",
             "description" : "<description>",
             "team_id" : "<team id>",
-            "creation_time" : "<date:time when board was created>"
+            "creation_time" : "<date:time when board was created>",
+            "idempotency_key" : "<optional key, a retry with the same key returns the first response>"
         }
         :return: A json string with the response {"id" : "<board_id>"}
 
@@ -23,47 +65,34 @@ class ProjectBoardBase:
          * board name can be max 64 characters
          * description can be max 128 characters
         """
-        data = json.loads(request)
-        
-        if len(data["board_name"]) > 64:
-            return json.dumps({"error":"Board name exceed 64 character"})
-        
-        if len(data["board_description"]) > 128:
-            return json.dumps({"error":"Board description exceed 64 character"})
+        data, error = request_schema.parse_request("create_board", request)
+        if error:
+            return error
 
-        
-        team_id = data.get("team_id")
-        if not team_id:
-            return json.dumps({"error":"Missing team id"})
-        
-        # Load and  valiadte team id
+        team_id = data["team_id"]
 
-        try:
-            with open("db/team_base.json","r") as f:
-                team_data = f.read().strip()
-                teams = json.loads(team_data) if team_data else []
+        # Valiadte team id against the index
 
-        except FileNotFoundError:
+        index = index_store.get_index(self.layout)
+        if not storage.collection_exists(self.layout.path("teams")):
             return json.dumps({"error":"Team Base not found"})
-        
 
-        
-        if not any(team.get("id") == team_id for team in teams):
+        if team_id not in index.team_by_id:
             return json.dumps({"error":"Team id does not exist"})
         
+        # with the board store only the board metadata is read
+        store = board_store.get_store(self.layout)
         try:
-            with open("db/project_board_base.json","r")as f:
-                content = f.read().strip()
-                if content:
-                    boards = json.loads(content)
-                else:
-                    boards = []
+            boards = store.boards() if store is not None else storage.load_collection(self.layout.path("boards"))
         except FileNotFoundError:
             boards = []
 
+        # Board names are unique per team, so a team's boards never clash across partitions
         for board in boards:
-            if board["board_name"] == data["board_name"]:
+            if board["board_name"] == data["board_name"] and board.get("team_id") == team_id:
                 return json.dumps({"error":"Board Name already exists"})
+        if board_archive.archived_board_name_exists(self.layout, team_id, data["board_name"]):
+            return json.dumps({"error":"Board Name already exists"})
             
         board_id = str(uuid.uuid4())
 
@@ -75,15 +104,19 @@ class ProjectBoardBase:
             "creation_time" : datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             
         }
-        boards.append(new_board)
-
-        with open("db/project_board_base.json","w") as f:
-            json.dump(boards,f,indent=4)
+        if store is not None:
+            store.add_board(new_board)
+        else:
+            boards.append(new_board)
+            storage.save_collection(self.layout.path("boards"), boards)
+        index.add_board(new_board)
+        index.synced("boards")
 
         return json.dumps({"id":board_id})
 
   
     # close a board
+    @storage.serialized("boards")
     def close_board(self, request: str) -> str:
         """
         :param request: A json string with the user details
@@ -97,129 +130,145 @@ class ProjectBoardBase:
           * Set the board status to CLOSED and record the end_time date:time
           * You can only close boards with all tasks marked as COMPLETE
         """
-        data = json.loads(request)
-        board_id = data.get("id")
-
-        if not board_id:
-          return json.dumps({"error": "Board ID is required"})
+        data, error = request_schema.parse_request("close_board", request)
+        if error:
+          return error
+        board_id = data["id"]
 
         try:
-          with open("db/project_board_base.json", "r") as f:
-            boards = json.load(f)
+          board, boards = self._load_board(board_id)
         except FileNotFoundError:
           return json.dumps({"error": "Board database not found"})
 
-        board_found = False
-        for board in boards:
-          if board["id"] == board_id:
-            board_found = True
-
-            tasks = board.get("tasks", [])
-
-            # Check if all tasks are COMPLETE
-            incomplete_tasks = [t for t in tasks if t.get("status") != "COMPLETE"]
-            if incomplete_tasks:
-                return json.dumps({"error": "All tasks must be COMPLETE to close the board"})
-
-            board["status"] = "CLOSED"
-            board["end_time"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if not board:
+          if board_archive.is_archived(self.layout, board_id):
+            return json.dumps({"error": "Board already closed"})
+          return json.dumps({"error": "Board not found"})
 
-            break
+        # Check if all tasks are COMPLETE
+        incomplete_tasks = [t for t in board.get("tasks", []) if t.get("status") != "COMPLETE"]
+        if incomplete_tasks:
+          return json.dumps({"error": "All tasks must be COMPLETE to close the board"})
 
-          if not board_found:
-            return json.dumps({"error": "Board not found"})
+        board["status"] = "CLOSED"
+        board["end_time"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
     # Save back to file
-          with open("db/project_board_base.json", "w") as f:
-            json.dump(boards, f, indent=4)
+        index = index_store.get_index(self.layout)
+        self._save_board(board_id, boards)
+        index.synced("boards")
 
-          return json.dumps({"message": "Board closed successfully"})
+        return json.dumps({"message": "Board closed successfully"})
 
     
 
     # add task to board
+    @storage.serialized("boards")
+    @idempotent("add_task")
     def add_task(self, request: str) -> str:
         """
         :param request: A json string with the task details. Task is assigned to a user_id who works on the task
         {
             "title" : "<board_name>",
             "description" : "<description>",
-            "user_id" : "<team id>"
-            "creation_time" : "<date:time when task was created>"
+            "user_id" : "<id of a user who is a member of the board's team>"
+            "auto_assign" : <optional bool, instead of user_id: assign the member of the board's team with the fewest open tasks>,
+            "creation_time" : "<date:time when task was created>",
+            "idempotency_key" : "<optional key, a retry with the same key returns the first response>"
         }
-        :return: A json string with the response {"id" : "<task_id>"}
+        :return: A json string with the response {"id" : "<task_id>"},
+                 plus "user_id" : "<assignee>" for an auto-assigned task
 
         Constraint:
          * task title must be unique for a board
          * title name can be max 64 characters
          * description can be max 128 characters
+         * the assignee must be a member of the board's team, its admin counts as one
 
         Constraints:
         * Can only add task to an OPEN board
         """
        
-        data = json.loads(request)
-    
-        try:
-          with open("db/team_base.json", "r") as f:
-              team_data = f.read().strip()
-              teams = json.loads(team_data) if team_data else []
-        except FileNotFoundError:
-          return json.dumps({"error": "TeamBase not found"})
-
-        team_id = data.get("user_id")
-        if not any(team.get("id") == team_id for team in teams):
-          return json.dumps({"error": "Team id does not exist"})
+        data, error = request_schema.parse_request("add_task", request)
+        if error:
+          return error
+        board_id = data["id"]
 
-        if len(data["title"]) > 64:
-          return json.dumps({"error": "Title exceeds 64 characters"})
+        index = index_store.get_index(self.layout)
+        if not storage.collection_exists(self.layout.path("teams")):
+          return json.dumps({"error": "TeamBase not found"})
 
-        if len(data["description"]) > 128:
-          return json.dumps({"error": "Description exceeds 128 characters"})
+        auto_assign = data.get("auto_assign", False)
+        assignee = data.get("user_id")
+        if auto_assign and assignee:
+          return json.dumps({"error": "Give either user_id or auto_assign"})
+        if not auto_assign:
+          if not assignee:
+            return json.dumps({"error": "Missing user_id"})
+          # tasks are assigned to users; older versions stored the team id instead
+          if assignee not in index.user_by_id:
+            return json.dumps({"error": "User id does not exist"})
+
+        if board_id not in index.board_by_id:
+          if not storage.collection_exists(self.layout.path("boards")):
+            return json.dumps({"error": "Board database not found"})
+          if board_archive.is_archived(self.layout, board_id):
+            return json.dumps({"error": "Board already closed"})
+          return json.dumps({"error": "Board not found"})
 
-        board_id = data.get("id")
-        if not board_id:
-          return json.dumps({"error": "Missing board id"})
+        # O(1) uniqueness check against the board's case-folded titles in the index
+        if data["title"].casefold() in index.board_titles.get(board_id, ()):
+          return json.dumps({"error": "Task title already exists in board"})
 
         try:
-          with open("db/project_board_base.json", "r") as f:
-            content = f.read().strip()
-            boards = json.loads(content) if content else []
+          board, boards = self._load_board(board_id)
         except FileNotFoundError:
           return json.dumps({"error": "Board database not found"})
 
-        board = next((b for b in boards if b["id"] == board_id), None)
         if not board:
           return json.dumps({"error": "Board not found"})
 
         if board.get("status") == "CLOSED":
           return json.dumps({"error": "Board already closed"})
 
-        tasks = board.get("tasks", [])
+        team_id = index.board_by_id.get(board_id)
+        if auto_assign:
+          # O(log n) pick from the heap of the team over the workload counters
+          assignee = index.extras["workload"].least_loaded(
+              team_id, index.team_assignees(team_id), index.members_version)
+          if assignee is None:
+            return json.dumps({"error": "Board team has no members to assign"})
+        elif assignee not in index.team_assignees(team_id):
+          return json.dumps({"error": "User is not a member of the board's team"})
 
-        if any(t["title"].lower() == data["title"].lower() for t in tasks):
-          return json.dumps({"error": "Task title already exists in board"})
+        tasks = board.get("tasks", [])
 
         task_id = str(uuid.uuid4())
         new_task = {
                 "id": task_id,
                 "title": data["title"],
                 "description": data["description"],
-                "user_id": team_id,
-                "status": "IN PROGRESS",
+                "user_id": assignee,
+                "status": "IN_PROGRESS",
                 "creation_time": data.get("creation_time") or datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
               }
 
         tasks.append(new_task)
         board["tasks"] = tasks
 
-        with open("db/project_board_base.json", "w") as f:
-          json.dump(boards, f, indent=4)
+        history = status_history.get_history(self.layout)
+        self._save_board(board_id, boards, new_task)
+        index.add_task(board_id, new_task)
+        index.synced("boards")
+        history.record([(board_id, task_id, new_task["status"], new_task["creation_time"])])
 
+        if auto_assign:
+          return json.dumps({"id": task_id, "user_id": assignee})
         return json.dumps({"id": task_id})
 
 
     # update the status of a task
+    @storage.serialized("boards")
     def update_task_status(self, request: str):
         """
         :param request: A json string with the user details
@@ -230,49 +279,47 @@ class ProjectBoardBase:
         """
         
     
-        data = json.loads(request)
-    
-        task_id = data.get("id")
-        new_status = data.get("status")
-
-        if not task_id or not new_status:
-          return json.dumps({"error": "Missing task id or status"})
-
-        if new_status not in ["OPEN", "IN_PROGRESS", "COMPLETE"]:
-          return json.dumps({"error": "Invalid status value"})
+        data, error = request_schema.parse_request("update_task_status", request)
+        if error:
+          return error
+        task_id = data["id"]
+        new_status = data["status"]
+
+        index = index_store.get_index(self.layout)
+        board_id = index.task_board.get(task_id)
+        if board_id is None:
+          return json.dumps({"error": "Task not found"})
 
         try:
-          with open("db/project_board_base.json", "r") as f:
-            boards_data = f.read().strip()
-            boards = json.loads(boards_data) if boards_data else []
+          board, boards = self._load_board(board_id)
         except FileNotFoundError:
           return json.dumps({"error": "Board database not found"})
 
-    # Look for the task in all boards
-        task_found = False
-        for board in boards:
-          tasks = board.get("tasks", [])
-          for task in tasks:
-            if task["id"] == task_id:
-                task["status"] = new_status
-                task["last_updated"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                task_found = True
-                break
-          if task_found:
-            break
+    # Look for the task only in the board that owns it
+        task_found = None
+        for task in (board or {}).get("tasks", []):
+          if task["id"] == task_id:
+              task["status"] = new_status
+              task["last_updated"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+              task_found = task
+              break
 
         if not task_found:
           return json.dumps({"error": "Task not found"})
 
-    # Save the updated data back
-        with open("db/project_board_base.json", "w") as f:
-          json.dump(boards, f, indent=4)
+    # Save the updated data back, the transition goes to the status history
+        history = status_history.get_history(self.layout)
+        self._save_board(board_id, boards)
+        index.update_task(board_id, task_found)
+        index.synced("boards")
+        history.record([(board_id, task_id, new_status, task_found["last_updated"])])
 
         return json.dumps({"message": "Task status updated successfully"})
 
 
 
     # list all open boards for a team
+    @cached_response("list_boards", "teams", "boards")
     def list_boards(self, request: str) -> str:
         """
         :param request: A json string with the team identifier
@@ -287,39 +334,36 @@ class ProjectBoardBase:
             "name" : "<board_name>"
           }
         ]
+
+        Lists the boards with at least one task assigned to a member of the team
+        (or, for tasks of older versions, to the team id itself).
         """
         
-        data = json.loads(request)
-
-        team_id = data.get("id")
-        if not team_id:
-          return json.dumps({"error": "Missing team id"})
+        data, error = request_schema.parse_request("list_boards", request)
+        if error:
+          return error
+        team_id = data["id"]
 
     # Validate team exists
-        try:
-
-          with open("db/team_base.json", "r") as f:
-            content = f.read().strip()
-            teams = json.loads(content) if content else []
-        except FileNotFoundError:
+        index = index_store.get_index(self.layout)
+        if not storage.collection_exists(self.layout.path("teams")):
           return json.dumps({"error": "TeamBase not found"})
 
-        if not any(team.get("id") == team_id for team in teams):
+        if team_id not in index.team_by_id:
           return json.dumps({"error": "Team ID does not exist"})
         # Read boards
         try:
-          with open("db/project_board_base.json", "r") as f:
-            content = f.read().strip()
-            boards = json.loads(content) if content else []
+          boards = storage.load_collection(self.layout.path("boards"))
         except FileNotFoundError:
           return json.dumps({"error": "Board database not found"})
 
     # Find boards with at least one task assigned to the team
+        assignees = index.team_assignees(team_id) | {team_id}
         result = []
         for board in boards:
           for task in board.get("tasks", []):
 
-            if task.get("user_id") == team_id:
+            if task.get("user_id") in assignees:
                 result.append({
                     "id": board["id"],
                     "board_name": board["board_name"]
@@ -330,72 +374,365 @@ class ProjectBoardBase:
 
     def export_board(self, request: str) -> str:
         """
-        Export a board in the out folder. The output will be a txt file.
+        Export a board in the out folder. The output will be a txt file, or the format asked for.
         We want you to be creative. Output a presentable view of the board and its tasks with the available data.
         :param request:
         {
-          "id" : "<board_id>"
+          "id" : "<board_id>",
+          "format" : "<optional, text | markdown | html | csv, default text>"
         }
         :return:
         {
           "out_file" : "<name of the file created>"
         }
         """
-        data = json.loads(request)
-        board_id = data.get("id")
-        if not board_id:
-          return json.dumps({"error": "Missing board id"})
+        data, error = request_schema.parse_request("export_board", request)
+        if error:
+          return error
+        board_id = data["id"]
 
-    # Load boards
+    # Load the board, boards closed long ago are read from the archive
         try:
-          with open("db/project_board_base.json", "r") as f:
-            content = f.read().strip()
-            boards = json.loads(content) if content else []
+          board, _ = self._load_board(board_id)
         except FileNotFoundError:
           return json.dumps({"error": "Board database not found"})
 
-    # Find the board
-        board = next((b for b in boards if b["id"] == board_id), None)
+        board = board or board_archive.load_board(self.layout, board_id)
         if not board:
           return json.dumps({"error": "Board not found"})
 
-        board_name = board.get("name", "Unnamed Board")
-        board_status = board.get("status", "UNKNOWN")
+        board_name = board.get("board_name") or "Unnamed Board"
         tasks = board.get("tasks", [])
-
-        # Prepare content
-        output_lines = [
-          f"BOARD NAME     : {board_name}",
-          f"BOARD ID       : {board_id}",
-          f"STATUS         : {board_status}",
-          f"TASK COUNT     : {len(tasks)}",
-          f"EXPORT TIME    : {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
-          "-" * 60
-        ]
-
-        if tasks:
-          for idx, task in enumerate(tasks, start=1):
-            output_lines.append(f"TASK {idx}")
-            output_lines.append(f"  ID          : {task.get('id')}")
-            output_lines.append(f"  Title       : {task.get('title')}")
-            output_lines.append(f"  Description : {task.get('description', '')}")
-            output_lines.append(f"  Assigned To : {task.get('user_id')}")
-            output_lines.append(f"  Status      : {task.get('status')}")
-            output_lines.append(f"  Created At  : {task.get('creation_time')}")
-            output_lines.append("-" * 60)
-        else:
-          output_lines.append("No tasks available in this board.")
+        renderer = export_renderers.RENDERERS[data.get("format") or "text"]
 
     # Ensure output folder exists
-        os.makedirs("out", exist_ok=True)
+        os.makedirs(self.layout.out_dir, exist_ok=True)
 
     # Create file name
         safe_board_name = "".join(c if c.isalnum() else "_" for c in board_name)
-        filename = f"{safe_board_name}_{board_id}.txt"
-        filepath = os.path.join("out", filename)
-
-    # Write to file
-        with open(filepath, "w") as f:
-          f.write("\n".join(output_lines))
+        filename = f"{safe_board_name}_{board_id}{renderer.extension}"
+        filepath = os.path.join(self.layout.out_dir, filename)
+
+    # Stream the report to the file, a task at a time
+        with open(filepath, "w", newline="", buffering=1 << 16) as f:
+          renderer.write(f, {
+              "board_name": board_name,
+              "board_id": board_id,
+              "status": board.get("status", "UNKNOWN"),
+              "task_count": len(tasks),
+              "export_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+          }, tasks)
 
         return json.dumps({"out_file": filename})
+
+    # delete a board with its tasks
+    @storage.serialized("boards")
+    def delete_board(self, request: str) -> str:
+        """
+        :param request: A json string with the board identifier
+        {
+          "id" : "<board_id>",
+          "dry_run" : <optional bool, only report what would be deleted>
+        }
+        :return: A json string with the response
+        {
+          "message" : "Board deleted",
+          "impact" : {"archived" : <bool, the board was in the archive>, "tasks" : <tasks deleted>}
+        }
+        A dry run returns {"dry_run" : true, "impact" : {...}} and changes nothing.
+        """
+        data, error = request_schema.parse_request("delete_board", request)
+        if error:
+          return error
+        board_id = data["id"]
+
+        index = index_store.get_index(self.layout)
+        archived = board_id not in index.board_by_id
+        if archived and not board_archive.is_archived(self.layout, board_id):
+          return json.dumps({"error": "Board not found"})
+
+        impact = {"archived": archived, "tasks": cascade.count_tasks(self.layout, index, [board_id])}
+        if data.get("dry_run"):
+          return json.dumps({"dry_run": True, "impact": impact})
+
+        with storage.transaction():
+          # fetched in the transaction, so a rollback also drops the index changes
+          index = index_store.get_index(self.layout)
+          cascade.apply(self.layout, index, drop_boards=[board_id])
+          cascade.record_tombstone(self.layout, "board", board_id, impact)
+
+        return json.dumps({"message": "Board deleted", "impact": impact})
+
+    # list the tasks of a board, a page at a time
+    @cached_response("list_tasks", "boards")
+    def list_tasks(self, request: str) -> str:
+        """
+        :param request: A json string with the board identifier and paging details
+        {
+          "id" : "<board_id>",
+          "limit" : <optional, max tasks to return, default 50, from 1 to 500>,
+          "after" : "<optional, the next cursor of the previous page>",
+          "status" : "<optional, OPEN | IN_PROGRESS | COMPLETE>",
+          "fields" : ["<optional, task fields to return, e.g. id, title, status>"]
+        }
+        :return: A json string with the response, tasks in creation order
+        {
+          "tasks" : [
+            {
+              "id" : "<task_id>",
+              "title" : "<task title>",
+              ...
+            }
+          ],
+          "next" : "<cursor of the next page, null on the last page>"
+        }
+        """
+        data, error = request_schema.parse_request("list_tasks", request)
+        if error:
+          return error
+        board_id = data["id"]
+        limit = data.get("limit") or 50
+        status = data.get("status")
+        fields = data.get("fields") or request_schema.TASK_FIELDS
+
+        unknown = [f for f in fields if f not in request_schema.TASK_FIELDS]
+        if unknown:
+          return json.dumps({"error": f"Unknown task fields: {', '.join(unknown)}"})
+
+        try:
+          boards = storage.load_collection(self.layout.path("boards"))
+        except FileNotFoundError:
+          return json.dumps({"error": "Board database not found"})
+
+        board = next((b for b in boards if b["id"] == board_id), None) or board_archive.load_board(self.layout, board_id)
+        if not board:
+          return json.dumps({"error": "Board not found"})
+        tasks = board.get("tasks", [])
+
+        start = 0
+        if data.get("after"):
+          start = _cursor_position(tasks, data["after"])
+          if start is None:
+            return json.dumps({"error": "Invalid cursor"})
+
+        page = []
+        position = start
+        while position < len(tasks) and len(page) < limit:
+          task = tasks[position]
+          position += 1
+          if status and task.get("status") != status:
+            continue
+          page.append({field: task.get(field) for field in fields})
+
+        # a full page with tasks left to look at gets a cursor, even if they are all filtered out
+        next_cursor = None
+        if len(page) == limit and position < len(tasks):
+          next_cursor = _make_cursor(position - 1, tasks[position - 1]["id"])
+
+        return json.dumps({"tasks": page, "next": next_cursor})
+
+    # full-text search over task titles and descriptions
+    def search_tasks(self, request: str) -> str:
+        """
+        :param request: A json string with the search details
+        {
+          "query" : "<words to search for>",
+          "board_id" : "<optional, only tasks of this board>",
+          "team_id" : "<optional, only tasks of this team's boards>",
+          "prefix" : <optional bool, match words starting with the query terms>,
+          "limit" : <optional, max results, default 20, from 1 to 100>,
+          "offset" : <optional, results to skip, default 0>
+        }
+        :return: A json string with the response, best match first
+        {
+          "total" : <number of matching tasks>,
+          "results" : [
+            {
+              "id" : "<task_id>",
+              "board_id" : "<board_id>",
+              "title" : "<task title>",
+              "score" : <relevance>
+            }
+          ]
+        }
+
+        Constraint:
+         * a task matches when its title or description contains every query term
+         * title matches rank higher than description matches
+        """
+        data, error = request_schema.parse_request("search_tasks", request)
+        if error:
+          return error
+
+        limit = data.get("limit") or 20
+        offset = data.get("offset") or 0
+
+        search = index_store.get_index(self.layout).extras["search"]
+        matches = search.search(data["query"], data.get("board_id"), data.get("team_id"), data.get("prefix", False))
+
+        results = []
+        for score, task_id in matches[offset:offset + limit]:
+          board_id, _, title = search.tasks[task_id]
+          results.append({
+              "id": task_id,
+              "board_id": board_id,
+              "title": title,
+              "score": round(score, 4)
+          })
+
+        return json.dumps({"total": len(matches), "results": results})
+
+    # open and finished tasks per assignee
+    def user_workload(self, request: str) -> str:
+        """
+        :param request: A json string with the user or team identifier
+        {
+          "user_id" : "<user_id, or give team_id>",
+          "team_id" : "<team_id, every member of the team>"
+        }
+        :return: A json string with the task counts of the user
+        {
+          "user_id" : "<user_id>",
+          "OPEN" : <count>,
+          "IN_PROGRESS" : <count>,
+          "COMPLETE" : <count>,
+          "open" : <tasks not COMPLETE>
+        }
+        or, for a team, {"team_id" : "<team_id>", "members" : [<the same per member>]}, least loaded first
+
+        Constraint:
+         * counts cover the tasks of the boards not archived yet
+        """
+        data, error = request_schema.parse_request("user_workload", request)
+        if error:
+          return error
+
+        index = index_store.get_index(self.layout)
+        workload = index.extras["workload"]
+        if data.get("user_id"):
+          user_id = data["user_id"]
+          if user_id not in index.user_by_id:
+            return json.dumps({"error": "User not found"})
+          return json.dumps({"user_id": user_id, **workload.workload(user_id)})
+
+        if not data.get("team_id"):
+          return json.dumps({"error": "Missing user_id or team_id"})
+        team_id = data["team_id"]
+        if team_id not in index.team_by_id:
+          return json.dumps({"error": "Team id does not exist"})
+        members = [{"user_id": user_id, **workload.workload(user_id)}
+                   for user_id in index.team_assignees(team_id)]
+        members.sort(key=lambda member: (member["open"], member["user_id"]))
+        return json.dumps({"team_id": team_id, "members": members})
+
+    # daily burndown of a board or team
+    def board_burndown(self, request: str) -> str:
+        """
+        :param request: A json string with the board or team identifier
+        {
+          "board_id" : "<board_id, or give team_id>",
+          "team_id" : "<team_id, all boards of the team>",
+          "from" : "<optional, first day YYYY-MM-DD, default the first task of the boards>",
+          "to" : "<optional, last day YYYY-MM-DD, default today>"
+        }
+        :return: A json string with one value per day
+        {
+          "days" : ["<YYYY-MM-DD>", ...],
+          "total" : [<tasks on the boards>, ...],
+          "remaining" : [<tasks not COMPLETE>, ...],
+          "complete" : [<tasks COMPLETE>, ...]
+        }
+        """
+        days, flow = self._daily_flow("board_burndown", request)
+        if flow is None:
+          return days
+
+        total = [sum(counts) for counts in zip(*flow.values())]
+        return json.dumps({
+            "days": days,
+            "total": total,
+            "remaining": [count - complete for count, complete in zip(total, flow["COMPLETE"])],
+            "complete": flow["COMPLETE"]
+        })
+
+    # daily cumulative flow of a board or team
+    def cumulative_flow(self, request: str) -> str:
+        """
+        :param request: A json string with the board or team identifier, as for board_burndown
+        :return: A json string with the number of tasks in each status at the end of every day
+        {
+          "days" : ["<YYYY-MM-DD>", ...],
+          "OPEN" : [<count>, ...],
+          "IN_PROGRESS" : [<count>, ...],
+          "COMPLETE" : [<count>, ...]
+        }
+        """
+        days, flow = self._daily_flow("cumulative_flow", request)
+        if flow is None:
+          return days
+        return json.dumps(dict(flow, days=days))
+
+    def _daily_flow(self, method, request):
+        """
+        :return: (list of days, {status: [count per day]}) or (json error string, None)
+        """
+        data, error = request_schema.parse_request(method, request)
+        if error:
+          return error, None
+
+        index = index_store.get_index(self.layout)
+        if data.get("board_id"):
+          board_ids = [data["board_id"]]
+          if data["board_id"] not in index.board_by_id and not board_archive.is_archived(self.layout, data["board_id"]):
+            return json.dumps({"error": "Board not found"}), None
+        elif data.get("team_id"):
+          team_id = data["team_id"]
+          if team_id not in index.team_by_id:
+            return json.dumps({"error": "Team id does not exist"}), None
+          archived = board_archive.load_archive_index(self.layout)["boards"]
+          board_ids = index.team_boards.get(team_id, []) + [
+              board_id for board_id, entry in archived.items() if entry["team_id"] == team_id]
+        else:
+          return json.dumps({"error": "Missing board_id or team_id"}), None
+
+        history = status_history.get_history(self.layout)
+        try:
+          last = datetime.strptime(data["to"], "%Y-%m-%d").date() if data.get("to") else datetime.now().date()
+          first = datetime.strptime(data["from"], "%Y-%m-%d").date() if data.get("from") else None
+        except ValueError:
+          return json.dumps({"error": "Invalid date, expected YYYY-MM-DD"}), None
+        first = first or history.first_day(board_ids) or last
+
+        count = (last - first).days + 1
+        if count < 1:
+          return json.dumps({"error": "from must not be after to"}), None
+        if count > status_history.MAX_DAYS:
+          return json.dumps({"error": f"Date range exceeds {status_history.MAX_DAYS} days"}), None
+
+        days = [(first + timedelta(days=day)).isoformat() for day in range(count)]
+        return days, history.flow(board_ids, first, count)
+
+
+def _make_cursor(position, task_id):
+    """Opaque keyset cursor: the position and id of the last task of a page."""
+    return base64.urlsafe_b64encode(f"{position}:{task_id}".encode("utf-8")).decode("ascii")
+
+
+def _cursor_position(tasks, cursor):
+    """
+    :return: index of the first task after the cursor, or None for a malformed cursor.
+    The id is checked at the recorded position first, so paging stays O(limit); if
+    tasks moved, the id is looked up instead.
+    """
+    try:
+        position, task_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split(":", 1)
+        position = int(position)
+    except (ValueError, UnicodeError):
+        return None
+
+    if 0 <= position < len(tasks) and tasks[position].get("id") == task_id:
+        return position + 1
+    for index, task in enumerate(tasks):
+        if task.get("id") == task_id:
+            return index + 1
+    return None
@@ -0,0 +1,162 @@
+"""
+Compact on-disk encoding of the collection records.
+
+A compact collection file is still a JSON list, written one record per line
+without indentation, whose first element is the marker {"$codec": "compact-1"}.
+In its records
+    * ids (id, team_id, user_id, admin, members) are the 16 bytes of the UUID in
+      url-safe base64 (22 characters); an id that is not a UUID is kept as "~<id>"
+    * creation_time, end_time and last_updated are integer wall-clock seconds
+    * statuses are indexes in STATUS_CODES
+and nested task lists are encoded the same way.
+
+storage.py decodes compact files transparently on every read, so the managers
+and the API responses only ever see the documented format. Values that do not
+fit the compact form (a malformed time, an unknown status) are kept as they are.
+
+Convert the collections of a db folder with
+    python record_codec.py [--db db] --to compact|json
+"""
+import argparse
+import base64
+import binascii
+import calendar
+import functools
+import os
+import sys
+import time
+import uuid
+
+CODEC_JSON = "json"
+CODEC_COMPACT = "compact"
+
+MARKER = {"$codec": "compact-1"}
+
+ID_FIELDS = ("id", "team_id", "user_id", "admin")
+ID_LIST_FIELDS = ("members",)
+TIME_FIELDS = ("creation_time", "end_time", "last_updated")
+NESTED_FIELDS = ("tasks",)
+STATUS_CODES = ("OPEN", "IN_PROGRESS", "COMPLETE", "CLOSED")
+
+_STATUS_INDEX = {status: code for code, status in enumerate(STATUS_CODES)}
+_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def is_marker(record):
+    return isinstance(record, dict) and record.get("$codec") == MARKER["$codec"]
+
+
+# ------------------- values -------------------
+
+def _encode_id(value):
+    if not isinstance(value, str):
+        return value
+    try:
+        parsed = uuid.UUID(value)
+    except ValueError:
+        return "~" + value
+    if str(parsed) != value:
+        return "~" + value
+    return base64.urlsafe_b64encode(parsed.bytes)[:22].decode("ascii")
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def _decode_id(value):
+    if value.startswith("~"):
+        return value[1:]
+    digits = binascii.a2b_base64(value.replace("-", "+").replace("_", "/") + "==").hex()
+    return f"{digits[:8]}-{digits[8:12]}-{digits[12:16]}-{digits[16:20]}-{digits[20:]}"
+
+
+def _encode_time(value):
+    try:
+        return calendar.timegm(time.strptime(value, _TIME_FORMAT))
+    except (TypeError, ValueError):
+        return value
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def _decode_time(value):
+    return time.strftime(_TIME_FORMAT, time.gmtime(value))
+
+
+# ------------------- records -------------------
+
+def encode(record):
+    """:return: a compact copy of a record"""
+    encoded = dict(record)
+    for field in ID_FIELDS:
+        if field in encoded:
+            encoded[field] = _encode_id(encoded[field])
+    for field in ID_LIST_FIELDS:
+        if isinstance(encoded.get(field), list):
+            encoded[field] = [_encode_id(value) for value in encoded[field]]
+    for field in TIME_FIELDS:
+        if isinstance(encoded.get(field), str):
+            encoded[field] = _encode_time(encoded[field])
+    if encoded.get("status") in _STATUS_INDEX:
+        encoded["status"] = _STATUS_INDEX[encoded["status"]]
+    for field in NESTED_FIELDS:
+        if isinstance(encoded.get(field), list):
+            encoded[field] = [encode(item) for item in encoded[field]]
+    return encoded
+
+
+def _decode_id_value(value):
+    return _decode_id(value) if value.__class__ is str else value
+
+
+def _decode_id_list(values):
+    if values.__class__ is not list:
+        return values
+    return [_decode_id(value) if value.__class__ is str else value for value in values]
+
+
+def _decode_time_value(value):
+    return _decode_time(value) if value.__class__ is int else value
+
+
+def _decode_status(value):
+    return STATUS_CODES[value] if value.__class__ is int and 0 <= value < len(STATUS_CODES) else value
+
+
+_DECODERS = {field: _decode_id_value for field in ID_FIELDS}
+_DECODERS.update({field: _decode_id_list for field in ID_LIST_FIELDS})
+_DECODERS.update({field: _decode_time_value for field in TIME_FIELDS})
+_DECODERS["status"] = _decode_status
+
+
+def decode_object(record):
+    """
+    Turn one compact object back into the documented format, in place. Meant as the
+    object_hook of the json decoder, which calls it for the nested tasks first.
+    """
+    for field, value in record.items():
+        decoder = _DECODERS.get(field)
+        if decoder is not None:
+            record[field] = decoder(value)
+    return record
+
+
+def main(argv=None):
+    import storage  # storage imports this module, so import it only when run as a script
+
+    parser = argparse.ArgumentParser(description="Rewrite the collections of a db folder in another encoding.")
+    parser.add_argument("--db", default=storage.DB_DIR, help="db folder, db by default")
+    parser.add_argument("--to", required=True, choices=(CODEC_COMPACT, CODEC_JSON))
+    args = parser.parse_args(argv)
+
+    layout = storage.Layout(args.db, codec=args.to)
+    for name in storage.COLLECTION_FILES:
+        path = layout.path(name)
+        try:
+            records = storage.load_collection(path)
+        except FileNotFoundError:
+            continue
+        storage.save_collection(path, records)
+        print(f"{path}: {len(records)} records, {os.path.getsize(path)} bytes")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
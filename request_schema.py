@@ -0,0 +1,252 @@
+"""
+Request parsing shared by all the managers.
+
+Every API method declares the shape of its request in SCHEMAS (required fields,
+types and the max lengths from the method docstrings). The schemas are compiled
+once at import time and a request is checked against them before the method
+touches any file, so malformed input is rejected with a json error response
+instead of raising KeyError / JSONDecodeError halfway through a method.
+"""
+import json
+
+STRING = "string"
+INTEGER = "integer"
+BOOLEAN = "boolean"
+LIST = "list"
+OBJECT = "object"
+
+_PY_TYPES = {
+    STRING: str,
+    INTEGER: int,
+    BOOLEAN: bool,
+    LIST: list,
+    OBJECT: dict,
+}
+
+TASK_STATUSES = ("OPEN", "IN_PROGRESS", "COMPLETE")
+TASK_FIELDS = ("id", "title", "description", "user_id", "status", "creation_time", "last_updated")
+MAX_TEAM_MEMBERS = 50
+EXPORT_FORMATS = ("text", "markdown", "html", "csv")
+
+
+def field(kind, required=True, max_length=None, choices=None, items=None, schema=None, min_length=0):
+    """
+    Describe one request field.
+    :param kind: STRING | INTEGER | BOOLEAN | LIST | OBJECT
+    :param min_length: min characters of a STRING, 1 rejects empty ids and names, or min value of an INTEGER
+    :param max_length: max characters of a STRING, or max value of an INTEGER
+    :param choices: allowed values of a STRING
+    :param items: kind of the elements of a LIST
+    :param schema: nested field dict of an OBJECT, or of every OBJECT item of a LIST
+    """
+    return {
+        "kind": kind,
+        "required": required,
+        "max_length": max_length,
+        "choices": choices,
+        "items": items,
+        "schema": schema,
+        "min_length": min_length,
+    }
+
+
+_ID = field(STRING, min_length=1)
+_IDEMPOTENCY_KEY = field(STRING, required=False, max_length=128)
+_DAILY_SERIES = {
+    "board_id": field(STRING, required=False),
+    "team_id": field(STRING, required=False),
+    "from": field(STRING, required=False, max_length=10),
+    "to": field(STRING, required=False, max_length=10),
+}
+
+SCHEMAS = {
+    # UserBase
+    "create_user": {
+        "name": field(STRING, max_length=64, min_length=1),
+        "display_name": field(STRING, max_length=64),
+        "description": field(STRING, required=False),
+        "idempotency_key": _IDEMPOTENCY_KEY,
+    },
+    "describe_user": {"id": _ID},
+    "update_user": {
+        "id": _ID,
+        "user": field(OBJECT, required=False, schema={
+            "name": field(STRING, required=False, max_length=64),
+            "display_name": field(STRING, required=False, max_length=128),
+        }),
+    },
+    "get_user_teams": {"id": _ID},
+    "delete_user": {
+        "id": _ID,
+        "reassign_to": field(STRING, required=False, min_length=1),
+        "dry_run": field(BOOLEAN, required=False),
+    },
+
+    # TeamBase
+    "create_team": {
+        "team_name": field(STRING, max_length=64, min_length=1),
+        "team_description": field(STRING, max_length=128),
+        "admin": field(STRING, min_length=1),
+        "idempotency_key": _IDEMPOTENCY_KEY,
+    },
+    "describe_team": {"id": _ID},
+    "update_team": {
+        "id": _ID,
+        "team": field(OBJECT, required=False, schema={
+            "team_name": field(STRING, required=False, max_length=64),
+            "description_name": field(STRING, required=False, max_length=128),
+            "admin": field(STRING, required=False),
+        }),
+    },
+    "add_users_to_team": {
+        "id": _ID,
+        "users": field(LIST, required=False, items=STRING),
+    },
+    "remove_users_from_team": {
+        "id": _ID,
+        "users": field(LIST, required=False, items=STRING),
+    },
+    "update_team_members": {
+        "teams": field(LIST, items=OBJECT, schema={
+            "id": _ID,
+            "add": field(LIST, required=False, items=STRING),
+            "remove": field(LIST, required=False, items=STRING),
+        }),
+    },
+    "list_team_users": {"id": _ID},
+    "delete_team": {"id": _ID, "dry_run": field(BOOLEAN, required=False)},
+
+    # ProjectBoardBase
+    "create_board": {
+        "board_name": field(STRING, max_length=64, min_length=1),
+        "board_description": field(STRING, max_length=128),
+        "team_id": field(STRING, min_length=1),
+        "idempotency_key": _IDEMPOTENCY_KEY,
+    },
+    "close_board": {"id": _ID},
+    "add_task": {
+        "id": _ID,
+        "title": field(STRING, max_length=64, min_length=1),
+        "description": field(STRING, max_length=128),
+        # required unless auto_assign is set, checked by add_task
+        "user_id": field(STRING, required=False, min_length=1),
+        "auto_assign": field(BOOLEAN, required=False),
+        "creation_time": field(STRING, required=False),
+        "idempotency_key": _IDEMPOTENCY_KEY,
+    },
+    "update_task_status": {
+        "id": _ID,
+        "status": field(STRING, choices=TASK_STATUSES),
+    },
+    "list_boards": {"id": _ID},
+    "export_board": {"id": _ID, "format": field(STRING, required=False, choices=EXPORT_FORMATS)},
+    "delete_board": {"id": _ID, "dry_run": field(BOOLEAN, required=False)},
+    "list_tasks": {
+        "id": _ID,
+        "limit": field(INTEGER, required=False, max_length=500, min_length=1),
+        "after": field(STRING, required=False),
+        "status": field(STRING, required=False, choices=TASK_STATUSES),
+        "fields": field(LIST, required=False, items=STRING),
+    },
+    "search_tasks": {
+        "query": field(STRING, max_length=256, min_length=1),
+        "board_id": field(STRING, required=False),
+        "team_id": field(STRING, required=False),
+        "prefix": field(BOOLEAN, required=False),
+        "limit": field(INTEGER, required=False, max_length=100, min_length=1),
+        "offset": field(INTEGER, required=False),
+    },
+    "user_workload": {
+        "user_id": field(STRING, required=False),
+        "team_id": field(STRING, required=False),
+    },
+    "board_burndown": _DAILY_SERIES,
+    "cumulative_flow": _DAILY_SERIES,
+}
+
+
+def _compile(schema):
+    """
+    Turn a field dict into a tuple of checks:
+    (name, python type, kind, required, min_length, max_length, choices set, item type, nested checks)
+    """
+    checks = []
+    for name, spec in schema.items():
+        checks.append((
+            name,
+            _PY_TYPES[spec["kind"]],
+            spec["kind"],
+            spec["required"],
+            spec["min_length"],
+            spec["max_length"],
+            frozenset(spec["choices"]) if spec["choices"] else None,
+            _PY_TYPES[spec["items"]] if spec["items"] else None,
+            _compile(spec["schema"]) if spec["schema"] else None,
+        ))
+    return tuple(checks)
+
+
+_COMPILED = {method: _compile(schema) for method, schema in SCHEMAS.items()}
+
+
+def _validate(checks, data, prefix=""):
+    for name, py_type, kind, required, min_length, max_length, choices, item_type, nested in checks:
+        if data.get(name) is None:
+            if required:
+                return f"Missing {prefix}{name}"
+            # an explicit null means absent, so the handlers' defaults apply to it
+            data.pop(name, None)
+            continue
+
+        value = data[name]
+        # bool is a subclass of int, an INTEGER field must not accept true/false
+        if not isinstance(value, py_type) or (py_type is int and isinstance(value, bool)):
+            return f"{prefix}{name} must be a {kind}"
+        if py_type is bool:
+            continue
+        if py_type is int:
+            if value < 0 and not min_length:
+                return f"{prefix}{name} must not be negative"
+            if value < min_length:
+                return f"{prefix}{name} must be at least {min_length}"
+            if max_length is not None and value > max_length:
+                return f"{prefix}{name} exceeds {max_length}"
+            continue
+        if len(value) < min_length:
+            return f"Missing {prefix}{name}"
+        if max_length is not None and len(value) > max_length:
+            return f"{prefix}{name} exceeds {max_length} characters"
+        if choices is not None and value not in choices:
+            return f"Invalid {prefix}{name} value"
+        if item_type is not None and not all(isinstance(item, item_type) for item in value):
+            return f"Invalid {prefix}{name} format. Expected a list of {item_type.__name__} values"
+        if nested is not None and py_type is list:
+            for position, item in enumerate(value):
+                error = _validate(nested, item, f"{prefix}{name}[{position}].")
+                if error:
+                    return error
+        elif nested is not None:
+            error = _validate(nested, value, prefix + name + ".")
+            if error:
+                return error
+    return None
+
+
+def parse_request(method, request):
+    """
+    Parse and validate the request of an API method. Optional fields sent as null
+    are dropped from data.
+    :return: (data, None) for a valid request, (None, <json error string>) otherwise
+    """
+    try:
+        data = json.loads(request)
+    except (TypeError, ValueError):
+        return None, json.dumps({"error": "Request is not valid JSON"})
+
+    if not isinstance(data, dict):
+        return None, json.dumps({"error": "Request must be a JSON object"})
+
+    error = _validate(_COMPILED[method], data)
+    if error:
+        return None, json.dumps({"error": error})
+    return data, None
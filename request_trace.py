@@ -0,0 +1,320 @@
+"""
+Record the calls made to the API managers and replay them as a load test.
+
+Recording is opt-in: wrap the managers with a TraceRecorder (main.py does it when
+PLANNER_TRACE=<trace file> is set)
+
+    recorder = TraceRecorder("trace.ndjson")
+    user_api = recorder.wrap(UserBase())
+
+and every call appends one line to the trace:
+
+    {"ts": <epoch seconds>, "api": "UserBase", "method": "create_user",
+     "args": ["<request json>"], "ms": <latency>, "response": "<only for calls that create ids>"}
+
+Replay re-executes a trace against a fresh db folder. Ids returned by the
+recorded create calls are mapped to the ids the replay creates, and a call that
+uses such an id waits until the call creating it finished, so a trace replays
+correctly with several concurrent callers. The managers rewrite whole collection
+files, so concurrent callers overlap reads with each other but never with a write.
+
+Usage:
+    python request_trace.py TRACE [--db DIR] [--speed 1.0] [--concurrency 1] [--durability strict]
+
+--speed scales the recorded pacing (2 replays twice as fast, 0 sends as fast as
+possible), --durability picks the storage durability mode to measure. The report
+gives throughput and latency percentiles per method.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import storage
+from user_base import UserBase
+from team_base import TeamBase
+from project_board_base import ProjectBoardBase
+
+TRACE_ENV = "PLANNER_TRACE"
+
+# calls whose {"id": ...} response is referenced by later calls
+ID_CREATING_METHODS = ("create_user", "create_team", "create_board", "add_task")
+
+API_CLASSES = {cls.__name__: cls for cls in (UserBase, TeamBase, ProjectBoardBase)}
+
+# calls that only read the collections, everything else is replayed as a write
+READ_METHODS = (
+    "list_users", "describe_user", "get_user_teams", "list_teams", "describe_team", "list_team_users",
+    "list_boards", "export_board", "list_tasks", "search_tasks", "user_workload", "board_burndown",
+    "cumulative_flow",
+)
+
+PERCENTILES = (50, 90, 99)
+
+
+class TraceRecorder:
+    """Appends one NDJSON line per API call to a trace file; shared by all the wrapped managers."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, "a", buffering=1)
+
+    def wrap(self, api):
+        return _RecordingProxy(api, self)
+
+    def write(self, entry):
+        line = json.dumps(entry) + "\n"
+        with self.lock:
+            self.file.write(line)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class _RecordingProxy:
+    def __init__(self, api, recorder):
+        self._api = api
+        self._recorder = recorder
+
+    def __getattr__(self, name):
+        attribute = getattr(self._api, name)
+        if name.startswith("_") or not callable(attribute):
+            return attribute
+
+        api_name = type(self._api).__name__
+
+        def call(*args):
+            started = time.time()
+            clock = time.perf_counter()
+            response = attribute(*args)
+            entry = {
+                "ts": started,
+                "api": api_name,
+                "method": name,
+                "args": list(args),
+                "ms": round((time.perf_counter() - clock) * 1000, 3),
+            }
+            if name in ID_CREATING_METHODS:
+                entry["response"] = response
+            self._recorder.write(entry)
+            return response
+        return call
+
+
+def wrap_from_env(*apis):
+    """
+    :return: the apis wrapped in a TraceRecorder writing to $PLANNER_TRACE, or unchanged if it is not set
+    """
+    path = os.environ.get(TRACE_ENV)
+    if not path:
+        return apis
+    recorder = TraceRecorder(path)
+    return tuple(recorder.wrap(api) for api in apis)
+
+
+def load_trace(path):
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _created_id(response):
+    try:
+        created = json.loads(response)
+    except (TypeError, ValueError):
+        return None
+    return created.get("id") if isinstance(created, dict) else None
+
+
+class _IdMap:
+    """Recorded id -> replayed id, with a wait for ids whose create call is still running."""
+
+    def __init__(self, pending_ids):
+        self.ids = {}
+        self.events = {recorded_id: threading.Event() for recorded_id in pending_ids}
+
+    def resolve(self, recorded_id, timeout=30):
+        event = self.events.get(recorded_id)
+        if event is None:
+            return recorded_id
+        event.wait(timeout)
+        return self.ids.get(recorded_id, recorded_id)
+
+    def created(self, recorded_id, replayed_id):
+        if replayed_id:
+            self.ids[recorded_id] = replayed_id
+        self.events[recorded_id].set()
+
+    def remap(self, value):
+        if isinstance(value, str):
+            if value in self.events:
+                return self.resolve(value)
+            try:
+                parsed = json.loads(value)
+            except ValueError:
+                return value
+            if isinstance(parsed, (dict, list)):
+                return json.dumps(self.remap(parsed))
+            return value
+        if isinstance(value, list):
+            return [self.remap(item) for item in value]
+        if isinstance(value, dict):
+            return {key: self.remap(item) for key, item in value.items()}
+        return value
+
+
+class _ReadWriteLock:
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.readers = 0
+        self.writing = False
+
+    def acquire(self, write):
+        with self.condition:
+            while self.writing or (write and self.readers):
+                self.condition.wait()
+            if write:
+                self.writing = True
+            else:
+                self.readers += 1
+
+    def release(self, write):
+        with self.condition:
+            if write:
+                self.writing = False
+            else:
+                self.readers -= 1
+            self.condition.notify_all()
+
+
+def _percentile(sorted_values, percentile):
+    if not sorted_values:
+        return None
+    rank = max(int(round(percentile / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def _summary(latencies):
+    latencies = sorted(latencies)
+    summary = {"calls": len(latencies)}
+    for percentile in PERCENTILES:
+        summary[f"p{percentile}_ms"] = _percentile(latencies, percentile)
+    summary["max_ms"] = latencies[-1] if latencies else None
+    return summary
+
+
+def replay(entries, db_dir, speed=1.0, concurrency=1):
+    """
+    Re-execute trace entries against db_dir.
+    :param speed: pacing factor of the recorded timestamps, 0 to send as fast as possible
+    :return: report dict with throughput, errors and latency percentiles overall and per method
+    """
+    os.makedirs(db_dir, exist_ok=True)
+    layout = storage.Layout(db_dir)
+    apis = {name: cls(layout) for name, cls in API_CLASSES.items()}
+
+    produced = [_created_id(entry.get("response")) for entry in entries]
+    id_map = _IdMap([recorded_id for recorded_id in produced if recorded_id])
+
+    latencies = {}
+    errors = {"calls": 0, "skipped": 0}
+    lock = threading.Lock()
+    slots = threading.Semaphore(concurrency)
+    collections = _ReadWriteLock()
+
+    def run(entry, recorded_id):
+        try:
+            api = apis[entry["api"]]
+            args = id_map.remap(entry.get("args", []))
+            write = entry["method"] not in READ_METHODS
+            collections.acquire(write)
+            try:
+                clock = time.perf_counter()
+                response = getattr(api, entry["method"])(*args)
+                elapsed = (time.perf_counter() - clock) * 1000
+            finally:
+                collections.release(write)
+            if recorded_id:
+                id_map.created(recorded_id, _created_id(response))
+            failed = isinstance(response, str) and response.startswith('{"error')
+            with lock:
+                latencies.setdefault(entry["method"], []).append(elapsed)
+                if failed:
+                    errors["calls"] += 1
+        except Exception:
+            with lock:
+                errors["calls"] += 1
+        finally:
+            if recorded_id and not id_map.events[recorded_id].is_set():
+                id_map.created(recorded_id, None)
+            slots.release()
+
+    first_ts = entries[0]["ts"] if entries else 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for entry, recorded_id in zip(entries, produced):
+            if entry.get("api") not in apis:
+                errors["skipped"] += 1
+                if recorded_id:
+                    id_map.created(recorded_id, None)
+                continue
+            if speed:
+                delay = (entry["ts"] - first_ts) / speed - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            slots.acquire()
+            pool.submit(run, entry, recorded_id)
+    # saves still pending in relaxed mode count towards the replay time
+    storage.flush()
+    elapsed = time.perf_counter() - started
+
+    all_latencies = [latency for values in latencies.values() for latency in values]
+    return {
+        "db": db_dir,
+        "calls": len(all_latencies),
+        "errors": errors["calls"],
+        "skipped": errors["skipped"],
+        "seconds": round(elapsed, 3),
+        "throughput_per_s": round(len(all_latencies) / elapsed, 1) if elapsed else None,
+        "latency": {key: round(value, 3) if isinstance(value, float) else value
+                    for key, value in _summary(all_latencies).items()},
+        "methods": {
+            method: {key: round(value, 3) if isinstance(value, float) else value
+                     for key, value in _summary(values).items()}
+            for method, values in sorted(latencies.items())
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a recorded request trace against a fresh db.")
+    parser.add_argument("trace", help="trace file recorded with PLANNER_TRACE")
+    parser.add_argument("--db", help="fresh db folder to replay into, a new temporary folder by default")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="pacing factor of the recorded timestamps, 0 sends as fast as possible")
+    parser.add_argument("--concurrency", type=int, default=1, help="concurrent callers, 1 by default")
+    parser.add_argument("--durability", choices=storage.DURABILITY_MODES,
+                        help="storage durability mode, $PLANNER_DURABILITY or strict by default")
+    args = parser.parse_args(argv)
+
+    if args.concurrency < 1 or args.speed < 0:
+        parser.error("--concurrency must be at least 1 and --speed not negative")
+    db_dir = args.db or tempfile.mkdtemp(prefix="replay-db-")
+    if os.path.isdir(db_dir) and os.listdir(db_dir):
+        parser.error(f"{db_dir} is not empty, replay needs a fresh db folder")
+
+    if args.durability:
+        storage.set_durability(args.durability)
+    report = replay(load_trace(args.trace), db_dir, args.speed, args.concurrency)
+    report["durability"] = storage.durability()["mode"]
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
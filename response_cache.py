@@ -0,0 +1,155 @@
+"""
+Cache of serialized responses for the read APIs.
+
+The final json string returned by list_users, list_teams, describe_team,
+list_team_users and list_boards is kept in a size-bounded LRU keyed by method
+and (canonical) request. Every entry remembers the collections it was built
+from; storage.save_collection() drops the entries of the collection it rewrote,
+and a hit is only served while the checksums of those collections still match,
+so a file changed by another process is never answered from a stale entry.
+"""
+import functools
+import json
+import threading
+from collections import OrderedDict
+
+import storage
+
+MAX_ENTRIES = 4096
+MAX_BYTES = 16 * 1024 * 1024
+
+
+class ResponseCache:
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (response, {path: checksum})
+        self.by_path = {}             # path -> set(key)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                response, checksums = entry
+                if all(storage.file_checksum(path) == checksum for path, checksum in checksums.items()):
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return response
+                self._drop(key)
+                self.invalidations += 1
+            self.misses += 1
+            return None
+
+    def put(self, key, response, paths, checksums):
+        """
+        :param checksums: checksums of `paths` taken before the response was built,
+        so a write racing with the build makes the entry stale rather than wrong.
+        """
+        if len(response) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = (response, dict(zip(paths, checksums)))
+            self.size += len(response)
+            for path in paths:
+                self.by_path.setdefault(path, set()).add(key)
+
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                self._drop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate(self, path):
+        with self.lock:
+            for key in list(self.by_path.pop(path, ())):
+                self._drop(key)
+                self.invalidations += 1
+
+    def drop_layout(self, layout_key):
+        """Drop the entries of the responses built from one layout."""
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == layout_key]:
+                self._drop(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.by_path.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+            }
+
+    def _drop(self, key):
+        response, checksums = self.entries.pop(key)
+        self.size -= len(response)
+        for path in checksums:
+            keys = self.by_path.get(path)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.by_path[path]
+
+
+_cache = ResponseCache()
+storage.add_write_listener(_cache.invalidate)
+
+
+def get_cache():
+    return _cache
+
+
+def stats():
+    """
+    :return: A json string with the cache counters
+    {"entries": <int>, "bytes": <int>, "hits": <int>, "misses": <int>, "invalidations": <int>, "evictions": <int>}
+    """
+    return json.dumps(_cache.stats())
+
+
+def _request_key(request):
+    try:
+        return json.dumps(json.loads(request), sort_keys=True)
+    except (TypeError, ValueError):
+        return request
+
+
+def cached_response(method, *collections):
+    """
+    Decorator for a read API method whose response only depends on `collections`.
+    Works for methods with and without a request argument.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args):
+            if storage.current_transaction() is not None:
+                # the staged view of a transaction is not what the checksums describe
+                return func(self, *args)
+
+            paths = [self.layout.path(name) for name in collections]
+            key = (self.layout.key, method) + tuple(_request_key(arg) for arg in args)
+
+            response = _cache.get(key)
+            if response is not None:
+                return response
+
+            checksums = [storage.file_checksum(path) for path in paths]
+            response = func(self, *args)
+            _cache.put(key, response, paths, checksums)
+            return response
+        return wrapper
+    return decorator
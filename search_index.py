@@ -0,0 +1,130 @@
+"""
+Inverted index over task titles and descriptions, backing ProjectBoardBase.search_tasks.
+
+The index is registered as an extra board index (see index_store.py), so it is
+built once, persisted in the index sidecar and updated incrementally by add_task;
+a search never rescans the boards collection.
+"""
+import bisect
+import math
+import re
+
+import index_store
+
+TITLE_WEIGHT = 2
+
+_TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    """Case-folded word tokens of a text."""
+    return _TOKEN.findall(text.casefold()) if isinstance(text, str) else []
+
+
+class SearchIndex:
+    """
+    postings : {token: {task_id: weight}}, weight = TITLE_WEIGHT * title hits + description hits
+    tasks    : {task_id: [board_id, team_id, title]}
+    tokens   : sorted list of all tokens, for prefix matching
+    """
+
+    def __init__(self):
+        self.postings = {}
+        self.tasks = {}
+        self.tokens = []
+
+    def add_board(self, board):
+        pass
+
+    def add_task(self, board_id, team_id, task):
+        task_id = task["id"]
+        self.tasks[task_id] = [board_id, team_id, task.get("title", "")]
+
+        weights = {}
+        for token in tokenize(task.get("title")):
+            weights[token] = weights.get(token, 0) + TITLE_WEIGHT
+        for token in tokenize(task.get("description")):
+            weights[token] = weights.get(token, 0) + 1
+
+        for token, weight in weights.items():
+            posting = self.postings.get(token)
+            if posting is None:
+                posting = self.postings[token] = {}
+                bisect.insort(self.tokens, token)
+            posting[task_id] = weight
+
+    def update_task(self, board_id, team_id, task):
+        # only the title and description are indexed, and they never change
+        pass
+
+    def remove_task(self, board_id, team_id, task):
+        task_id = task["id"]
+        self.tasks.pop(task_id, None)
+        for token in set(tokenize(task.get("title")) + tokenize(task.get("description"))):
+            posting = self.postings.get(token)
+            if posting is None:
+                continue
+            posting.pop(task_id, None)
+            if not posting:
+                del self.postings[token]
+                del self.tokens[bisect.bisect_left(self.tokens, token)]
+
+    def _expand(self, term, prefix):
+        if not prefix:
+            return [term] if term in self.postings else []
+        start = bisect.bisect_left(self.tokens, term)
+        end = bisect.bisect_left(self.tokens, term + "\U0010ffff")
+        return self.tokens[start:end]
+
+    def search(self, query, board_id=None, team_id=None, prefix=False):
+        """
+        Tasks matching every term of the query, best first.
+        :return: list of (score, task_id)
+        """
+        terms = tokenize(query)
+        if not terms:
+            return []
+
+        total = len(self.tasks) or 1
+        scores = None
+        for term in dict.fromkeys(terms):
+            term_scores = {}
+            for token in self._expand(term, prefix):
+                posting = self.postings[token]
+                idf = math.log(1 + total / len(posting))
+                for task_id, weight in posting.items():
+                    term_scores[task_id] = term_scores.get(task_id, 0) + weight * idf
+
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {task_id: score + term_scores[task_id]
+                          for task_id, score in scores.items() if task_id in term_scores}
+            if not scores:
+                return []
+
+        results = []
+        for task_id, score in scores.items():
+            task_board, task_team, _ = self.tasks[task_id]
+            if board_id and task_board != board_id:
+                continue
+            if team_id and task_team != team_id:
+                continue
+            results.append((score, task_id))
+
+        results.sort(key=lambda item: (-item[0], item[1]))
+        return results
+
+    def to_json(self):
+        return {"postings": self.postings, "tasks": self.tasks}
+
+    @classmethod
+    def from_json(cls, data):
+        index = cls()
+        index.postings = data["postings"]
+        index.tasks = data["tasks"]
+        index.tokens = sorted(index.postings)
+        return index
+
+
+index_store.register_board_index("search", SearchIndex)
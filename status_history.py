@@ -0,0 +1,298 @@
+"""
+Append-only history of task status transitions, stored column by column.
+
+Every transition is one row of four columns kept in parallel arrays and in one
+file each under db/history/:
+    tasks.u32   interned task id
+    boards.u32  interned board id
+    status.u8   index in request_schema.TASK_STATUSES
+    time.i64    wall-clock seconds ("%Y-%m-%d %H:%M:%S" read as UTC)
+Ids are interned in ids.txt, one per line, the line number being the code.
+
+Rows are appended, never rewritten. A row is complete once all four columns hold
+it, so a write cut short by a crash is dropped on the next load. Other processes
+appending to the same files are picked up by reading the column tails.
+
+The daily series (cumulative flow, burndown) are computed over whole columns;
+with NumPy installed they are vectorized, otherwise a pure Python loop gives the
+same result.
+"""
+import calendar
+import os
+import time
+from array import array
+from datetime import date, timedelta
+
+import storage
+import board_archive
+from request_schema import TASK_STATUSES
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+HISTORY_DIR = "history"
+MAX_DAYS = 3660
+
+_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+_DAY = 86400
+
+# column name -> array typecode
+_COLUMNS = {
+    "tasks": "I",
+    "boards": "I",
+    "status": "B",
+    "time": "q",
+}
+_FILES = {"tasks": "tasks.u32", "boards": "boards.u32", "status": "status.u8", "time": "time.i64"}
+_IDS_FILE = "ids.txt"
+
+# Spellings written by older versions of add_task
+_LEGACY_STATUSES = {"IN PROGRESS": "IN_PROGRESS"}
+
+
+def to_seconds(text):
+    """Wall-clock seconds of a "%Y-%m-%d %H:%M:%S" time, or None if it does not parse."""
+    try:
+        return calendar.timegm(time.strptime(text, _TIME_FORMAT))
+    except (TypeError, ValueError):
+        return None
+
+
+def status_code(status):
+    status = _LEGACY_STATUSES.get(status, status)
+    return TASK_STATUSES.index(status) if status in TASK_STATUSES else None
+
+
+class StatusHistory:
+    def __init__(self, layout=storage.DEFAULT_LAYOUT):
+        self.layout = layout
+        self.directory = os.path.join(layout.db_dir, HISTORY_DIR)
+        self.columns = {name: array(typecode) for name, typecode in _COLUMNS.items()}
+        self.ids = []
+        self.codes = {}
+        self._ids_offset = 0
+        self._staged = {}  # id(transaction) -> rows recorded in it
+
+    def _path(self, file_name):
+        return os.path.join(self.directory, file_name)
+
+    # ------------------- load / append -------------------
+
+    def sync(self):
+        """Read the rows and ids appended to the files since the last call."""
+        self._read_ids()
+        for name, column in self.columns.items():
+            try:
+                with open(self._path(_FILES[name]), "rb") as f:
+                    f.seek(len(column) * column.itemsize)
+                    data = f.read()
+            except FileNotFoundError:
+                continue
+            column.frombytes(data[:len(data) - len(data) % column.itemsize])
+
+        # only rows present in every column are complete
+        rows = min(len(column) for column in self.columns.values())
+        for column in self.columns.values():
+            del column[rows:]
+
+    def _read_ids(self):
+        try:
+            with open(self._path(_IDS_FILE), "rb") as f:
+                f.seek(self._ids_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].decode("utf-8").splitlines():
+            self.codes[line] = len(self.ids)
+            self.ids.append(line)
+        self._ids_offset += end
+
+    def _intern(self, value, new_ids):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.ids)
+            self.ids.append(value)
+            new_ids.append(value)
+        return code
+
+    def record(self, rows):
+        """
+        Append transitions.
+        :param rows: iterable of (board_id, task_id, status, "%Y-%m-%d %H:%M:%S" time)
+        Inside a transaction the rows are appended when it commits.
+        """
+        txn = storage.current_transaction()
+        if txn is not None:
+            # one append per transaction, whatever the number of calls in it
+            staged = self._staged.get(id(txn))
+            if staged is None:
+                staged = self._staged[id(txn)] = []
+                txn.after_commit(lambda: self.record(self._staged.pop(id(txn), [])))
+                txn.after_rollback(lambda: self._staged.pop(id(txn), None))
+            staged.extend(rows)
+            return
+        self.sync()
+        new_ids = []
+        appended = {name: array(typecode) for name, typecode in _COLUMNS.items()}
+        for board_id, task_id, status, when in rows:
+            code = status_code(status)
+            seconds = to_seconds(when)
+            if code is None or seconds is None:
+                continue
+            appended["tasks"].append(self._intern(task_id, new_ids))
+            appended["boards"].append(self._intern(board_id, new_ids))
+            appended["status"].append(code)
+            appended["time"].append(seconds)
+
+        if not appended["tasks"]:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        if new_ids:
+            with open(self._path(_IDS_FILE), "ab") as f:
+                data = "".join(value + "\n" for value in new_ids).encode("utf-8")
+                f.write(data)
+            self._ids_offset += len(data)
+        # tasks last: a row counts once all four columns hold it
+        for name in ("time", "status", "boards", "tasks"):
+            with open(self._path(_FILES[name]), "ab") as f:
+                appended[name].tofile(f)
+            self.columns[name].extend(appended[name])
+
+    def seed(self):
+        """
+        Start the history of a db that has tasks but no history yet: every task gets
+        its creation as IN_PROGRESS and, when it moved since, its current status at
+        last_updated.
+        """
+        def rows():
+            try:
+                boards = storage.iter_collection(self.layout.path("boards"))
+                for board in boards:
+                    yield from _board_rows(board)
+            except FileNotFoundError:
+                pass
+            for board in board_archive.iter_archived_boards(self.layout):
+                yield from _board_rows(board)
+        self.record(rows())
+
+    # ------------------- series -------------------
+
+    def flow(self, board_ids, first_day, days):
+        """
+        Number of tasks in every status at the end of each day.
+        :param board_ids: boards to count the tasks of
+        :param first_day: datetime.date of the first day
+        :return: {status: [count per day]}
+        """
+        self.sync()
+        board_codes = [self.codes[board_id] for board_id in board_ids if board_id in self.codes]
+        start = calendar.timegm(first_day.timetuple())
+        compute = _flow_numpy if numpy is not None else _flow_python
+        counts = compute(self.columns, board_codes, start, days) if board_codes else [[0] * days for _ in TASK_STATUSES]
+        return dict(zip(TASK_STATUSES, counts))
+
+    def first_day(self, board_ids):
+        """datetime.date of the earliest transition of the boards, None if they have none."""
+        self.sync()
+        board_codes = {self.codes[board_id] for board_id in board_ids if board_id in self.codes}
+        times = self.columns["time"]
+        boards = self.columns["boards"]
+        earliest = min((times[row] for row in range(len(times)) if boards[row] in board_codes), default=None)
+        return None if earliest is None else date(1970, 1, 1) + timedelta(seconds=earliest)
+
+
+def _board_rows(board):
+    for task in board.get("tasks", []):
+        created = task.get("creation_time")
+        yield board["id"], task["id"], "IN_PROGRESS", created
+        if task.get("status") not in ("IN_PROGRESS", "IN PROGRESS") and task.get("last_updated"):
+            yield board["id"], task["id"], task.get("status"), task["last_updated"]
+
+
+def _flow_python(columns, board_codes, start, days):
+    tasks, boards, status, times = columns["tasks"], columns["boards"], columns["status"], columns["time"]
+    wanted = set(board_codes)
+    rows = [row for row in range(len(tasks)) if boards[row] in wanted]
+    rows.sort(key=lambda row: (tasks[row], times[row], row))
+
+    delta = [[0] * days for _ in TASK_STATUSES]
+    previous_task = None
+    previous_status = None
+    for row in rows:
+        task = tasks[row]
+        if task != previous_task:
+            previous_task, previous_status = task, None
+        day = max((times[row] - start) // _DAY, 0)
+        if day < days:
+            delta[status[row]][day] += 1
+            if previous_status is not None:
+                delta[previous_status][day] -= 1
+        previous_status = status[row]
+
+    for counts in delta:
+        total = 0
+        for day in range(days):
+            total += counts[day]
+            counts[day] = total
+    return delta
+
+
+def _flow_numpy(columns, board_codes, start, days):
+    boards = numpy.frombuffer(columns["boards"], dtype=numpy.uint32)
+    selected = numpy.isin(boards, numpy.array(board_codes, dtype=numpy.uint32))
+    tasks = numpy.frombuffer(columns["tasks"], dtype=numpy.uint32)[selected]
+    status = numpy.frombuffer(columns["status"], dtype=numpy.uint8)[selected].astype(numpy.int64)
+    times = numpy.frombuffer(columns["time"], dtype=numpy.int64)[selected]
+
+    # by task, then time, then append order
+    order = numpy.lexsort((numpy.arange(len(tasks)), times, tasks))
+    tasks, status, times = tasks[order], status[order], times[order]
+
+    previous = numpy.empty_like(status)
+    previous[1:] = status[:-1]
+    if len(previous):
+        previous[0] = -1
+    previous[1:][tasks[1:] != tasks[:-1]] = -1
+
+    day = numpy.maximum((times - start) // _DAY, 0)
+    in_range = day < days
+    delta = numpy.zeros((len(TASK_STATUSES), days), dtype=numpy.int64)
+    numpy.add.at(delta, (status[in_range], day[in_range]), 1)
+    moved = in_range & (previous >= 0)
+    numpy.subtract.at(delta, (previous[moved], day[moved]), 1)
+    return numpy.cumsum(delta, axis=1).tolist()
+
+
+# layout key -> StatusHistory of this process
+_histories = {}
+
+
+def get_history(layout=storage.DEFAULT_LAYOUT):
+    """
+    :return: the StatusHistory of a layout; a db without history is seeded from its boards.
+    """
+    history = _histories.get(layout.key)
+    if history is None:
+        history = StatusHistory(layout)
+        if not os.path.isdir(history.directory) and os.path.isdir(layout.db_dir):
+            history.seed()
+        _histories[layout.key] = history
+    return history
+
+
+def resident_bytes(layout):
+    """Bytes held in memory by the history of a layout, 0 when it is not loaded."""
+    history = _histories.get(layout.key)
+    if history is None:
+        return 0
+    rows = sum(column.itemsize * len(column) for column in history.columns.values())
+    # an interned id costs its string plus its entry in codes
+    return rows + 160 * len(history.ids)
+
+
+def close_history(layout):
+    """Drop the in-memory columns of a layout; the files hold every recorded row."""
+    _histories.pop(layout.key, None)
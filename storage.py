@@ -0,0 +1,1106 @@
+"""
+Shared helpers for the JSON collections persisted in the db folder.
+Every manager reads and writes its collection through these functions so that
+derived structures (see index_store.py) can tell when a file has changed.
+
+A Layout says where the collections of one dataset live. By default all of them
+are in the db folder, but a layout can point single collections elsewhere, e.g.
+a board partition that shares the user and team files (see partitioned_board.py).
+
+Collections are stored as indented JSON, or in the compact encoding of
+record_codec.py for layouts created with codec="compact". Reads detect the
+encoding of each file and always return records in the documented format; a
+rewrite keeps the encoding the file already has.
+
+Inside a transaction() the loads and saves of the calling thread go to an
+in-memory staged view, and every collection saved in it is written once, when
+the transaction commits.
+
+How durable a save is depends on the durability mode (set_durability(), or the
+PLANNER_DURABILITY environment variable):
+    strict   every save is written to a temporary file, fsynced and renamed in
+             place before it returns
+    group    saves wait for the next group commit, which writes and fsyncs all
+             the collections saved since the previous one together; once a
+             second save is waiting the group is held open for up to
+             group_commit_ms, or until group_commit_ops saves are waiting
+    relaxed  saves return at once and a background thread writes and fsyncs
+             the latest version of each collection every flush_interval_ms
+In group and relaxed mode this process reads the saved records before they
+reach the file; other processes see them after the flush.
+
+The managers run every load -> modify -> save of a collection under the lock of
+its path (see locked()), so concurrent calls of one process never save over each
+other's changes; in group mode a call waits for its group commit after it let go
+of the lock, so the calls queued behind it still share the commit.
+"""
+import atexit
+import contextlib
+import functools
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+import record_codec
+
+DB_DIR = "db"
+OUT_DIR = "out"
+
+COLLECTION_FILES = {
+    "users": "user_base.json",
+    "teams": "team_base.json",
+    "boards": "project_board_base.json",
+}
+
+
+def collection_path(name, db_dir=DB_DIR):
+    return os.path.join(db_dir, COLLECTION_FILES[name])
+
+
+class Layout:
+    """
+    Paths of the collections of one dataset.
+    :param db_dir: folder of the collections and of side files such as the index sidecar
+    :param paths: optional {collection name: path} overrides
+    :param codec: optional encoding of the collection files written from now on,
+                  "json" or "compact" (see record_codec.py)
+    :param out_dir: folder of the files written by export_board, out by default
+    """
+
+    def __init__(self, db_dir=DB_DIR, paths=None, codec=None, out_dir=OUT_DIR):
+        self.db_dir = db_dir
+        self.out_dir = out_dir
+        self.paths = {name: collection_path(name, db_dir) for name in COLLECTION_FILES}
+        self.paths.update(paths or {})
+        self.key = (db_dir,) + tuple(sorted(self.paths.items()))
+        if codec is not None:
+            for path in self.paths.values():
+                set_codec(path, codec)
+
+    def path(self, name):
+        return self.paths[name]
+
+    def side_file(self, file_name):
+        return os.path.join(self.db_dir, file_name)
+
+
+DEFAULT_LAYOUT = Layout()
+
+
+def workspace_layout(root, codec=None):
+    """:return: the Layout of a dataset kept under `root`, in root/db and root/out"""
+    return Layout(os.path.join(root, DB_DIR), codec=codec, out_dir=os.path.join(root, OUT_DIR))
+
+# path -> (mtime_ns, size, sha1) of the last version of the file seen by this process
+_checksums = {}
+
+# callables invoked with the path of every collection rewritten by save_collection()
+_write_listeners = []
+
+
+def add_write_listener(listener):
+    _write_listeners.append(listener)
+
+
+# path -> codec chosen for the file, files not listed keep the encoding they have
+_codecs = {}
+
+_COMPACT_PREFIX = "[" + json.dumps(record_codec.MARKER, separators=(",", ":"))
+
+
+def set_codec(path, codec):
+    if codec not in (record_codec.CODEC_JSON, record_codec.CODEC_COMPACT):
+        raise ValueError(f"Unknown codec {codec}")
+    _codecs[path] = codec
+
+
+def codec_for(path):
+    """:return: the codec a rewrite of `path` uses, the one set for it or else the one of the file"""
+    codec = _codecs.get(path)
+    if codec is not None:
+        return codec
+    return file_codec(path)
+
+
+def file_codec(path):
+    """:return: the codec the file at `path` is written in, json for a missing file"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            head = f.read(len(_COMPACT_PREFIX))
+    except FileNotFoundError:
+        return record_codec.CODEC_JSON
+    return record_codec.CODEC_COMPACT if head == _COMPACT_PREFIX else record_codec.CODEC_JSON
+
+
+# path -> callable run before the collection is read or rewritten as a whole, see set_barrier()
+_barriers = {}
+
+
+def set_barrier(path, callback):
+    """
+    Have callback() run before every whole-collection read or rewrite of `path`,
+    for a module that holds changes to the collection that are not written yet
+    (see board_store.py). file_checksum() does not run it.
+    """
+    _barriers[path] = callback
+
+
+def clear_barrier(path):
+    _barriers.pop(path, None)
+
+
+def barrier(path):
+    callback = _barriers.get(path)
+    if callback is not None:
+        callback()
+
+
+def load_collection(path):
+    """
+    Load a collection (a JSON list) from disk. An empty file is an empty collection.
+    Raises FileNotFoundError when the file does not exist, like open() does.
+    Inside a transaction the staged records are returned.
+    """
+    txn = current_transaction()
+    if txn is not None:
+        return txn.load(path)
+    return _load_saved(path)
+
+
+def _load_saved(path):
+    barrier(path)
+    pending = _writer.pending_records(path)
+    return pending if pending is not None else _read_collection(path)
+
+
+def collection_exists(path):
+    """
+    os.path.exists() for a collection, counting collections created by the current
+    transaction or saved but not flushed yet.
+    """
+    txn = current_transaction()
+    if txn is not None and path in txn.staged:
+        return True
+    return _writer.pending_records(path) is not None or os.path.exists(path)
+
+
+def _read_collection(path):
+    with open(path, "r") as f:
+        content = f.read().strip()
+    if content.startswith(_COMPACT_PREFIX):
+        return json.loads(content, object_hook=record_codec.decode_object)[1:]
+    return json.loads(content) if content else []
+
+
+def iter_collection(path, chunk_size=1 << 20):
+    """
+    Yield the records of a collection one at a time without loading the whole file.
+    Memory is bounded by chunk_size plus the size of the largest single record.
+    Raises FileNotFoundError when the file is missing and json.JSONDecodeError when
+    it is not a JSON list.
+    """
+    barrier(path)
+    for record, _, _ in _scan_collection(path, chunk_size):
+        yield record
+
+
+def iter_collection_spans(path, chunk_size=1 << 20):
+    """
+    Like iter_collection(), yielding (record, start, end) with the byte range of the
+    record in the file, for reading it back later with read_span().
+    """
+    yield from _scan_collection(path, chunk_size)
+
+
+def read_span(f, start, end, codec):
+    """:return: the record stored at bytes start..end of the open (binary) collection file f"""
+    text = os.pread(f.fileno(), end - start, start).decode("utf-8")
+    if codec == record_codec.CODEC_COMPACT:
+        return json.loads(text, object_hook=record_codec.decode_object)
+    return json.loads(text)
+
+
+def _byte_offset(buffer, pos, ascii_buffer):
+    return pos if ascii_buffer else len(buffer[:pos].encode("utf-8"))
+
+
+def _scan_collection(path, chunk_size):
+    if _writer.pending_records(path) is not None:
+        flush()
+    decoder = json.JSONDecoder()
+    # newline="" keeps \r\n as it is, so character counts match the bytes of the file
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        buffer = ""
+        base = 0  # byte offset of buffer[0] in the file
+        ascii_buffer = True
+        pos = 0
+        eof = False
+        started = False
+        first = True
+
+        while True:
+            # skip whitespace, the opening bracket and separators
+            while True:
+                while pos < len(buffer) and buffer[pos] in " \t\r\n":
+                    pos += 1
+                if pos < len(buffer) or eof:
+                    break
+                chunk = f.read(chunk_size)
+                base += _byte_offset(buffer, len(buffer), ascii_buffer)
+                buffer, pos = chunk, 0
+                ascii_buffer = buffer.isascii()
+                eof = not chunk
+
+            if pos >= len(buffer):
+                if started:
+                    raise json.JSONDecodeError("Unterminated collection", buffer, pos)
+                return
+
+            char = buffer[pos]
+            if not started:
+                if char != "[":
+                    raise json.JSONDecodeError("Collection is not a JSON list", buffer, pos)
+                started = True
+                pos += 1
+                continue
+            if char == "]":
+                return
+            if char == ",":
+                pos += 1
+                continue
+
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+                complete = end < len(buffer) or eof
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                complete = False
+
+            if not complete:
+                chunk = f.read(chunk_size)
+                base += _byte_offset(buffer, pos, ascii_buffer)
+                buffer = buffer[pos:] + chunk
+                ascii_buffer = buffer.isascii()
+                pos = 0
+                eof = not chunk
+                continue
+
+            start = base + _byte_offset(buffer, pos, ascii_buffer)
+            pos = end
+            if first:
+                first = False
+                if record_codec.is_marker(record):
+                    decoder = json.JSONDecoder(object_hook=record_codec.decode_object)
+                    continue
+            yield record, start, base + _byte_offset(buffer, end, ascii_buffer)
+
+
+def iter_collection_items(path, field, chunk_size=1 << 20):
+    """
+    Stream a collection whose records hold a long `field` list (boards and their
+    tasks) without ever holding a whole record. Yields, in file order:
+        ("record", record)  a record without the list
+        ("head", head)      a record with the list: the fields that precede it
+        ("item", item)      every item of the list
+        ("end", record)     after the last item: the whole record but the list
+    Memory is bounded by chunk_size plus the size of the largest single item.
+    Raises FileNotFoundError and json.JSONDecodeError like iter_collection().
+    """
+    barrier(path)
+    if _writer.pending_records(path) is not None:
+        flush()
+    plain = json.JSONDecoder()
+    items = plain
+    hook = None
+    first = True
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        reader = _Reader(f, chunk_size)
+        if reader.next_char() is None:
+            return
+        reader.expect("[")
+        while True:
+            char = reader.next_char()
+            if char == "]":
+                return
+            if char == ",":
+                reader.advance()
+                continue
+            if char != "{":
+                # not an object, the caller reports it
+                first = False
+                yield "record", reader.decode(items)
+                continue
+
+            reader.advance()
+            record = {}
+            has_list = False
+            while True:
+                char = reader.next_char()
+                if char == "}":
+                    reader.advance()
+                    break
+                if char == ",":
+                    reader.advance()
+                    continue
+                key = reader.decode(plain)
+                reader.expect(":")
+                if key == field and reader.next_char() == "[" and not has_list:
+                    has_list = True
+                    yield "head", hook(dict(record)) if hook else dict(record)
+                    reader.advance()
+                    while True:
+                        char = reader.next_char()
+                        if char == "]":
+                            reader.advance()
+                            break
+                        if char == ",":
+                            reader.advance()
+                            continue
+                        yield "item", reader.decode(items)
+                else:
+                    record[key] = reader.decode(plain)
+
+            if first:
+                first = False
+                if record_codec.is_marker(record):
+                    hook = record_codec.decode_object
+                    items = json.JSONDecoder(object_hook=hook)
+                    continue
+            record = hook(record) if hook else record
+            yield ("end" if has_list else "record"), record
+
+
+class _Reader:
+    """Chunked reader of a JSON text for iter_collection_items()."""
+
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        chunk = self.f.read(self.chunk_size)
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        self.eof = not chunk
+
+    def next_char(self):
+        """:return: the next character that is not whitespace, None at the end of the file"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.eof:
+                return None
+            self._fill()
+
+    def advance(self):
+        self.pos += 1
+
+    def expect(self, char):
+        if self.next_char() != char:
+            raise json.JSONDecodeError(f"Expecting {char!r}", self.buffer, self.pos)
+        self.pos += 1
+
+    def decode(self, decoder):
+        """:return: the JSON value at the current position"""
+        self.next_char()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.buffer, self.pos)
+                # a number may go on in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+
+def _dumps_compact(record):
+    return json.dumps(record_codec.encode(record), separators=(",", ":"))
+
+
+def _encode_collection(path, records):
+    if codec_for(path) == record_codec.CODEC_COMPACT:
+        lines = [json.dumps(record_codec.MARKER, separators=(",", ":"))]
+        lines.extend(_dumps_compact(record) for record in records)
+        return ("[" + ",\n".join(lines) + "]").encode("utf-8")
+    return json.dumps(records, indent=4).encode("utf-8")
+
+
+def save_collection(path, records):
+    """
+    Rewrite a collection on disk and remember the checksum of what was written,
+    so the next file_checksum() call does not have to read it back.
+    Inside a transaction the records are only staged until the commit.
+    """
+    barrier(path)
+    txn = current_transaction()
+    if txn is not None:
+        txn.save(path, records)
+        return
+
+    data = _encode_collection(path, records)
+    digest = hashlib.sha1(data).hexdigest()
+    if _durability["mode"] == DURABILITY_STRICT:
+        replace_file(path, data, sync=True)
+        _remember(path, digest)
+    else:
+        group = _durability["mode"] == DURABILITY_GROUP
+        held = getattr(_local, "held", None)
+        sequence = _writer.save(path, records, data, digest, wait=group and not held)
+        if group and held:
+            # waited for once the locks are released, see locked()
+            _local.wait_for = sequence
+    notify_write(path)
+
+
+def notify_write(path):
+    """Tell the write listeners that the collection at `path` changed."""
+    for listener in _write_listeners:
+        listener(path)
+
+
+# ------------------- durability -------------------
+
+DURABILITY_STRICT = "strict"
+DURABILITY_GROUP = "group"
+DURABILITY_RELAXED = "relaxed"
+DURABILITY_MODES = (DURABILITY_STRICT, DURABILITY_GROUP, DURABILITY_RELAXED)
+DURABILITY_ENV = "PLANNER_DURABILITY"
+
+_durability = {
+    "mode": DURABILITY_STRICT,
+    "group_commit_ms": 5,
+    "group_commit_ops": 64,
+    "flush_interval_ms": 1000,
+}
+
+
+def set_durability(mode, group_commit_ms=None, group_commit_ops=None, flush_interval_ms=None):
+    """
+    Choose how saves reach the disk, for the whole process (see the module docstring).
+    Saves pending from the previous mode are flushed first.
+    """
+    if mode not in DURABILITY_MODES:
+        raise ValueError(f"durability must be one of {', '.join(DURABILITY_MODES)}")
+    flush()
+    _durability["mode"] = mode
+    for name, value in (("group_commit_ms", group_commit_ms), ("group_commit_ops", group_commit_ops),
+                        ("flush_interval_ms", flush_interval_ms)):
+        if value is not None:
+            _durability[name] = value
+    _writer.wake()
+
+
+def durability():
+    """:return: copy of the durability settings"""
+    return dict(_durability)
+
+
+def replace_file(path, data, sync=False):
+    """
+    Replace a file with data (bytes) through a temporary file of its own, fsyncing
+    both when sync is set. Concurrent replacements of one path never share a
+    temporary file; the last one to be renamed wins.
+    """
+    tmp_path = _write_temporary(path, data, sync, ".tmp")
+    try:
+        os.replace(tmp_path, path)
+    except BaseException:
+        _remove_quietly(tmp_path)
+        raise
+    if sync:
+        _fsync_dir(os.path.dirname(path))
+
+
+def _write_temporary(path, data, sync, suffix):
+    """:return: path of a new uniquely named file next to `path` holding data"""
+    f = tempfile.NamedTemporaryFile(dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + ".",
+                                    suffix=suffix, delete=False)
+    try:
+        with f:
+            f.write(data)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+    except BaseException:
+        _remove_quietly(f.name)
+        raise
+    return f.name
+
+
+def temporary_path(path, suffix=".tmp"):
+    """:return: path of a new, empty, uniquely named file next to `path`, for a writer to fill and rename"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + ".",
+                                    suffix=suffix)
+    os.close(fd)
+    return tmp_path
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _fsync_dir(directory):
+    try:
+        fd = os.open(directory or ".", os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class _BackgroundWriter:
+    """
+    Saves waiting to be written in group and relaxed mode, and the thread that
+    writes them. pending keeps {path: (records, data, sha1)} until the file holds it,
+    so loads and checksums of this process see the saved version meanwhile.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        # also run in a forked child: the writer thread is the parent's, and so are its pending saves
+        self.condition = threading.Condition()
+        self.pending = {}
+        self.saved = 0      # sequence number of the last save
+        self.flushed = 0    # every save up to this one is on disk
+        self.oldest = None  # time.monotonic() of the oldest save not flushed
+        self.flush_requested = False
+        self.error = None
+        self.thread = None
+
+    def pending_records(self, path):
+        with self.condition:
+            entry = self.pending.get(path)
+        return entry[0] if entry is not None else None
+
+    def pending_checksum(self, path):
+        with self.condition:
+            entry = self.pending.get(path)
+        return entry[2] if entry is not None else None
+
+    def save(self, path, records, data, digest, wait):
+        with self.condition:
+            self._start()
+            self.pending[path] = (records, data, digest)
+            if self.saved == self.flushed:
+                self.oldest = time.monotonic()
+            self.saved += 1
+            sequence = self.saved
+            self.condition.notify_all()
+        if wait:
+            self.wait(sequence)
+        return sequence
+
+    def wait(self, sequence):
+        """Wait until the save numbered `sequence` is on disk."""
+        with self.condition:
+            while self.flushed < sequence and self.error is None:
+                self.condition.wait()
+            if self.error is not None:
+                raise OSError(f"group commit failed: {self.error}")
+
+    def flush(self):
+        """Write everything saved so far and wait for it."""
+        with self.condition:
+            if self.flushed == self.saved:
+                return
+            self._start()
+            sequence = self.saved
+            self.flush_requested = True
+            self.condition.notify_all()
+            while self.flushed < sequence and self.error is None:
+                self.condition.wait()
+            if self.error is not None:
+                raise OSError(f"flush failed: {self.error}")
+
+    def wake(self):
+        with self.condition:
+            self.condition.notify_all()
+
+    def _start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="storage-writer", daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while True:
+                    waiting = self.saved - self.flushed
+                    if not waiting:
+                        self.condition.wait()
+                        continue
+                    if self.flush_requested or waiting >= _durability["group_commit_ops"]:
+                        break
+                    # a lone save is not delayed, saves arriving while it is written form the next group
+                    if waiting == 1 and _durability["mode"] == DURABILITY_GROUP:
+                        break
+                    interval = _durability["group_commit_ms" if _durability["mode"] == DURABILITY_GROUP
+                                          else "flush_interval_ms"]
+                    remaining = self.oldest + interval / 1000 - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                self.flush_requested = False
+                sequence = self.saved
+                batch = dict(self.pending)
+
+            try:
+                for path, (records, data, digest) in batch.items():
+                    replace_file(path, data, sync=True)
+                    _remember(path, digest)
+                error = None
+            except OSError as e:
+                error = e
+
+            with self.condition:
+                for path, entry in batch.items():
+                    # a newer save of the same path stays pending
+                    if self.pending.get(path) is entry and error is None:
+                        del self.pending[path]
+                self.error = error
+                if error is None:
+                    self.flushed = sequence
+                    self.oldest = time.monotonic()
+                self.condition.notify_all()
+            if error is not None:
+                time.sleep(_durability["group_commit_ms"] / 1000)
+
+
+_writer = _BackgroundWriter()
+
+
+def flush():
+    """Write and fsync every save still pending in group or relaxed mode."""
+    _writer.flush()
+
+
+def forget(layout):
+    """
+    Flush pending saves and drop what this module remembers about the files of a
+    layout (checksums, codecs), for a dataset that is being closed.
+    """
+    flush()
+    for path in layout.paths.values():
+        _checksums.pop(path, None)
+        _codecs.pop(path, None)
+
+
+atexit.register(flush)
+if hasattr(os, "register_at_fork"):
+    # a forked worker reads the files, so they must hold every save made before the fork
+    os.register_at_fork(before=flush, after_in_child=_writer.reset)
+
+if os.environ.get(DURABILITY_ENV):
+    set_durability(os.environ[DURABILITY_ENV])
+
+
+# ------------------- transactions -------------------
+
+JOURNAL_FILE = "txn_journal.json"
+
+_local = threading.local()
+
+
+class TransactionError(Exception):
+    """Raised by Transaction.check() for an error response, rolls the transaction back."""
+
+
+class Transaction:
+    """
+    Unit of work over the collections, see transaction().
+
+    staged : {path: records} of every collection loaded or saved in the transaction.
+             A load returns the staged list itself, so the managers must save what
+             they change (they always do: every mutation is followed by a save).
+    dirty  : paths saved in the transaction, written by commit()
+    held   : collection locks taken in the transaction, released when it ends
+    """
+
+    def __init__(self):
+        self.staged = {}
+        self.dirty = []
+        self.held = []
+        self._after_commit = {}
+        self._after_rollback = {}
+
+    def load(self, path):
+        if path not in self.staged:
+            self.staged[path] = _load_saved(path)
+        return self.staged[path]
+
+    def save(self, path, records):
+        self.staged[path] = records
+        if path not in self.dirty:
+            self.dirty.append(path)
+
+    def after_commit(self, callback, key=None):
+        """Run callback() once the commit wrote the files; a key registers it only once."""
+        self._after_commit[key if key is not None else object()] = callback
+
+    def after_rollback(self, callback, key=None):
+        self._after_rollback[key if key is not None else object()] = callback
+
+    def check(self, response):
+        """
+        :return: the parsed json response of an API call made in the transaction.
+        Raises TransactionError when it is an error response.
+        """
+        result = json.loads(response)
+        if isinstance(result, dict) and ("error" in result or "errors" in result):
+            raise TransactionError(result.get("error") or result.get("errors"))
+        return result
+
+    def commit(self):
+        """
+        Write every dirty collection to a temporary file, record them in a journal,
+        then move them in place. A commit cut short after the journal was written is
+        completed by recover().
+        """
+        if not self.dirty:
+            self._run(self._after_commit)
+            return
+
+        # the commit writes the files itself, older saves still pending must land first
+        flush()
+        sync = _durability["mode"] != DURABILITY_RELAXED
+        written = []
+        try:
+            for path in self.dirty:
+                data = _encode_collection(path, self.staged[path])
+                written.append((path, _write_temporary(path, data, sync, ".txn"), hashlib.sha1(data).hexdigest()))
+        except BaseException:
+            for _, tmp_path, _ in written:
+                _remove_quietly(tmp_path)
+            raise
+
+        journal = os.path.join(os.path.dirname(self.dirty[0]), JOURNAL_FILE)
+        # one journal per folder: commits of transactions on other layouts take turns
+        with _commit_lock:
+            replace_file(journal, json.dumps([[path, tmp_path] for path, tmp_path, _ in written]).encode("utf-8"),
+                         sync)
+            for path, tmp_path, digest in written:
+                os.replace(tmp_path, path)
+                _remember(path, digest)
+            os.remove(journal)
+        if sync:
+            for directory in {os.path.dirname(path) for path in self.dirty}:
+                _fsync_dir(directory)
+
+        for path in self.dirty:
+            for listener in _write_listeners:
+                listener(path)
+        self._run(self._after_commit)
+
+    def rollback(self):
+        self.staged.clear()
+        self.dirty.clear()
+        self._run(self._after_rollback)
+
+    def release(self):
+        while self.held:
+            self.held.pop().release()
+
+    @staticmethod
+    def _run(callbacks):
+        for callback in list(callbacks.values()):
+            callback()
+
+
+def current_transaction():
+    """:return: the transaction of the calling thread, or None"""
+    return getattr(_local, "transaction", None)
+
+
+@contextlib.contextmanager
+def transaction():
+    """
+    Group API calls of the calling thread into one unit of work:
+
+        with storage.transaction() as txn:
+            team_id = txn.check(team_api.create_team(request))["id"]
+            txn.check(team_api.add_users_to_team(...))
+            ...
+
+    Every load sees the changes staged so far and every collection touched is
+    written once when the block ends. An exception (e.g. the TransactionError of
+    txn.check()) rolls everything back and is re-raised. A transaction opened
+    inside another one joins it.
+    """
+    outer = current_transaction()
+    if outer is not None:
+        yield outer
+        return
+
+    txn = Transaction()
+    _local.transaction = txn
+    try:
+        yield txn
+    except BaseException:
+        _local.transaction = None
+        try:
+            txn.rollback()
+        finally:
+            txn.release()
+        raise
+    _local.transaction = None
+    try:
+        txn.commit()
+    finally:
+        txn.release()
+
+
+def recover(directory):
+    """
+    Finish a commit that was interrupted after its journal was written: move the
+    temporary files it lists in place. Called when a process first opens a layout.
+    """
+    journal = os.path.join(directory, JOURNAL_FILE)
+    try:
+        with open(journal, "r") as f:
+            entries = json.load(f)
+    except FileNotFoundError:
+        return
+    except json.JSONDecodeError:
+        entries = []
+    for entry in entries:
+        # journals of older versions list the paths, whose temporary file was <path>.txn
+        path, tmp_path = entry if isinstance(entry, list) else (entry, entry + ".txn")
+        if os.path.exists(tmp_path):
+            os.replace(tmp_path, path)
+    os.remove(journal)
+
+
+# ------------------- collection locks -------------------
+
+# absolute path -> lock of the collection
+_path_locks = {}
+_path_locks_guard = threading.Lock()
+_commit_lock = threading.Lock()
+
+
+def _path_lock(path):
+    path = os.path.abspath(path)
+    with _path_locks_guard:
+        lock = _path_locks.get(path)
+        if lock is None:
+            lock = _path_locks[path] = threading.RLock()
+        return lock
+
+
+@contextlib.contextmanager
+def locked(layout, *names):
+    """
+    Hold the locks of collections of a layout for a load -> modify -> save of them:
+
+        with storage.locked(self.layout, "users"):
+            users = storage.load_collection(self.layout.path("users"))
+            ...
+            storage.save_collection(self.layout.path("users"), users)
+
+    The locks are reentrant and taken in path order. A transaction takes the locks
+    of every collection of the layout and keeps them until it commits or rolls
+    back, since its saves only reach the files then. In group mode the wait for
+    the group commit of the saves made under the locks happens after they are
+    released.
+    """
+    paths = sorted(set(layout.paths.values()) if current_transaction() is not None
+                   else {layout.path(name) for name in names}, key=os.path.abspath)
+    locks = [_path_lock(path) for path in paths]
+
+    txn = current_transaction()
+    if txn is not None:
+        for lock in locks:
+            if lock not in txn.held:
+                lock.acquire()
+                txn.held.append(lock)
+        yield
+        return
+
+    outermost = not getattr(_local, "held", 0)
+    for lock in locks:
+        lock.acquire()
+    _local.held = getattr(_local, "held", 0) + 1
+    try:
+        yield
+    finally:
+        _local.held -= 1
+        for lock in reversed(locks):
+            lock.release()
+        wait_for = _local.__dict__.pop("wait_for", None) if outermost else None
+    if wait_for is not None:
+        _writer.wait(wait_for)
+
+
+def serialized(*names):
+    """
+    Decorator for a manager method that changes collections: the call runs under
+    locked(self.layout, *names).
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with locked(self.layout, *names):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class CollectionWriter:
+    """
+    Write a collection record by record, producing the same layout as
+    save_collection() without holding the whole list in memory.
+
+    A record with a long nested list (a board and its tasks) can itself be streamed:
+    open_list(record, "tasks"), write_item(task) for every task, close_list().
+    write() and write_raw() return the byte range of the record in the file; offsets
+    are not tracked once open_list() was used.
+    :param codec: encoding of the file, by default the one save_collection() would use for `path`
+    """
+
+    def __init__(self, path, buffer_size=1 << 20, codec=None):
+        self.path = path
+        self.count = 0
+        self.offset = 0
+        self._items = None
+        self._compact = (codec or codec_for(path)) == record_codec.CODEC_COMPACT
+        self._file = open(path, "w", encoding="utf-8", buffering=buffer_size)
+        self._file.write(_COMPACT_PREFIX if self._compact else "[")
+        self.offset = len(_COMPACT_PREFIX) if self._compact else 1
+
+    def write(self, record):
+        if self._compact:
+            return self._write_record(",\n", _dumps_compact(record))
+        return self._write_record(",\n" + _INDENT if self.count else "\n" + _INDENT,
+                                  json.dumps(record, indent=4).replace("\n", "\n" + _INDENT))
+
+    def write_raw(self, data):
+        """
+        Copy a record as stored in another file of the same codec (bytes read with its
+        byte range from iter_collection_spans()).
+        """
+        text = data.decode("utf-8")
+        separator = ",\n" if self._compact else (",\n" + _INDENT if self.count else "\n" + _INDENT)
+        if text.isascii():
+            return self._write_record(separator, text)
+        self._file.write(separator + text)
+        start = self.offset + len(separator)
+        self.offset = start + len(data)
+        self.count += 1
+        return start, self.offset
+
+    def _write_record(self, separator, text):
+        # json.dumps() escapes non-ASCII characters, so the text is as long as its bytes
+        self._file.write(separator + text)
+        start = self.offset + len(separator)
+        self.offset = start + len(text)
+        self.count += 1
+        return start, self.offset
+
+    def open_list(self, record, field):
+        """Start writing `record` with a `field` list whose items follow through write_item()."""
+        if self._compact:
+            head = _dumps_compact(record)[:-1] + "," if record else "{"
+            self._file.write(",\n" + head + json.dumps(field) + ":[")
+        else:
+            head = json.dumps(record, indent=4)[:-2] + ",\n" if record else "{\n"
+            self._file.write(",\n" if self.count else "\n")
+            self._file.write(_INDENT + head.replace("\n", "\n" + _INDENT) + _INDENT + json.dumps(field) + ": [")
+        self._items = 0
+        self.count += 1
+
+    def write_item(self, item):
+        if self._compact:
+            self._file.write(("," if self._items else "") + _dumps_compact(item))
+        else:
+            indent = _INDENT * 3
+            self._file.write(",\n" if self._items else "\n")
+            self._file.write(indent + json.dumps(item, indent=4).replace("\n", "\n" + indent))
+        self._items += 1
+
+    def close_list(self, tail=None):
+        """:param tail: optional fields of the record that follow the list"""
+        if self._compact:
+            self._file.write("]" + ("," + _dumps_compact(tail)[1:-1] if tail else "") + "}")
+        else:
+            self._file.write("\n" + _INDENT * 2 + "]" if self._items else "]")
+            if tail:
+                fields = json.dumps(tail, indent=4)[2:-2]
+                self._file.write(",\n" + _INDENT + fields.replace("\n", "\n" + _INDENT))
+            self._file.write("\n" + _INDENT + "}")
+        self._items = None
+
+    def close(self):
+        if self._items is not None:
+            self.close_list()
+        if self._compact:
+            self._file.write("]")
+        else:
+            self._file.write("\n]" if self.count else "]")
+        if _durability["mode"] != DURABILITY_RELAXED:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+_INDENT = " " * 4
+
+
+def file_checksum(path):
+    """
+    :return: sha1 hex digest of the file contents, or None when the file is missing.
+    The digest is cached per (mtime, size) so unchanged files are hashed once per process.
+    A save that is not flushed yet counts as the contents of the file.
+    """
+    pending = _writer.pending_checksum(path)
+    if pending is not None:
+        return pending
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    cached = _checksums.get(path)
+    if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+        return cached[2]
+
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    _checksums[path] = (stat.st_mtime_ns, stat.st_size, digest.hexdigest())
+    return digest.hexdigest()
+
+
+def _remember(path, digest):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return
+    _checksums[path] = (stat.st_mtime_ns, stat.st_size, digest)
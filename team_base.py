@@ -1,6 +1,15 @@
 import json
 import uuid
 from datetime import datetime
+
+import storage
+import index_store
+import request_schema
+import cascade
+import workload_index  # registers the board index delete_team finds the team's tasks with
+from idempotency import idempotent
+from response_cache import cached_response
+
 class TeamBase:
     """
     Base interface implementation for API's to manage teams.
@@ -8,14 +17,23 @@ class TeamBase:
     Users can be
     """
 
+    def __init__(self, layout=None):
+        """
+        :param layout: storage.Layout of the collections, the db folder by default
+        """
+        self.layout = layout or storage.DEFAULT_LAYOUT
+
     # create a team
+    @storage.serialized("teams")
+    @idempotent("create_team")
     def create_team(self, request: str) -> str:
         """
         :param request: A json string with the team details
         {
           "name" : "<team_name>",
           "description" : "<some description>",
-          "admin": "<id of a user>"
+          "admin": "<id of a user>",
+          "idempotency_key" : "<optional key, a retry with the same key returns the first response>"
         }
         :return: A json string with the response {"id" : "<team_id>"}
 
@@ -25,41 +43,27 @@ class TeamBase:
             * Description can be max 128 characters
         """
         
-        data = json.loads(request)
-        if len(data["team_name"]) > 64:
-            return json.dumps({"error":"Team name exceed 64 character"})
-        
-        if len(data["team_description"]) > 128:
-            return json.dumps({"error":"Team description exceed 64 character"})
-        
-        # Load user to validate admin id
+        data, error = request_schema.parse_request("create_team", request)
+        if error:
+            return error
 
-        try:
-            with open("db/user_base.json","r") as f:
-                user_data = f.read().strip()
-                users = json.loads(user_data) if user_data else []
-        except FileNotFoundError:
+        # Validate admin id and team name against the index instead of parsing the user file
+
+        index = index_store.get_index(self.layout)
+        if not storage.collection_exists(self.layout.path("users")):
             return json.dumps({"error":"UserBase not found"})
-        
-        #checks if admin id exists
 
         admin_id = data.get("admin")
-        if not any(user.get("id") == admin_id for user in users):
+        if admin_id not in index.user_by_id:
             return json.dumps({"error":"Admin user id does not exist"})
 
+        if data["team_name"] in index.team_by_name:
+            return json.dumps({"error":"Team Name already exists"})
+
         try:
-            with open("db/team_base.json","r")as f:
-                content = f.read().strip()
-                if content:
-                    teams = json.loads(content)
-                else:
-                    teams = []
+            teams = storage.load_collection(self.layout.path("teams"))
         except FileNotFoundError:
             teams = []
-
-        for team in teams:
-            if team["team_name"] == data["team_name"]:
-                return json.dumps({"error":"Team Name already exists"})
             
         team_id = str(uuid.uuid4())
 
@@ -68,16 +72,20 @@ class TeamBase:
             "team_name" : data["team_name"],
             "team_description" : data["team_description"],
             "admin" : admin_id,
-            "creation_time" : datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            "creation_time" : datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "members" : [],
+            "member_count" : 0
         }
         teams.append(new_team)
 
-        with open("db/team_base.json","w") as f:
-            json.dump(teams,f,indent=4)
+        storage.save_collection(self.layout.path("teams"), teams)
+        index.add_team(new_team)
+        index.synced("teams")
 
         return json.dumps({"id":team_id})
 
     # list all teams
+    @cached_response("list_teams", "teams")
     def list_teams(self) -> str:
         """
         :return: A json list with the response.
@@ -92,9 +100,7 @@ class TeamBase:
         """
         
         try:
-            with open("db/team_base.json","r") as f:
-                content = f.read().strip()
-                teams = json.loads(content) if content else []
+            teams = storage.load_collection(self.layout.path("teams"))
         except FileNotFoundError:
             teams = []
 
@@ -111,6 +117,7 @@ class TeamBase:
         return json.dumps(team_list,indent=4)
 
     # describe team
+    @cached_response("describe_team", "teams")
     def describe_team(self, request: str) -> str:
         """
         :param request: A json string with the team details
@@ -129,15 +136,12 @@ class TeamBase:
 
         """
         try:
-            request_data = json.loads(request)
-            team_id = request_data.get("id")
+            request_data, error = request_schema.parse_request("describe_team", request)
+            if error:
+                return error
+            team_id = request_data["id"]
 
-            if not team_id:
-                return json.dumps({"error": "Missing team id"})
-            
-            with open("db/team_base.json" ,"r") as f:
-                content = f.read().strip()
-                teams = json.loads(content) if content else []
+            teams = storage.load_collection(self.layout.path("teams"))
             
             for team in teams:
                 if team["id"] == team_id:
@@ -156,6 +160,7 @@ class TeamBase:
             return json.dumps({"error":"Team base file not found"})
 
     # update team
+    @storage.serialized("teams")
     def update_team(self, request: str) -> str:
         """
         :param request: A json string with the team details
@@ -176,16 +181,13 @@ class TeamBase:
             * Description can be max 128 characters
         """
         try:
-            request_data = json.loads(request)
-            team_id = request_data.get("id")
-            updated_team = request_data.get("team",{})
-
-            if not team_id:
-                return json.dumps({"error": "Missing team id"})
+            request_data, error = request_schema.parse_request("update_team", request)
+            if error:
+                return error
+            team_id = request_data["id"]
+            updated_team = request_data.get("team") or {}
             
-            with open("db/team_base.json" ,"r") as f:
-                content = f.read().strip()
-                teams = json.loads(content) if content else []
+            teams = storage.load_collection(self.layout.path("teams"))
             
             team_found = False
             for team in teams:
@@ -197,9 +199,6 @@ class TeamBase:
                     
                     if len(team["team_name"]) > 64:
                         return json.dumps({"error": "Team name exceed 64 characters"})
-                    if "description_name" in updated_team and len(updated_team["description_name"]) > 128:
-                        return json.dumps({"error": "Description name exceed 128 characters"})
-                    
                     
                     if "description_name" in updated_team:
                         team["description_name"] = updated_team["description_name"]
@@ -208,8 +207,9 @@ class TeamBase:
             if not team_found:
               return json.dumps({"error": "Team not found"})
             
-            with open("db/team_base.json","w") as f:
-                json.dump(teams,f,indent=4)
+            index = index_store.get_index(self.layout)
+            storage.save_collection(self.layout.path("teams"), teams)
+            index.synced("teams")
 
             return json.dumps({"message": "Team, updated successfully"})
         
@@ -231,47 +231,15 @@ class TeamBase:
 
         Constraint:
         * Cap the max users that can be added to 50
+        * Every user id must exist
         """
-        try:
-            request_data = json.loads(request)
-            team_id = request_data.get("id")
-            new_user_ids = request_data.get("users",[])
-
-            if not team_id:
-                return json.dumps({"error":"Missing team ID"})
-            
-            if not isinstance(new_user_ids,list) or not all(isinstance(u,str) for u in new_user_ids):
-                return json.dumps({"error":"Invalid user format.Expected a list of user IDs"})
-            
-            with open("db/team_base.json","r") as f:
-                content = f.read().strip()
-                teams = json.loads(content) if content else []
-
-            team_found  = False
-            for team in teams:
-                if team["id"] == team_id:
-                    team_found = True
-
-                    existing_member = team.get("members",[])
-                    total_users = len(set(existing_member + new_user_ids))
-
-                    if total_users > 50:
-                        return json.dumps({"error":"Cannot exceed 50 user in team"})
-                    
-                    #Remove duplicated
-                    team["members"] =list(set(existing_member + new_user_ids))
-                    break
-              
-            if not team_found:
-                return json.dumps({"error": "Team not found"})
-            
-            with open("db/team_base.json","w") as f:
-                json.dump(teams,f,indent=4)
-
-            return json.dumps({"message":"Users successfully added to team"})
-        
-        except FileNotFoundError:
-            return json.dumps({"message":"Team base file not found"})
+        request_data, error = request_schema.parse_request("add_users_to_team", request)
+        if error:
+            return error
+        error = self._update_members([{"id": request_data["id"], "add": request_data.get("users") or []}])
+        if error:
+            return error
+        return json.dumps({"message":"Users successfully added to team"})
 
     # remove users to team
     def remove_users_from_team(self, request: str):
@@ -284,52 +252,180 @@ class TeamBase:
 
         :return:
 
-        Constraint:
-        * Cap the max users that can be added to 50
+        Users that are not members of the team are ignored.
         """
-        try:
-            request_data = json.loads(request)
-            team_id = request_data.get("id")
-            remove_user_ids = request_data.get("users",[])
+        request_data, error = request_schema.parse_request("remove_users_from_team", request)
+        if error:
+            return error
+        error = self._update_members([{"id": request_data["id"], "remove": request_data.get("users") or []}])
+        if error:
+            return error
+        return json.dumps({"message":"Users successfully removed from team"})
+
+    # add and remove users of several teams at once
+    def update_team_members(self, request: str):
+        """
+        :param request: A json string with the membership changes
+        {
+          "teams" : [
+            {
+              "id" : "<team_id>",
+              "add" : ["user_id 1", "user_id2"],
+              "remove" : ["user_id 3"]
+            }
+          ]
+        }
 
-            if not team_id:
-                return json.dumps({"error":"Missing team ID"})
-            
-            if not isinstance(remove_user_ids,list) or not all(isinstance(u,str) for u in remove_user_ids):
-                return json.dumps({"error":"Invalid user format.Expected a list of user IDs"})
-            
-            with open("db/team_base.json","r") as f:
-                content = f.read().strip()
-                teams = json.loads(content) if content else []
+        :return: A json string with the new member count of every team
+        {"message" : "Team members updated", "member_count" : {"<team_id>" : <count>}}
 
-            team_found  = False
-            for team in teams:
-                if team["id"] == team_id:
-                    team_found = True
+        The changes are applied all together with a single write of the team file,
+        or not at all if any of them is invalid. Within a team removals are applied
+        before additions.
 
-                    current_member = team.get("members",[])
-                    updated_members = len(set(current_member + remove_user_ids))
+        Constraint:
+        * Cap the max users of a team to 50
+        * Every added user id must exist
+        * A team can be listed once
+        """
+        request_data, error = request_schema.parse_request("update_team_members", request)
+        if error:
+            return error
+
+        seen = set()
+        for change in request_data["teams"]:
+            if change["id"] in seen:
+                return json.dumps({"error": f"Team {change['id']} is listed more than once"})
+            seen.add(change["id"])
+
+        member_count = {}
+        error = self._update_members(request_data["teams"], member_count)
+        if error:
+            return error
+        return json.dumps({"message": "Team members updated", "member_count": member_count})
+
+    @storage.serialized("teams")
+    def _update_members(self, changes, member_count=None):
+        """
+        Apply membership changes [{"id", "add", "remove"}] to their teams and persist
+        the team file once. Each change is worked out against the member sets of the
+        index, so it costs O(users added + removed) rather than O(team size).
+        :param member_count: optional dict that receives the new count of every team
+        :return: None, or a json error string if a change is invalid (nothing is written then)
+        """
+        index = index_store.get_index(self.layout)
 
-                    
-                    
-                    
-                    team["members"] = updated_members
-                    break
-              
-            if not team_found:
+        planned = []
+        for change in changes:
+            team_id = change["id"]
+            if team_id not in index.team_by_id:
                 return json.dumps({"error": "Team not found"})
-            
-            with open("db/team_base.json","w") as f:
-                json.dump(teams,f,indent=4)
 
-            return json.dumps({"message":"Users successfully removed from team"})
-        
+            members = index.team_members.get(team_id, set())
+            removed = [user_id for user_id in dict.fromkeys(change.get("remove") or []) if user_id in members]
+            removed_set = set(removed)
+
+            added = []
+            for user_id in dict.fromkeys(change.get("add") or []):
+                if user_id not in index.user_by_id:
+                    return json.dumps({"error": f"User id {user_id} does not exist"})
+                if user_id not in members or user_id in removed_set:
+                    added.append(user_id)
+
+            count = len(members) - len(removed) + len(added)
+            if count > request_schema.MAX_TEAM_MEMBERS:
+                return json.dumps({"error":"Cannot exceed 50 user in team"})
+            planned.append((team_id, added, removed_set, count))
+
+        try:
+            teams = storage.load_collection(self.layout.path("teams"))
         except FileNotFoundError:
-            return json.dumps({"message":"Team base file not found"})
+            return json.dumps({"error": "Team base file not found"})
+        teams_by_id = {team["id"]: team for team in teams}
+
+        for team_id, added, removed_set, count in planned:
+            team = teams_by_id[team_id]
+            # members written by older versions can be a bare number, the index has them as empty
+            team_members = team.get("members") if isinstance(team.get("members"), list) else []
+            if removed_set:
+                team_members = [user_id for user_id in team_members if user_id not in removed_set]
+            team_members.extend(added)
+            team["members"] = team_members
+            team["member_count"] = count
+
+        storage.save_collection(self.layout.path("teams"), teams)
+        for team_id, added, removed_set, count in planned:
+            index.remove_team_members(team_id, removed_set)
+            index.add_team_members(team_id, added)
+            if member_count is not None:
+                member_count[team_id] = count
+        index.synced("teams")
+        return None
+
+    # delete a team with its boards
+    @storage.serialized("teams", "boards")
+    def delete_team(self, request: str) -> str:
+        """
+        :param request: A json string with the team identifier
+        {
+          "id" : "<team_id>",
+          "dry_run" : <optional bool, only report what would be deleted>
+        }
 
-    
+        :return: A json string with the response
+        {
+          "message" : "Team deleted",
+          "impact" : {
+            "memberships" : <members removed>,
+            "boards" : <boards deleted, archived ones included>,
+            "tasks" : <tasks deleted with the boards>,
+            "tasks_unassigned" : <tasks of other boards assigned to the team>
+          }
+        }
+        A dry run returns {"dry_run" : true, "impact" : {...}} and changes nothing.
+
+        The users of the team are kept.
+        """
+        request_data, error = request_schema.parse_request("delete_team", request)
+        if error:
+            return error
+        team_id = request_data["id"]
+
+        index = index_store.get_index(self.layout)
+        if team_id not in index.team_by_id:
+            return json.dumps({"error": "Team not found"})
+
+        board_ids = list(index.team_boards.get(team_id, ())) + cascade.team_archived_boards(self.layout, team_id)
+        dropped = set(board_ids)
+        # tasks of older versions were assigned to a team id
+        orphaned = {task_id: None for task_id in index.extras["workload"].tasks_of(team_id)
+                    if index.task_board.get(task_id) not in dropped}
+        archived = cascade.archived_tasks_of(self.layout, team_id, exclude=dropped)
+        archived_orphaned = {board_id: dict.fromkeys(task_ids) for board_id, task_ids in archived.items()}
+        impact = {
+            "memberships": len(index.team_members.get(team_id, ())),
+            "boards": len(board_ids),
+            "tasks": cascade.count_tasks(self.layout, index, board_ids),
+            "tasks_unassigned": len(orphaned) + sum(len(tasks) for tasks in archived_orphaned.values()),
+        }
+        if request_data.get("dry_run"):
+            return json.dumps({"dry_run": True, "impact": impact})
+
+        with storage.transaction():
+            # fetched in the transaction, so a rollback also drops the index changes
+            index = index_store.get_index(self.layout)
+            teams = storage.load_collection(self.layout.path("teams"))
+            storage.save_collection(self.layout.path("teams"), [team for team in teams if team["id"] != team_id])
+            cascade.apply(self.layout, index, drop_boards=board_ids, reassign=orphaned,
+                          reassign_archived=archived_orphaned)
+            index.remove_team(team_id)
+            index.synced("teams")
+            cascade.record_tombstone(self.layout, "team", team_id, impact)
+
+        return json.dumps({"message": "Team deleted", "impact": impact})
 
     # list users of a team
+    @cached_response("list_team_users", "teams", "users")
     def list_team_users(self, request: str):
         """
         :param request: A json string with the team identifier
@@ -348,28 +444,23 @@ class TeamBase:
         """
 
         try:
-            request_data = json.loads(request)
-            team_id = request_data.get("id")
-            
+            request_data, error = request_schema.parse_request("list_team_users", request)
+            if error:
+                return error
+            team_id = request_data["id"]
 
-            if not team_id:
-                return json.dumps({"error":"Missing team ID"})
-            
             #Load Team
-            with open("db/team_base.json","r") as f:
-                content = f.read().strip()
-                teams = json.loads(content) if content else []
+            teams = storage.load_collection(self.layout.path("teams"))
 
             # Load User
-            with open("db/user_base.json","r") as f:
-                content = f.read().strip()
-                users = json.loads(content) if content else []
+            users = storage.load_collection(self.layout.path("users"))
     
             for team in teams:
                 if team["id"] == team_id:
                     member_ids = team.get("members",[])
                     if not isinstance(member_ids,list):
                         member_ids = [member_ids]
+                    member_ids = set(member_ids)
                     results = []
 
                     for user in users:
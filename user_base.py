@@ -1,19 +1,37 @@
 import json
 import uuid
 from datetime import datetime
+
+import storage
+import index_store
+import request_schema
+import cascade
+import workload_index  # registers the board index delete_user finds a user's tasks with
+from idempotency import idempotent
+from response_cache import cached_response
+
 class UserBase:
     """
     Base interface implementation for API's to manage users.
     """
 
+    def __init__(self, layout=None):
+        """
+        :param layout: storage.Layout of the collections, the db folder by default
+        """
+        self.layout = layout or storage.DEFAULT_LAYOUT
+
     # create a user
+    @storage.serialized("users")
+    @idempotent("create_user")
     def create_user(self, request: str) -> str:
         
         """
         :param request: A json string with the user details
         {
           "name" : "<user_name>",
-          "display_name" : "<display name>"
+          "display_name" : "<display name>",
+          "idempotency_key" : "<optional key, a retry with the same key returns the first response>"
         }
         :return: A json string with the response {"id" : "<user_id>"}
 
@@ -22,23 +40,19 @@ class UserBase:
             * name can be max 64 characters
             * display name can be max 64 characters
         """
-        data = json.loads(request)
-        if len(data["name"]) > 64 or len(data["display_name"]) > 64:
-            return json.dumps({"error" : "Name or Display_name exceeds 64 charchters"})
-        
+        data, error = request_schema.parse_request("create_user", request)
+        if error:
+            return error
+
+        # Uniqueness is checked against the index before touching the user file
+        index = index_store.get_index(self.layout)
+        if data["name"] in index.user_by_name:
+            return json.dumps({"errors":"Username already exists"})
+
         try:
-            with open("db/user_base.json","r")as f:
-                content = f.read().strip()
-                if content:
-                  users = json.loads(content)
-                else:
-                    users = []
+            users = storage.load_collection(self.layout.path("users"))
         except FileNotFoundError:
             users = []
-
-        for user in users:
-            if user["name"] == data["name"]:
-                return json.dumps({"errors":"Username already exists"})
             
         user_id = str(uuid.uuid4())
 
@@ -47,19 +61,21 @@ class UserBase:
             "name" : data["name"],
             "display_name" : data["display_name"],
             "creation_time" : datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "description" : data["description"]
+            "description" : data.get("description", "")
         }
 
         users.append(new_user)
 
-        with open("db/user_base.json","w") as f:
-            json.dump(users,f,indent=4)
+        storage.save_collection(self.layout.path("users"), users)
+        index.add_user(new_user)
+        index.synced("users")
 
         return json.dumps({"id":user_id})
         
     
 
     # list all users
+    @cached_response("list_users", "users")
     def list_users(self) -> str:
         """
         :return: A json list with the response
@@ -72,9 +88,7 @@ class UserBase:
         ]
         """
         try:
-            with open("db/user_base.json","r") as f:
-                content = f.read().strip()
-                users = json.loads(content) if content else []
+            users = storage.load_collection(self.layout.path("users"))
         except FileNotFoundError:
             users = []
 
@@ -108,15 +122,12 @@ class UserBase:
 
         """
         try:
-            request_data = json.loads(request)
-            user_id = request_data.get("id")
+            request_data, error = request_schema.parse_request("describe_user", request)
+            if error:
+                return error
+            user_id = request_data["id"]
 
-            if not user_id:
-                return json.dumps({"error": "Missing user id"})
-            
-            with open("db/user_base.json" ,"r") as f:
-                content = f.read().strip()
-                users = json.loads(content) if content else []
+            users = storage.load_collection(self.layout.path("users"))
             
             for user in users:
                 if user["id"] == user_id:
@@ -135,6 +146,7 @@ class UserBase:
             
 
     # update user
+    @storage.serialized("users")
     def update_user(self, request: str) -> str:
         """
         :param request: A json string with the user details
@@ -154,16 +166,13 @@ class UserBase:
             * display name can be max 128 characters
         """
         try:
-            request_data = json.loads(request)
-            user_id = request_data.get("id")
-            updated_user = request_data.get("user",{})
-
-            if not user_id:
-                return json.dumps({"error": "Missing user id"})
+            request_data, error = request_schema.parse_request("update_user", request)
+            if error:
+                return error
+            user_id = request_data["id"]
+            updated_user = request_data.get("user") or {}
             
-            with open("db/user_base.json" ,"r") as f:
-                content = f.read().strip()
-                users = json.loads(content) if content else []
+            users = storage.load_collection(self.layout.path("users"))
             
             user_found = False
             for user in users:
@@ -175,8 +184,6 @@ class UserBase:
                     
                     if len(user["name"]) > 64:
                         return json.dumps({"error": "User name exceed 64 characters"})
-                    if "display_name" in updated_user and len(updated_user["display_name"]) > 128:
-                        return json.dumps({"error": "Display name exceed 128 characters"})
                     
                     #Upadte User name
                     if "display_name" in updated_user:
@@ -186,8 +193,10 @@ class UserBase:
             if not user_found:
               return json.dumps({"error": "User not found"})
             
-            with open("db/user_base.json","w") as f:
-                json.dump(users,f,indent=4)
+            # Display names are not indexed, only the checksum has to follow the write
+            index = index_store.get_index(self.layout)
+            storage.save_collection(self.layout.path("users"), users)
+            index.synced("users")
 
             return json.dumps({"message": "User updated successfully"})
         
@@ -197,7 +206,83 @@ class UserBase:
 
 
 
-                
+    # delete a user
+    @storage.serialized("users", "teams", "boards")
+    def delete_user(self, request: str) -> str:
+        """
+        :param request: A json string with the user details
+        {
+          "id" : "<user_id>",
+          "reassign_to" : "<optional user_id, gets the tasks of the deleted user>",
+          "dry_run" : <optional bool, only report what would be deleted>
+        }
+
+        :return: A json string with the response
+        {
+          "message" : "User deleted",
+          "impact" : {
+            "memberships" : <teams left>,
+            "tasks" : <tasks of the user, archived ones included>,
+            "tasks_reassigned" : <those given to reassign_to, the others are left unassigned>
+          }
+        }
+        A dry run returns {"dry_run" : true, "impact" : {...}} and changes nothing.
+
+        Constraint:
+            * the admin of a team cannot be deleted, delete the team first
+            * without reassign_to the user's tasks are left unassigned (user_id null)
+            * reassign_to only gets the tasks of boards whose team it is a member of,
+              the tasks of other boards are left unassigned
+        """
+        request_data, error = request_schema.parse_request("delete_user", request)
+        if error:
+            return error
+        user_id = request_data["id"]
+        reassign_to = request_data.get("reassign_to")
+
+        index = index_store.get_index(self.layout)
+        if user_id not in index.user_by_id:
+            return json.dumps({"error": "User not found"})
+        admin_of = index.admin_teams.get(user_id)
+        if admin_of:
+            return json.dumps({"error": f"User is the admin of {len(admin_of)} team(s), delete them first"})
+        if reassign_to is not None and (reassign_to == user_id or reassign_to not in index.user_by_id):
+            return json.dumps({"error": "reassign_to must be another existing user"})
+
+        # every affected record comes from a reverse index, nothing is scanned
+        team_ids = set(index.user_teams.get(user_id, ()))
+        task_ids = index.extras["workload"].tasks_of(user_id)
+        archived_tasks = cascade.archived_tasks_of(self.layout, user_id)
+        reassign, reassign_archived, reassigned = cascade.reassignment(
+            self.layout, index, task_ids, archived_tasks, reassign_to)
+        impact = {"memberships": len(team_ids),
+                  "tasks": len(task_ids) + sum(len(tasks) for tasks in archived_tasks.values()),
+                  "tasks_reassigned": reassigned}
+        if request_data.get("dry_run"):
+            return json.dumps({"dry_run": True, "impact": impact})
+
+        with storage.transaction():
+            # fetched in the transaction, so a rollback also drops the index changes
+            index = index_store.get_index(self.layout)
+            users = storage.load_collection(self.layout.path("users"))
+            storage.save_collection(self.layout.path("users"), [user for user in users if user["id"] != user_id])
+            index.remove_user(user_id)
+            index.synced("users")
+
+            if team_ids:
+                teams = storage.load_collection(self.layout.path("teams"))
+                for team in teams:
+                    if team["id"] in team_ids:
+                        team["members"] = [member for member in team["members"] if member != user_id]
+                        team["member_count"] = len(team["members"])
+                        index.remove_team_members(team["id"], [user_id])
+                storage.save_collection(self.layout.path("teams"), teams)
+                index.synced("teams")
+
+            cascade.apply(self.layout, index, reassign=reassign, reassign_archived=reassign_archived)
+            cascade.record_tombstone(self.layout, "user", user_id, impact)
+
+        return json.dumps({"message": "User deleted", "impact": impact})
 
     def get_user_teams(self, request: str) -> str:
         """
@@ -216,15 +301,12 @@ class UserBase:
         ]
         """
         try:
-            request_data = json.loads(request)
-            user_id = request_data.get("id")
+            request_data, error = request_schema.parse_request("get_user_teams", request)
+            if error:
+                return error
+            user_id = request_data["id"]
 
-            if not user_id:
-                return json.dumps({"error": "Missing user id"})
-            
-            with open("db/team_base.json" ,"r") as f:
-                content = f.read().strip()
-                teams = json.loads(content) if content else []
+            teams = storage.load_collection(self.layout.path("teams"))
 
             user_team =[]
             for team in teams:
@@ -0,0 +1,142 @@
+"""
+Per-assignee task counters by status, backing ProjectBoardBase.user_workload and
+the auto_assign mode of add_task.
+
+The counters are registered as an extra board index (see index_store.py): they
+are built once, persisted in the index sidecar and updated by add_task and
+update_task_status, so a workload query never scans the boards collection.
+
+Tasks are assigned to users. Tasks of older versions hold a team id, and their
+counters are kept under that id: user_workload only reports users, and
+delete_team finds those tasks through tasks_of().
+
+least_loaded() keeps one min-heap of (open tasks, user_id) per team it was asked
+about. A counter change pushes a fresh entry onto the heaps of the user's teams;
+older entries of that user are stale and dropped when they reach the top, so a
+pick is O(log n). A heap is rebuilt when the team membership changed since it
+was built.
+"""
+import heapq
+
+import index_store
+import status_history
+from request_schema import TASK_STATUSES
+
+_COMPLETE = TASK_STATUSES.index("COMPLETE")
+
+
+class WorkloadIndex:
+    """
+    counts : {user_id: [tasks per status, in TASK_STATUSES order]}
+    tasks  : {task_id: [user_id, status code]}
+    heaps  : {team_id: (membership version, [(open tasks, user_id)])}, not persisted
+    by_user: {user_id: set(task_id)}, derived from tasks on first use of tasks_of(), not persisted
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self.tasks = {}
+        self.heaps = {}
+        self.heap_teams = {}  # user_id -> team ids with a heap holding the user
+        self.by_user = None
+
+    def add_board(self, board):
+        pass
+
+    def add_task(self, board_id, team_id, task):
+        user_id = task.get("user_id")
+        code = status_history.status_code(task.get("status"))
+        if user_id is None or code is None:
+            return
+        self.tasks[task["id"]] = [user_id, code]
+        self._count(user_id, code, 1)
+        if self.by_user is not None:
+            self.by_user.setdefault(user_id, set()).add(task["id"])
+
+    def update_task(self, board_id, team_id, task):
+        self.remove_task(board_id, team_id, task)
+        self.add_task(board_id, team_id, task)
+
+    def remove_task(self, board_id, team_id, task):
+        entry = self.tasks.pop(task["id"], None)
+        if entry is None:
+            return
+        self._count(entry[0], entry[1], -1)
+        if self.by_user is not None:
+            self.by_user.get(entry[0], set()).discard(task["id"])
+
+    def tasks_of(self, user_id):
+        """:return: ids of the tasks assigned to user_id (a team id for tasks of older versions)"""
+        if self.by_user is None:
+            self.by_user = {}
+            for task_id, (assignee, _) in self.tasks.items():
+                self.by_user.setdefault(assignee, set()).add(task_id)
+        return set(self.by_user.get(user_id, ()))
+
+    def _count(self, user_id, code, delta):
+        counts = self.counts.get(user_id)
+        if counts is None:
+            counts = self.counts[user_id] = [0] * len(TASK_STATUSES)
+        counts[code] += delta
+        if not any(counts):
+            del self.counts[user_id]
+        if code != _COMPLETE:
+            entry = (self.open_tasks(user_id), user_id)
+            for team_id in self.heap_teams.get(user_id, ()):
+                heapq.heappush(self.heaps[team_id][1], entry)
+
+    def open_tasks(self, user_id):
+        """Tasks of the user that are not COMPLETE."""
+        counts = self.counts.get(user_id)
+        return 0 if counts is None else sum(counts) - counts[_COMPLETE]
+
+    def workload(self, user_id):
+        """:return: {status: count} of the user's tasks, plus "open" for the ones not COMPLETE"""
+        counts = self.counts.get(user_id) or [0] * len(TASK_STATUSES)
+        return dict(zip(TASK_STATUSES, counts), open=self.open_tasks(user_id))
+
+    def least_loaded(self, team_id, members, version):
+        """
+        :param members: the user ids of the team
+        :param version: membership version of the index, see ProjectIndex.members_version
+        :return: the member with the fewest open tasks (ties go to the smallest id), None for an empty team
+        """
+        built = self.heaps.get(team_id)
+        if built is None or built[0] != version:
+            self._build_heap(team_id, members, version)
+        heap = self.heaps[team_id][1]
+        while heap:
+            open_tasks, user_id = heap[0]
+            if open_tasks == self.open_tasks(user_id):
+                break
+            heapq.heappop(heap)
+        else:
+            return None
+        # stale entries pile up as counters move, compact once they dominate
+        if len(heap) > 4 * len(members) + 64:
+            self._build_heap(team_id, members, version)
+        return user_id
+
+    def _build_heap(self, team_id, members, version):
+        built = self.heaps.get(team_id)
+        if built is not None:
+            for _, user_id in built[1]:
+                self.heap_teams.get(user_id, set()).discard(team_id)
+        heap = [(self.open_tasks(user_id), user_id) for user_id in members]
+        heapq.heapify(heap)
+        self.heaps[team_id] = (version, heap)
+        for user_id in members:
+            self.heap_teams.setdefault(user_id, set()).add(team_id)
+
+    def to_json(self):
+        return {"counts": self.counts, "tasks": self.tasks}
+
+    @classmethod
+    def from_json(cls, data):
+        index = cls()
+        index.counts = data["counts"]
+        index.tasks = data["tasks"]
+        return index
+
+
+index_store.register_board_index("workload", WorkloadIndex)
@@ -0,0 +1,198 @@
+"""
+Workspaces: one independent planner dataset per tenant, all served by one process.
+
+A workspace lives in its own folder, <root>/<workspace_id>/, with the collections
+and side files in db/ and the exported boards in out/ (storage.workspace_layout).
+The managers of a workspace are plain UserBase/TeamBase/ProjectBoardBase objects
+bound to that layout.
+
+WorkspaceRegistry keeps the most recently used workspaces open: their index,
+status history and idempotency keys stay in memory, so a call does not reload
+them. When the estimated memory of the open workspaces goes over the budget, or
+there are more of them than max_open, the least recently used ones are closed;
+closing flushes pending saves, writes the index sidecar if it changed and drops
+every per-workspace cache. Workspaces idle for longer than max_idle_seconds are
+closed on the next registry call.
+
+    registry = WorkspaceRegistry("tenants", max_bytes=512 << 20)
+    with registry.use("acme") as workspace:
+        workspace.users.create_user(request)
+"""
+import contextlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import storage
+import index_store
+import idempotency
+import response_cache
+import status_history
+import board_archive
+import board_store
+from user_base import UserBase
+from team_base import TeamBase
+from project_board_base import ProjectBoardBase
+
+MAX_BYTES = 256 * 1024 * 1024
+MAX_OPEN = 1024
+
+# estimated bytes of one stored idempotency key and its response
+IDEMPOTENCY_ENTRY_BYTES = 512
+
+_WORKSPACE_ID = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$")
+
+
+class Workspace:
+    """
+    The managers of one workspace.
+    :param root: folder of the workspace
+    :param codec: optional encoding of the collection files, see storage.Layout
+    :param board_cache_tasks: serve the boards from a board_store.BoardStore keeping at
+                              most this many tasks in memory, None to read the whole file
+    """
+
+    def __init__(self, workspace_id, root, codec=None, board_cache_tasks=None):
+        self.workspace_id = workspace_id
+        self.root = root
+        self.layout = storage.workspace_layout(root, codec)
+        self.board_cache_tasks = board_cache_tasks
+        self.users = UserBase(self.layout)
+        self.teams = TeamBase(self.layout)
+        self.boards = ProjectBoardBase(self.layout)
+        self.last_used = time.monotonic()
+        self.in_use = 0
+        self.bytes = 0
+
+    def open(self):
+        os.makedirs(self.layout.db_dir, exist_ok=True)
+        if self.board_cache_tasks is not None:
+            board_store.enable(self.layout, max_tasks=self.board_cache_tasks)
+        index_store.get_index(self.layout)
+        self.measure()
+
+    def measure(self):
+        """:return: estimated bytes this workspace holds in memory"""
+        self.bytes = (index_store.get_index(self.layout).approx_bytes()
+                      + status_history.resident_bytes(self.layout)
+                      + IDEMPOTENCY_ENTRY_BYTES * len(idempotency.get_cache(self.layout).entries))
+        store = board_store.get_store(self.layout)
+        if store is not None:
+            self.bytes += store.cached_bytes + index_store.ENTRY_BYTES * len(store.meta)
+        return self.bytes
+
+    def close(self):
+        """Flush the workspace to disk and drop everything it holds in memory."""
+        board_store.close_store(self.layout)
+        storage.forget(self.layout)
+        index_store.close_index(self.layout)
+        status_history.close_history(self.layout)
+        idempotency.close_cache(self.layout)
+        response_cache.get_cache().drop_layout(self.layout.key)
+        board_archive.forget_archive_index(self.layout)
+
+
+class WorkspaceRegistry:
+    """
+    LRU of open workspaces under a memory budget. Safe to use from several threads.
+    :param base_dir: folder holding one sub-folder per workspace
+    :param max_bytes: memory budget of the open workspaces (estimated, see Workspace.measure)
+    :param max_open: most workspaces open at once
+    :param max_idle_seconds: close workspaces not used for this long, None to keep them
+    :param board_cache_tasks: see Workspace
+    """
+
+    def __init__(self, base_dir, max_bytes=MAX_BYTES, max_open=MAX_OPEN, max_idle_seconds=None, codec=None,
+                 board_cache_tasks=None):
+        self.base_dir = base_dir
+        self.max_bytes = max_bytes
+        self.max_open = max_open
+        self.max_idle_seconds = max_idle_seconds
+        self.codec = codec
+        self.board_cache_tasks = board_cache_tasks
+        self.open_workspaces = OrderedDict()  # workspace_id -> Workspace, least recently used first
+        self.lock = threading.RLock()
+        self.opened = 0
+        self.evictions = 0
+
+    def get(self, workspace_id):
+        """
+        :return: the open Workspace of workspace_id, opening (and creating) it if needed.
+        Raises ValueError for an id that is not a safe folder name.
+        """
+        with self.lock:
+            workspace = self._get(workspace_id)
+            self._evict()
+            return workspace
+
+    @contextlib.contextmanager
+    def use(self, workspace_id):
+        """Like get(), and the workspace is not evicted before the block ends."""
+        with self.lock:
+            workspace = self._get(workspace_id)
+            workspace.in_use += 1
+            self._evict()
+        try:
+            yield workspace
+        finally:
+            with self.lock:
+                workspace.in_use -= 1
+                workspace.last_used = time.monotonic()
+                if workspace_id in self.open_workspaces:
+                    workspace.measure()
+                self._evict()
+
+    def _get(self, workspace_id):
+        if not isinstance(workspace_id, str) or not _WORKSPACE_ID.match(workspace_id):
+            raise ValueError(f"Invalid workspace id {workspace_id!r}")
+
+        workspace = self.open_workspaces.get(workspace_id)
+        if workspace is None:
+            workspace = Workspace(workspace_id, os.path.join(self.base_dir, workspace_id), self.codec,
+                                  self.board_cache_tasks)
+            workspace.open()
+            self.open_workspaces[workspace_id] = workspace
+            self.opened += 1
+        else:
+            self.open_workspaces.move_to_end(workspace_id)
+        workspace.last_used = time.monotonic()
+        return workspace
+
+    def _evict(self):
+        now = time.monotonic()
+        total = sum(workspace.bytes for workspace in self.open_workspaces.values())
+        # the most recently used workspace is the one being served, it stays open
+        for workspace_id, workspace in list(self.open_workspaces.items())[:-1]:
+            idle = self.max_idle_seconds is not None and now - workspace.last_used > self.max_idle_seconds
+            over = total > self.max_bytes or len(self.open_workspaces) > self.max_open
+            if not (idle or over):
+                break
+            if workspace.in_use:
+                continue
+            self.close(workspace_id)
+            total -= workspace.bytes
+            self.evictions += 1
+
+    def close(self, workspace_id):
+        """Close one workspace; the next get() opens it again."""
+        with self.lock:
+            workspace = self.open_workspaces.pop(workspace_id, None)
+            if workspace is not None:
+                workspace.close()
+
+    def close_all(self):
+        with self.lock:
+            for workspace_id in list(self.open_workspaces):
+                self.close(workspace_id)
+
+    def stats(self):
+        """:return: {"open": <count>, "bytes": <estimated>, "opened": <count>, "evictions": <count>}"""
+        with self.lock:
+            return {
+                "open": len(self.open_workspaces),
+                "bytes": sum(workspace.bytes for workspace in self.open_workspaces.values()),
+                "opened": self.opened,
+                "evictions": self.evictions,
+            }